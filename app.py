@@ -1,44 +1,170 @@
+import time
+START = time.perf_counter()
+
 import sys
-import json
+import argparse
+import multiprocessing
+import threading
+from functools import partial
 from typing import Dict
 
+import numpy as np
 from PySide6 import QtCore
-from PySide6.QtWidgets import QApplication, QLabel,QWidget, QHBoxLayout, QDialog, QVBoxLayout, QDialogButtonBox, QComboBox, QPushButton, QLineEdit, QFileDialog, QListView, QStackedWidget, QSizePolicy
-from PySide6.QtCore import Qt, QSize
+from PySide6.QtWidgets import QApplication, QLabel,QWidget, QHBoxLayout, QDialog, QVBoxLayout, QDialogButtonBox, QComboBox, QPushButton, QLineEdit, QFileDialog, QListView, QStackedWidget, QSizePolicy, QFormLayout, QListWidget, QListWidgetItem, QCheckBox
+from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QStandardItemModel, QStandardItem, QIcon
-import pyvisa
 
-from instruments import Agilent8163B_GUI, Agilent8164B_GUI, AgilentE3640A_GUI
+from instruments.core import Device
+from instruments.registry import get_device_registry, get_registry
+from instruments.visa import DEFAULT_TIMEOUT, resource_manager, set_resource_manager
+from instruments.connect import connect_all
+from instruments.discovery import IdnCache, discover
+from instruments.scheduler import get_scheduler
+from instruments.metrics import get_metrics
+from instruments.session import read_session, write_session
+from instruments.plot import PlotPanel, PlotWidget
+from instruments.acquisition import Reader, SyncAcquisition
 
 class Instrument:
-    """Represents an instrument object with name and type."""
-    instrument_map = {
-        "Agilent8163B": Agilent8163B_GUI,
-        "Agilent8164B": Agilent8164B_GUI,
-        "AgilentE3640A": AgilentE3640A_GUI,
-    }
-    
-    def __init__(self, row: int, name: str, instr_type: str, rm: pyvisa.ResourceManager, active: bool=False):
+    """
+    Represents an instrument object with name and type.
+    Its panel is only built when it is first needed and can be released again
+    while the instrument is idle, keeping the address and settings to rebuild it.
+    """
+    def __init__(self, row: int, name: str, instr_type: str, active: bool=False, addr: str="", settings: Dict=None,
+                 params: Dict=None):
+        if instr_type not in get_registry():
+            raise KeyError(f"Unknown instrument type: {instr_type}")
         self.row = row
         self.id = name
         self.instr_type = instr_type
-        self._gui = self.instrument_map[instr_type](rm=rm)
         self.active = active
+        self.last_used = time.monotonic()
+        self._addr = addr
+        self._settings = settings or {}
+        self._params = params or {}
+        self._gui = None
+        # the device opened without a panel, see `open`, until the panel takes it over
+        self._device = None
 
     @property
     def gui(self):
+        if self._gui is None:
+            # the driver module is imported and VISA opened with the first instrument of a type
+            cls = get_registry().load(self.instr_type)
+            device, self._device = self._device, None
+            if device is None:
+                self._gui = cls(rm=resource_manager())
+                self._gui.device.restore(self._params)
+            else:
+                self._gui = cls(rm=resource_manager(), device=device)
+            self._gui.addr = self._addr
+            self._gui.restore_settings(self._settings)
+            self.last_used = time.monotonic()
         return self._gui
+
+    @property
+    def loaded(self) -> bool:
+        return self._gui is not None
+
+    @property
+    def device(self):
+        """The device of the instrument, whose panel may not be built."""
+        if self._gui is not None:
+            return self._gui.device
+        if self._device is None:
+            self._device = get_device_registry().load(self.instr_type)(rm=resource_manager())
+            self._device.restore(self._params)
+        return self._device
+
+    @property
+    def connected(self) -> bool:
+        if self._gui is not None:
+            return self._gui.connected
+        return self._device is not None and self._device.connected
+
+    def open(self, timeout: float=None):
+        """
+        Open the instrument and send its settings, blocking. Safe to call from
+        any thread: without a panel only the device is opened, no panel is built.
+        """
+        if self._gui is not None:
+            self._gui.open(self.addr, timeout)
+            return
+        if self.instr_type not in get_device_registry():
+            # an instrument added by another package may only come with a panel
+            raise KeyError(f"{self.instr_type} cannot be opened without its panel.")
+        device = self.device
+        device.connect(self._addr, DEFAULT_TIMEOUT if timeout is None else timeout)
+        device.initialise()
+
+    @property
+    def addr(self) -> str:
+        return self._gui.addr if self._gui is not None else self._addr
+
+    def settings(self) -> Dict:
+        return self._gui.settings() if self._gui is not None else self._settings
+
+    def params(self) -> Dict:
+        """The value of every parameter of the device."""
+        if self._gui is None and self._device is None:
+            return self._params
+        return self.device.settings()
+
+    def idle(self) -> bool:
+        """Check if the panel can be released without losing anything."""
+        gui = self._gui
+        return gui is None or not (self.active or gui.connected or gui.busy())
+
+    def release(self):
+        """Delete the panel, keeping what is needed to build it again."""
+        gui, self._gui = self._gui, None
+        if gui is None:
+            # only a removed instrument is released with its device open
+            device, self._device = self._device, None
+            if device is not None:
+                self._params = device.settings()
+                device.close()
+            return
+        self._addr = gui.addr
+        self._settings = gui.settings()
+        self._params = gui.device.settings()
+        gui.delete()
+        gui.deleteLater()
     
     def to_dict(self):
-        """Convert instrument object to dictionary for saving."""
-        return {"row": self.row, "id": self.id, "type": self.instr_type, "addr": self._gui.addr}
+        """Convert instrument object to dictionary for saving, see `instruments.session`."""
+        return {"id": self.id, "type": self.instr_type, "addr": self.addr, "settings": self.settings(),
+                "params": self.params()}
 
     @classmethod
-    def from_dict(cls, data: Dict, rm: pyvisa.ResourceManager):
+    def from_dict(cls, data: Dict, row: int):
         """Create an Instrument object from a dictionary."""
-        instr = cls(data["row"], data["id"], data["type"], rm=rm, active=False)
-        instr.gui.addr = data["addr"]
-        return instr
+        return cls(row, data["id"], data["type"], active=False, addr=data["addr"],
+                   settings=data.get("settings"), params=data.get("params"))
+
+    def matches(self, data: Dict) -> bool:
+        """Check if `data` describes this instrument, so it can be restored in place."""
+        return data["id"] == self.id and data["type"] == self.instr_type and data["addr"] == self.addr
+
+    def restore(self, data: Dict):
+        """
+        Take the settings of `data`. A connected instrument is only sent the
+        parameters that differ from what it holds, as one compound transaction.
+        """
+        if self._gui is None:
+            self._settings = data.get("settings") or {}
+            self._params = data.get("params") or {}
+            if self._device is not None:
+                self._device.apply(self._params)
+            return
+        gui = self._gui
+        gui.device.restore(data.get("params") or {})
+        gui.restore_settings(data.get("settings") or {})
+        if gui.connected:
+            # the cache of the command queue drops the writes that change nothing
+            with gui.commands.batch("restore"):
+                gui.apply_settings()
 
 
 class InstrSelectionDialog(QDialog):
@@ -58,7 +184,7 @@ class InstrSelectionDialog(QDialog):
 
         # Dropdown with instrument choices
         self.combo_box = QComboBox()
-        self.combo_box.addItems(["Agilent8163B", "Agilent8164B", "AgilentE3640A"])
+        self.combo_box.addItems(get_registry().names())
         layout.addWidget(QLabel("Choose an instrument:"))
         layout.addWidget(self.combo_box)
         
@@ -77,15 +203,285 @@ class InstrSelectionDialog(QDialog):
         return name, instrument_type
     
 
+class DiscoveryDialog(QDialog):
+    """Scan the VISA resources and pick the instruments found to add to the list."""
+    scan_progress = Signal(int, int)
+    scan_done = Signal(list)
+    scan_failed = Signal(str)
+
+    def __init__(self, known: set, skip: set=(), parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Find Instruments")
+        self.setStyleSheet("font-size: 14px;")
+        self.known = known
+        self.skip = skip
+        self.cache = IdnCache()
+
+        layout = QVBoxLayout(self)
+        self.found = QListWidget(parent=self)
+        layout.addWidget(self.found)
+        self.status = QLabel(parent=self)
+        layout.addWidget(self.status)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.rescan_button = button_box.addButton("Rescan", QDialogButtonBox.ButtonRole.ActionRole)
+        self.rescan_button.clicked.connect(lambda: self.scan(refresh=True))
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+        self.scan_progress.connect(self.on_progress)
+        self.scan_done.connect(self.on_done)
+        self.scan_failed.connect(self.on_failed)
+        self.scan()
+
+    def scan(self, refresh: bool=False):
+        """Scan in the background, probing only the resources not cached unless `refresh`."""
+        self.rescan_button.setEnabled(False)
+        self.status.setText("Scanning...")
+        threading.Thread(target=self._scan, args=(refresh,), name="discovery", daemon=True).start()
+
+    def _scan(self, refresh: bool):
+        try:
+            found = discover(resource_manager(), self.cache, skip=self.skip, refresh=refresh,
+                             on_progress=self.scan_progress.emit)
+        except Exception as e:
+            self.scan_failed.emit(str(e))
+            return
+        self.scan_done.emit(found)
+
+    @QtCore.Slot(int, int)
+    def on_progress(self, done: int, total: int):
+        self.status.setText(f"Probing {done}/{total}")
+
+    @QtCore.Slot(list)
+    def on_done(self, found: list):
+        """List the resources, checking the ones of a known type that are not added yet."""
+        self.rescan_button.setEnabled(True)
+        self.found.clear()
+        for result in sorted(found, key=lambda result: result.resource):
+            if result.instr_type is not None:
+                text = f"{result.resource}: {result.instr_type}"
+            elif result.idn is not None:
+                text = f"{result.resource}: unknown ({result.idn})"
+            else:
+                text = f"{result.resource}: no answer"
+            item = QListWidgetItem(text)
+            if result.instr_type is not None:
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                new = result.resource not in self.known
+                item.setCheckState(Qt.CheckState.Checked if new else Qt.CheckState.Unchecked)
+                item.setData(Qt.ItemDataRole.UserRole, (result.resource, result.instr_type))
+            else:
+                item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEnabled)
+            self.found.addItem(item)
+        self.status.setText(f"Found {sum(result.instr_type is not None for result in found)} "
+                            f"known instruments out of {len(found)} resources")
+
+    @QtCore.Slot(str)
+    def on_failed(self, error: str):
+        print("Discovery issue: \n", error)
+        self.rescan_button.setEnabled(True)
+        self.status.setText("Scan failed")
+
+    def selected(self) -> list:
+        """The (address, instrument type) of every checked resource."""
+        selected = []
+        for i in range(self.found.count()):
+            item = self.found.item(i)
+            if item.checkState() == Qt.CheckState.Checked and item.data(Qt.ItemDataRole.UserRole):
+                selected.append(item.data(Qt.ItemDataRole.UserRole))
+        return selected
+
+
+class SyncDialog(QDialog):
+    """Step a setting of one instrument while reading the others on a common timebase."""
+    acquisition_done = Signal(object)
+    acquisition_failed = Signal(str)
+    fields = {
+        "start": ("Start: ", "0"),
+        "stop": ("Stop: ", "1"),
+        "step": ("Step: ", "0.1"),
+        "settle": ("Settling time [s]: ", "0.1"),
+        "samples": ("Samples per step: ", "1"),
+    }
+
+    def __init__(self, instrs: list, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Synchronised acquisition")
+        self.setStyleSheet("font-size: 14px;")
+        self.instrs = instrs
+        self.acquisition = None
+        self.result = None
+        self.stepper = None
+
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.target = QComboBox(parent=self)
+        for instr in instrs:
+            for name in instr.gui.step_targets:
+                self.target.addItem(f"{instr.id}: {name}", (instr, name))
+        form.addRow("Step: ", self.target)
+        self.edits = {}
+        for key, (label, default) in self.fields.items():
+            self.edits[key] = QLineEdit(default, parent=self)
+            form.addRow(label, self.edits[key])
+        layout.addLayout(form)
+
+        layout.addWidget(QLabel("Read:"))
+        self.reads = QListWidget(parent=self)
+        for instr in instrs:
+            for name, var in instr.gui.read_vars.items():
+                item = QListWidgetItem(f"{instr.id}: {name}")
+                item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+                item.setCheckState(Qt.CheckState.Checked)
+                item.setData(Qt.ItemDataRole.UserRole, (instr, var))
+                self.reads.addItem(item)
+        layout.addWidget(self.reads)
+
+        buttons = QHBoxLayout()
+        self.run_button = QPushButton("Run", parent=self)
+        self.run_button.clicked.connect(self.start)
+        self.abort_button = QPushButton("Abort", parent=self)
+        self.abort_button.clicked.connect(self.abort)
+        self.abort_button.setEnabled(False)
+        self.save_button = QPushButton("Save CSV", parent=self)
+        self.save_button.clicked.connect(self.save)
+        self.save_button.setEnabled(False)
+        self.status = QLabel(parent=self)
+        buttons.addWidget(self.run_button)
+        buttons.addWidget(self.abort_button)
+        buttons.addWidget(self.save_button)
+        buttons.addWidget(self.status, 1)
+        layout.addLayout(buttons)
+
+        self.plot = PlotWidget(parent=self, time_axis=False)
+        layout.addWidget(self.plot, 1)
+
+        self.acquisition_done.connect(self.on_done)
+        self.acquisition_failed.connect(self.on_failed)
+
+    def readers(self) -> list:
+        """A reader for every checked variable, under the lock of its instrument."""
+        readers = []
+        for i in range(self.reads.count()):
+            item = self.reads.item(i)
+            if item.checkState() != Qt.CheckState.Checked:
+                continue
+            instr, var = item.data(Qt.ItemDataRole.UserRole)
+            readers.append(Reader(item.text(), var.get_value, lock=instr.gui.commands.lock))
+        return readers
+
+    def running(self, state: bool):
+        """Enable the controls that apply to a running or stopped acquisition."""
+        self.run_button.setEnabled(not state)
+        self.abort_button.setEnabled(state)
+        self.save_button.setEnabled(not state and self.result is not None)
+        if state:
+            self.status.setText("Acquiring...")
+
+    @QtCore.Slot()
+    def start(self):
+        """Start the acquisition in a background thread."""
+        if self.target.currentData() is None:
+            print("Acquisition issue: \n", "No instrument has a setting that can be stepped.")
+            return
+        instr, name = self.target.currentData()
+        key, step = instr.gui.step_targets[name]
+        try:
+            params = {field: float(edit.text()) for field, edit in self.edits.items()}
+            if params["step"] == 0 or (params["stop"] - params["start"]) * params["step"] < 0:
+                raise ValueError("The step must go from the start towards the stop value.")
+            setpoints = np.arange(params["start"], params["stop"] + params["step"] / 2, params["step"])
+            self.acquisition = SyncAcquisition(step, setpoints, self.readers(), settle=params["settle"],
+                                               samples=int(params["samples"]), step_lock=instr.gui.commands.lock)
+        except ValueError as e:
+            print("Acquisition issue: \n", e)
+            return
+
+        self.stepper = (instr, key)
+        self.result = None
+        self.plot.clear()
+        for reader in self.acquisition.readers:
+            self.plot.add_trace(reader.name, self.acquisition.trace(reader.name))
+        self.running(True)
+        threading.Thread(target=self._run, args=(self.acquisition,), name="acquisition", daemon=True).start()
+
+    def _run(self, acquisition: SyncAcquisition):
+        try:
+            self.acquisition_done.emit(acquisition.run())
+        except Exception as e:
+            self.acquisition_failed.emit(str(e))
+
+    @QtCore.Slot()
+    def abort(self):
+        """Abort the running acquisition."""
+        if self.acquisition is not None:
+            self.acquisition.abort()
+
+    def reject(self):
+        self.abort()
+        super().reject()
+
+    @QtCore.Slot(object)
+    def on_done(self, result):
+        """Show the timing of the acquisition."""
+        self.result = result
+        jitter = result.jitter()
+        self.status.setText(f"{len(result)} rows, jitter {jitter['mean'] * 1E3:.2f} ms "
+                            f"(max {jitter['max'] * 1E3:.2f} ms)")
+        self.finish()
+
+    @QtCore.Slot(str)
+    def on_failed(self, error: str):
+        print("Acquisition issue: \n", error)
+        self.result = self.acquisition.result()
+        self.status.setText(f"Stopped after {len(self.result)} rows")
+        self.finish()
+
+    def finish(self):
+        """Forget the stepped setting since it was written behind the panel's back."""
+        instr, key = self.stepper
+        instr.gui.commands.cache.invalidate(key)
+        self.running(False)
+        self.plot.update()
+
+    @QtCore.Slot()
+    def save(self):
+        """Save the result to a CSV file."""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Acquisition", "", "CSV Files (*.csv)")
+        if not file_path:
+            return
+        self.result.to_csv(file_path)
+
+
 class MyMainWidget(QWidget):
     """ Main widget for the application."""
+    connect_progress = Signal(int, int, str)
+    connect_done = Signal(int, list, float)
+    # panels not shown for this long are released while idle
+    idle_timeout = 60.0
+    # seconds each instrument has to answer, and how many are opened at once
+    connect_timeout = DEFAULT_TIMEOUT
+    max_connections = 8
+    # port of the control server, see `ControlServer`
+    server_port = 8765
+    # seconds between writes of the metrics file, see `export_metrics`
+    metrics_interval = 15.0
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Instrument controller")
         self.setStyleSheet("font-size: 14px;")
         self.layout = QHBoxLayout(self)
-        self.rm = pyvisa.ResourceManager()
-        self.instrs = []
+        # by name, in the order they were added
+        self.instrs = {}
+        self.overlay = None
+        self.diagnostics = None
+        self.server = None
+        self.recorder = None
+        self.record_dir = None
+        self.metrics_path = None
         
         self.icon = QIcon()
         self.icon.addFile("owl.png")
@@ -114,8 +510,24 @@ class MyMainWidget(QWidget):
         self.load_button = QPushButton("Load", parent=self)
         self.load_button.clicked.connect(self.load_state)
         button_layout.addWidget(self.load_button)
+
+        self.plot_button = QPushButton("Plot", parent=self)
+        self.plot_button.clicked.connect(self.show_overlay)
+        button_layout.addWidget(self.plot_button)
+
+        self.sync_button = QPushButton("Sync", parent=self)
+        self.sync_button.clicked.connect(self.show_sync_dialog)
+        button_layout.addWidget(self.sync_button)
+
+        self.diagnostics_button = QPushButton("Diagnostics", parent=self)
+        self.diagnostics_button.clicked.connect(self.show_diagnostics)
+        button_layout.addWidget(self.diagnostics_button)
         button_layout.addStretch()
 
+        self.find_button = QPushButton("Find", parent=self)
+        self.find_button.clicked.connect(self.show_discovery_dialog)
+        button_layout.addWidget(self.find_button)
+
         self.add_button = QPushButton("+", parent=self)
         self.add_button.clicked.connect(self.show_add_dialog)
         button_layout.addWidget(self.add_button)
@@ -125,14 +537,38 @@ class MyMainWidget(QWidget):
         button_layout.addWidget(self.remove_button)
         
         self.select_layout.addLayout(button_layout)
+
+        connect_layout = QHBoxLayout()
+        self.connect_button = QPushButton("Connect all", parent=self)
+        self.connect_button.clicked.connect(self.connect_all)
+        connect_layout.addWidget(self.connect_button)
+        self.auto_connect = QCheckBox("Connect on load", parent=self)
+        connect_layout.addWidget(self.auto_connect)
+        connect_layout.addStretch()
+        self.serve_box = QCheckBox("Remote control", parent=self)
+        self.serve_box.toggled.connect(self.serve)
+        connect_layout.addWidget(self.serve_box)
+        self.record_box = QCheckBox("Record", parent=self)
+        self.record_box.toggled.connect(self.record)
+        connect_layout.addWidget(self.record_box)
+        self.select_layout.addLayout(connect_layout)
+        self.connect_progress.connect(self.on_connect_progress)
+        self.connect_done.connect(self.on_connect_done)
+
+        self.status = QLabel(parent=self)
+        self.select_layout.addWidget(self.status)
         self.layout.addWidget(self.select_container)
 
         # Stacked widget for instrument GUIs
         self.instr_stack = QStackedWidget(self)
         self.instr_stack.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        placeholder = QLabel("No Instrument Selected")
-        placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.instr_stack.addWidget(placeholder)
+        self.placeholder = QLabel("No Instrument Selected")
+        self.placeholder.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.instr_stack.addWidget(self.placeholder)
+
+        self.release_timer = QtCore.QTimer(self)
+        self.release_timer.timeout.connect(self.release_idle)
+        self.release_timer.start(int(self.idle_timeout * 1E3 / 4))
         
         self.layout.addWidget(self.instr_stack)
         self.layout.setStretch(0, 1)
@@ -141,8 +577,36 @@ class MyMainWidget(QWidget):
 
     @QtCore.Slot()
     def on_instrument_selected(self, index):
-        """Show the GUI for the selected instrument."""
-        self.instr_stack.setCurrentIndex(index.row()+1)
+        """Show the GUI for the selected instrument, building it on first selection."""
+        self.show_panel(self.model.itemFromIndex(index).data(Qt.ItemDataRole.UserRole))
+
+    def show_panel(self, instr: Instrument):
+        """Put the panel of an instrument on the stack and show it."""
+        loaded = get_registry().is_loaded(instr.instr_type)
+        gui = instr.gui
+        if not loaded:
+            load_time = get_registry().load_times[instr.instr_type]
+            self.status.setText(f"Loaded {instr.instr_type} in {load_time * 1E3:.0f} ms")
+        if self.instr_stack.indexOf(gui) < 0:
+            self.instr_stack.addWidget(gui)
+        self.instr_stack.setCurrentWidget(gui)
+
+    @QtCore.Slot()
+    def release_idle(self):
+        """Release the panels that are idle and have not been shown for a while."""
+        now = time.monotonic()
+        current = self.instr_stack.currentWidget()
+        for instr in self.loaded():
+            if instr.gui is current:
+                instr.last_used = now
+            elif instr.idle() and now - instr.last_used > self.idle_timeout:
+                self.release_panel(instr)
+
+    def release_panel(self, instr: Instrument):
+        """Take the panel of an instrument off the stack and delete it."""
+        if instr.loaded:
+            self.instr_stack.removeWidget(instr.gui)
+        instr.release()
 
 
     @QtCore.Slot()
@@ -152,19 +616,34 @@ class MyMainWidget(QWidget):
         if dialog.exec():  # If the user presses OK
             name, instr_type = dialog.get_selected_instrument()
             uuid = self.get_unique_name(name)
-            instr = Instrument(self.model.rowCount(), uuid, instr_type, rm=self.rm, active=False)
+            instr = Instrument(self.model.rowCount(), uuid, instr_type, active=False)
             self.add_instrument_to_list(instr)
 
 
+    @QtCore.Slot()
+    def show_discovery_dialog(self):
+        """Find the instruments on the bus and add the selected ones."""
+        known = {instr.addr for instr in self.instrs.values()}
+        # the connected instruments are not probed again while in use
+        connected = {instr.addr for instr in self.instrs.values() if instr.connected}
+        dialog = DiscoveryDialog(known, skip=connected, parent=self)
+        if dialog.exec():
+            for addr, instr_type in dialog.selected():
+                uuid = self.get_unique_name(instr_type)
+                self.add_instrument_to_list(Instrument(self.model.rowCount(), uuid, instr_type, addr=addr))
+
+
     @QtCore.Slot()
     def remove_instrument(self):
         """Remove the selected instrument from the list."""
         selected_indexes = self.list_view.selectedIndexes()
-        if selected_indexes:
-            index = selected_indexes[0]  # Get the first selected index
-            self.model.removeRow(index.row())  # Remove the row from the model
-        instr = self.instrs.pop([i for i, obj in enumerate(self.instrs) if obj.row == index.row()][0])
-        instr.gui.delete()
+        if not selected_indexes:
+            return
+        index = selected_indexes[0]  # Get the first selected index
+        instr = self.model.itemFromIndex(index).data(Qt.ItemDataRole.UserRole)
+        self.model.removeRow(index.row())  # Remove the row from the model
+        self.instrs.pop(instr.id)
+        self.release_panel(instr)
 
 
     @QtCore.Slot()
@@ -175,8 +654,7 @@ class MyMainWidget(QWidget):
         item.setCheckState(Qt.CheckState.Unchecked if not instr.active else Qt.CheckState.Checked)
         item.setData(instr, Qt.ItemDataRole.UserRole)
         self.model.appendRow(item)
-        self.instr_stack.addWidget(instr.gui)
-        self.instrs.append(instr)
+        self.instrs[instr.id] = instr
 
     @QtCore.Slot()
     def handle_checkbox_toggle(self, item):
@@ -184,12 +662,159 @@ class MyMainWidget(QWidget):
         instr = item.data(Qt.ItemDataRole.UserRole)
         if instr:
             instr.active = item.checkState() == Qt.CheckState.Checked
-            instr.gui.state(instr.active)
+            if instr.active or instr.loaded:
+                instr.gui.state(instr.active)
+
+
+    @QtCore.Slot()
+    def show_overlay(self):
+        """Show the readings of every instrument on one plot."""
+        if self.overlay is None:
+            self.overlay = PlotPanel()
+            self.overlay.setWindowTitle("All readings")
+            self.overlay.setWindowIcon(self.icon)
+            self.overlay.resize(900, 500)
+
+        self.overlay.clear()
+        # a panel that was never built has no readings
+        for instr in self.loaded():
+            for name, var in instr.gui.read_vars.items():
+                self.overlay.add_trace(f"{instr.id}: {name}", var.history)
+        self.overlay.show()
+
+
+    @QtCore.Slot()
+    def show_sync_dialog(self):
+        """Show the dialog of a synchronised acquisition across the instruments."""
+        dialog = SyncDialog(self.loaded(), parent=self)
+        dialog.setWindowIcon(self.icon)
+        dialog.resize(700, 700)
+        dialog.exec()
+
 
+    @QtCore.Slot()
+    def show_diagnostics(self):
+        """Show the timing of the SCPI commands and the polling."""
+        if self.diagnostics is None:
+            from instruments.diagnostics import DiagnosticsPanel
+            self.diagnostics = DiagnosticsPanel()
+            self.diagnostics.setWindowTitle("Diagnostics")
+            self.diagnostics.setWindowIcon(self.icon)
+            self.diagnostics.resize(900, 500)
+        self.diagnostics.show()
+        self.diagnostics.refresh()
+
+    def export_metrics(self, path: str):
+        """Write the metrics to `path` now and then, for a Prometheus textfile collector."""
+        self.metrics_path = path
+        self.metrics_timer = QtCore.QTimer(self)
+        self.metrics_timer.timeout.connect(self.write_metrics)
+        self.metrics_timer.start(int(self.metrics_interval * 1E3))
+
+    @QtCore.Slot()
+    def write_metrics(self):
+        try:
+            get_metrics().write(self.metrics_path, get_scheduler().stats())
+        except OSError as e:
+            print("Metrics export issue: \n", e)
+
+    def report_startup(self):
+        """Show how long the app took from being started to being shown."""
+        elapsed = time.perf_counter() - START
+        self.status.setText(f"Started in {elapsed * 1E3:.0f} ms")
+
+
+    @QtCore.Slot()
+    def connect_all(self):
+        """Open every instrument that has an address and is not connected, all at once."""
+        jobs = {}
+        for instr in self.instrs.values():
+            # the panels are not built for this, only the devices are opened
+            if instr.addr and not instr.connected:
+                jobs[instr.id] = partial(instr.open, self.connect_timeout)
+        if not jobs:
+            return
+        self.connect_button.setEnabled(False)
+        self.status.setText(f"Connecting 0/{len(jobs)}")
+        threading.Thread(target=self._connect_all, args=(jobs,), name="connect-all", daemon=True).start()
+
+    def _connect_all(self, jobs: Dict):
+        start = time.perf_counter()
+        results = connect_all(jobs, max_workers=self.max_connections,
+                              on_progress=lambda done, total, result: self.connect_progress.emit(done, total, result.name))
+        failed = [name for name, result in results.items() if not result.ok]
+        self.connect_done.emit(len(results) - len(failed), failed, time.perf_counter() - start)
+
+    @QtCore.Slot(int, int, str)
+    def on_connect_progress(self, done: int, total: int, name: str):
+        self.status.setText(f"Connecting {done}/{total} ({name})")
+
+    @QtCore.Slot(int, list, float)
+    def on_connect_done(self, connected: int, failed: list, duration: float):
+        """Report how many instruments were opened and which ones failed."""
+        self.connect_button.setEnabled(True)
+        text = f"Connected {connected}/{connected + len(failed)} in {duration:.1f} s"
+        if failed:
+            text += "\nFailed: " + ", ".join(failed)
+        self.status.setText(text)
+
+    @QtCore.Slot(bool)
+    def serve(self, state: bool):
+        """Start/stop serving the connected instruments to other processes."""
+        if not state:
+            if self.server is not None:
+                self.server.stop()
+                self.server = None
+            return
+        # the server module is only imported once it is used
+        from instruments.server import ControlServer
+        try:
+            self.server = ControlServer(self.devices, port=self.server_port)
+            self.server.start()
+        except OSError as e:
+            print("Control server issue: \n", e)
+            self.server = None
+            self.serve_box.setChecked(False)
+            return
+        self.status.setText(f"Serving on port {self.server.port}")
+
+    @QtCore.Slot(bool)
+    def record(self, state: bool):
+        """Start/stop streaming the readings of every instrument to Parquet files."""
+        if not state:
+            if self.recorder is not None:
+                self.recorder.stop()
+                stats = self.recorder.stats()
+                self.status.setText(f"Recorded {stats['rows']} readings to {stats['files']} files")
+                self.recorder = None
+            return
+        directory = self.record_dir or QFileDialog.getExistingDirectory(self, "Record to")
+        if not directory:
+            self.record_box.setChecked(False)
+            return
+        # the recorder module is only imported once it is used
+        from instruments.recorder import Recorder
+        try:
+            self.recorder = Recorder(self.devices, directory)
+            self.recorder.start()
+        except (ImportError, OSError) as e:
+            print("Recording issue: \n", e)
+            self.recorder = None
+            self.record_box.setChecked(False)
+            return
+        self.status.setText(f"Recording to {directory}")
+
+    def devices(self) -> Dict:
+        """The devices of the instruments whose panels are built or that are open, by name, for the control server and recorder."""
+        return {instr.id: instr.device for instr in list(self.instrs.values()) if instr.loaded or instr.connected}
+
+    def loaded(self) -> list:
+        """The instruments whose panels are built."""
+        return [instr for instr in self.instrs.values() if instr.loaded]
 
     def get_unique_name(self, name):
         """Ensure the name is unique by appending a number if necessary."""
-        existing_names = [self.model.item(i).text() for i in range(self.model.rowCount())]
+        existing_names = self.instrs
 
         if name not in existing_names:
             return name
@@ -203,6 +828,23 @@ class MyMainWidget(QWidget):
 
         return new_name
     
+    def ordered(self) -> list:
+        """The instruments in the order of the list, with their rows updated."""
+        instrs = []
+        for row in range(self.model.rowCount()):
+            instr = self.model.item(row).data(Qt.ItemDataRole.UserRole)
+            instr.row = row
+            instrs.append(instr)
+        return instrs
+
+    def clear_instruments(self):
+        """Remove every instrument and delete their panels."""
+        self.instr_stack.setCurrentWidget(self.placeholder)
+        for instr in self.instrs.values():
+            self.release_panel(instr)
+        self.instrs.clear()
+        self.model.clear()
+
     def save_state(self):
         """Save the window state and list to a JSON file."""
         file_path, _ = QFileDialog.getSaveFileName(self, "Save State", "", "JSON Files (*.json)")
@@ -212,11 +854,14 @@ class MyMainWidget(QWidget):
 
         state_data = {
             "window_geometry": self.geometry().getRect(),
-            "instrument_list": [i.to_dict() for i in self.instrs]
+            "auto_connect": self.auto_connect.isChecked(),
+            "instruments": [i.to_dict() for i in self.ordered()]
         }
 
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(state_data, file, indent=4)
+        try:
+            write_session(file_path, state_data)
+        except OSError as e:
+            print("Save state issue: \n", e)
     
 
     def load_state(self):
@@ -227,23 +872,81 @@ class MyMainWidget(QWidget):
             return
 
         try:
-            with open(file_path, "r") as file:
-                state_data = json.load(file)
-
-            self.model.clear()  # Clear existing data
-            for instrument_data in state_data.get("instrument_list", []):
-                instrument = Instrument.from_dict(instrument_data, rm=self.rm)
-                self.add_instrument_to_list(instrument)
+            state_data = read_session(file_path)
+            self.restore_instruments(state_data["instruments"])
+            self.auto_connect.setChecked(state_data.get("auto_connect", self.auto_connect.isChecked()))
+            if self.auto_connect.isChecked():
+                self.connect_all()
 
         except Exception as e:
             print(f"Failed to load state: {e}")
 
+    def restore_instruments(self, entries: list):
+        """
+        Make the list match the saved `entries`. The instruments already in the
+        list keep their panel and connection and are only sent the settings that
+        changed, the others are removed or added.
+        """
+        kept = {data["id"] for data in entries
+                if data["id"] in self.instrs and self.instrs[data["id"]].matches(data)}
+        instrs = []
+        for row, data in enumerate(entries):
+            if data["id"] in kept:
+                instr = self.instrs[data["id"]]
+                instr.restore(data)
+            else:
+                instr = Instrument.from_dict(data, row)
+            instrs.append(instr)
+
+        current = self.instr_stack.currentWidget()
+        for instr in self.instrs.values():
+            if instr.id not in kept:
+                if instr.loaded and instr.gui is current:
+                    self.instr_stack.setCurrentWidget(self.placeholder)
+                self.release_panel(instr)
+        self.instrs.clear()
+        self.model.clear()
+        for row, instr in enumerate(instrs):
+            instr.row = row
+            self.add_instrument_to_list(instr)
+
 
 if __name__ == "__main__":
-    app = QApplication([])
+    # the worker processes start the app again in a frozen build
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Instrument controller")
+    parser.add_argument("--sim", action="store_true", help="use simulated instruments instead of VISA")
+    parser.add_argument("--serve", type=int, nargs="?", const=MyMainWidget.server_port, metavar="PORT",
+                        help="serve the instruments to other processes on a local port")
+    parser.add_argument("--metrics", metavar="FILE", help="write the command timing to a Prometheus text file")
+    parser.add_argument("--record", metavar="DIR", help="stream the readings to Parquet files in a directory")
+    parser.add_argument("--processes", action="store_true",
+                        help="open and poll every instrument in a worker process of its own")
+    args, qt_args = parser.parse_known_args()
+    if args.sim:
+        from instruments.sim import SimResourceManager
+        set_resource_manager(SimResourceManager())
+    if args.processes:
+        Device.process = True
+
+    app = QApplication(sys.argv[:1] + qt_args)
 
     widget = MyMainWidget()
     widget.resize(800, 600)
     widget.show()
-
-    sys.exit(app.exec())
\ No newline at end of file
+    if args.metrics:
+        widget.export_metrics(args.metrics)
+    if args.serve is not None:
+        widget.server_port = args.serve
+        widget.serve_box.setChecked(True)
+    if args.record:
+        widget.record_dir = args.record
+        widget.record_box.setChecked(True)
+    # runs once the event loop has shown the window
+    QtCore.QTimer.singleShot(0, widget.report_startup)
+
+    ret = app.exec()
+    widget.serve(False)
+    widget.record(False)
+    get_scheduler().shutdown()
+    sys.exit(ret)
\ No newline at end of file
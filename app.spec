@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['instruments.aglient816xB', 'instruments.aglientE3640A', 'instruments.server', 'instruments.sim', 'instruments.diagnostics', 'instruments.worker', 'instruments.recorder'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
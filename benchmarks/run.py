@@ -0,0 +1,265 @@
+"""
+Benchmarks of the instrument stack against simulated instruments.
+
+e.g.
+    python benchmarks/run.py --instruments 8 --latency 2 --jitter 1
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+
+Each benchmark is run on a fresh simulated bench, see `instruments.sim`, and the
+results are written as JSON. The command exits with 1 if an instrument reported
+an error, or with --baseline if any result got worse than in an earlier run by
+more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from instruments.bench import Bench
+from instruments.scheduler import get_scheduler
+from instruments.sim import SimResourceManager
+
+TYPES = ("Agilent8163B", "Agilent8164B", "AgilentE3640A")
+
+# whether a larger value of a result is better, for the comparison with a baseline
+HIGHER_IS_BETTER = ("rate", "throughput")
+
+
+def summary(values) -> dict:
+    """The distribution of a set of durations in ms."""
+    values = np.asarray(values, dtype=float) * 1E3
+    if not len(values):
+        return {"n": 0}
+    return {"n": int(len(values)), "mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)), "max_ms": float(values.max())}
+
+
+def make_bench(args, n: int=None) -> Bench:
+    """A bench of `n` instruments of every type in turn on a simulated bus."""
+    n = args.instruments if n is None else n
+    instruments = {f"GPIB0::{i + 1}::INSTR": TYPES[i % len(TYPES)] for i in range(n)}
+    rm = SimResourceManager(instruments, latency=args.latency * 1E-3, jitter=args.jitter * 1E-3)
+    bench = Bench(rm=rm)
+    for i, (addr, instr_type) in enumerate(instruments.items()):
+        bench.add(f"{instr_type}-{i}", instr_type, addr, process=args.processes)
+    return bench
+
+
+def bench_connect(args) -> dict:
+    """Time to open every instrument at once, then to send all their settings."""
+    with make_bench(args) as bench:
+        start = time.perf_counter()
+        results = bench.connect(initialise=False)
+        connect = time.perf_counter() - start
+
+        durations = []
+        start = time.perf_counter()
+        for device in bench.devices.values():
+            t0 = time.perf_counter()
+            device.initialise()
+            device.wait()
+            durations.append(time.perf_counter() - t0)
+        initialise = time.perf_counter() - start
+        errors = sum(len(device.errors) for device in bench.devices.values())
+    return {"instruments": len(results), "connect_s": connect,
+            "connect_each": summary([result.duration for result in results.values()]),
+            "initialise_s": initialise, "initialise_each": summary(durations), "initialise_errors": errors}
+
+
+def bench_poll(args) -> dict:
+    """Sustained sample rate of the polling of every instrument."""
+    with make_bench(args) as bench:
+        bench.connect(initialise=False)
+        for device in bench.devices.values():
+            device.poller.set_period(args.period)
+            device.poller.start()
+        time.sleep(args.duration)
+        stats = [s for device in bench.devices.values() for s in device.poller.stats()]
+        samples = sum(s["count"] for s in stats)
+        for device in bench.devices.values():
+            device.poller.stop()
+    requested = len(stats) / args.period
+    rate = samples / args.duration
+    return {"tasks": len(stats), "period_s": args.period, "requested_rate": requested,
+            "sample_rate": rate, "rate_ratio": rate / requested if requested else 0.0,
+            "overruns": int(sum(s.get("overruns", 0) for s in stats))}
+
+
+def bench_queue(args) -> dict:
+    """Throughput of the write queue, with every write sent and with writes coalesced."""
+    with make_bench(args, n=1) as bench:
+        bench.connect(initialise=False)
+        device = next(iter(bench.devices.values()))
+        param = next(param for param in device.params.values() if param.writable)
+        commands = device.commands
+
+        start = time.perf_counter()
+        for i in range(args.writes):
+            commands.submit(None, param.setter, param.value)
+        commands.wait()
+        sent = time.perf_counter() - start
+
+        commands.sent = commands.coalesced = 0
+        start = time.perf_counter()
+        for i in range(args.writes):
+            # a slider being dragged: only the latest value has to reach the instrument
+            param.set(i)
+        commands.wait()
+        coalesced = time.perf_counter() - start
+    return {"writes": args.writes, "throughput": args.writes / sent,
+            "coalesced_throughput": args.writes / coalesced, "coalesced_sent": commands.sent}
+
+
+def bench_ui(args) -> dict:
+    """Frame time of the app with every panel built, connected and polling."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PySide6.QtCore import QTimer, QElapsedTimer
+        from PySide6.QtWidgets import QApplication
+    except ImportError as e:
+        return {"skipped": str(e)}
+    from instruments.visa import set_resource_manager
+    import app
+
+    instruments = {f"GPIB0::{i + 1}::INSTR": TYPES[i % len(TYPES)] for i in range(args.instruments)}
+    set_resource_manager(SimResourceManager(instruments, latency=args.latency * 1E-3, jitter=args.jitter * 1E-3))
+    qt_app = QApplication.instance() or QApplication([])
+    widget = app.MyMainWidget()
+    widget.resize(800, 600)
+    widget.show()
+    for row, (addr, instr_type) in enumerate(instruments.items()):
+        widget.add_instrument_to_list(app.Instrument(row, f"{instr_type}-{row}", instr_type, addr=addr))
+    for instr in widget.instrs.values():
+        widget.show_panel(instr)
+        instr.gui.read_channel.set_period(args.period)
+
+    def run_for(duration: float):
+        QTimer.singleShot(int(duration * 1E3), qt_app.quit)
+        qt_app.exec()
+
+    widget.connect_all()
+    run_for(1.0)
+    for instr in widget.instrs.values():
+        widget.model.item(instr.row).setCheckState(app.Qt.CheckState.Checked)
+
+    # a 60 Hz timer only fires late when the event loop is busy
+    frames = []
+    clock = QElapsedTimer()
+    clock.start()
+    frame_timer = QTimer()
+    frame_timer.setTimerType(app.Qt.TimerType.PreciseTimer)
+    frame_timer.timeout.connect(lambda: frames.append(clock.restart() * 1E-3))
+    frame_timer.start(16)
+    run_for(args.duration)
+    frame_timer.stop()
+    stats = [s for instr in widget.instrs.values() for s in instr.gui.read_channel.stats()]
+
+    for instr in widget.instrs.values():
+        widget.model.item(instr.row).setCheckState(app.Qt.CheckState.Unchecked)
+    widget.clear_instruments()
+    widget.close()
+    return {"instruments": len(instruments), "frame": summary(frames[1:]),
+            "sample_rate": sum(s["measured_rate"] for s in stats)}
+
+
+BENCHMARKS = {
+    "connect": bench_connect,
+    "poll": bench_poll,
+    "queue": bench_queue,
+    "ui": bench_ui,
+}
+
+
+def flatten(results: dict, prefix: str="") -> dict:
+    """The numbers of nested results by dotted name."""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def errors(results: dict) -> list:
+    """The error counts of the results that are not zero."""
+    return [f"{name}: {value}" for name, value in flatten(results["results"]).items()
+            if name.endswith("_errors") and value]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """The timings and rates that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    old = flatten(baseline["results"])
+    for name, value in flatten(results["results"]).items():
+        if not name.endswith(("_s", "_ms") + HIGHER_IS_BETTER) or name not in old or not old[name]:
+            continue
+        change = (value - old[name]) / abs(old[name])
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            regressions.append(f"{name}: {old[name]:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the instrument stack against simulated instruments.")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"the benchmarks to run out of {', '.join(BENCHMARKS)}, all by default")
+    parser.add_argument("--instruments", type=int, default=6, help="number of simulated instruments")
+    parser.add_argument("--latency", type=float, default=2.0, help="time of every transaction in ms")
+    parser.add_argument("--jitter", type=float, default=1.0, help="most extra time of a transaction in ms")
+    parser.add_argument("--period", type=float, default=0.05, help="polling period in s")
+    parser.add_argument("--duration", type=float, default=3.0, help="time the sustained benchmarks run for in s")
+    parser.add_argument("--processes", action="store_true", help="run every instrument in a worker process")
+    parser.add_argument("--writes", type=int, default=500, help="writes queued by the queue benchmark")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "results.json"),
+                        help="the JSON file to write the results to")
+    parser.add_argument("--baseline", help="an earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="the relative change counted as a regression")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(),
+                 "params": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}},
+        "results": {},
+    }
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"Running {name}...")
+        start = time.perf_counter()
+        results["results"][name] = BENCHMARKS[name](args)
+        print(json.dumps(results["results"][name], indent=4))
+        print(f"{name} took {time.perf_counter() - start:.1f} s")
+    get_scheduler().shutdown()
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results written to {args.output}")
+
+    failed = errors(results)
+    if failed:
+        print("Errors:\n  " + "\n  ".join(failed))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
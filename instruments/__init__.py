@@ -1,2 +1,17 @@
-from .aglient816xB import Agilent8164B_GUI, Agilent8163B_GUI
-from .aglientE3640A import AgilentE3640A_GUI
\ No newline at end of file
+from importlib import import_module
+
+# the GUIs pull in their pyoctal drivers, so they are imported on first access
+_lazy = {
+    "Agilent8163B_GUI": ".aglient816xB",
+    "Agilent8164B_GUI": ".aglient816xB",
+    "AgilentE3640A_GUI": ".aglientE3640A",
+}
+
+__all__ = list(_lazy)
+
+def __getattr__(name: str):
+    if name in _lazy:
+        value = getattr(import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,158 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from instruments.history import timestamp
+from instruments.sweep import SweepAborted
+
+
+class Reader:
+    """A read of one instrument, taken under the lock that guards its bus."""
+    def __init__(self, name: str, func, lock=None):
+        self.name = name
+        self.func = func
+        self.lock = lock
+
+    def read(self, barrier: threading.Barrier=None):
+        """Read the value, returning it with the timestamp of the middle of the read."""
+        if barrier is not None:
+            # release every reader of the step at the same moment
+            barrier.wait()
+        with self.lock if self.lock is not None else nullcontext():
+            start = timestamp()
+            value = self.func()
+            end = timestamp()
+        return value, (start + end) / 2, end - start
+
+
+class AcquisitionResult:
+    """Columns of a synchronised acquisition, all on the timebase of `history.timestamp`."""
+    def __init__(self, columns: dict):
+        self.columns = columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __len__(self):
+        return len(self.columns["setpoint"])
+
+    @property
+    def readers(self) -> list:
+        return [name for name in self.columns if name != "setpoint" and f"t {name}" in self.columns]
+
+    def jitter(self) -> dict:
+        """
+        The spread of the read timestamps within each step, i.e. how far apart in
+        time the instruments were sampled for the same point.
+        """
+        times = np.column_stack([self.columns[f"t {name}"] for name in self.readers])
+        spread = np.nanmax(times, axis=1) - np.nanmin(times, axis=1) if times.size else np.zeros(0)
+        if not len(spread):
+            return {"mean": 0.0, "max": 0.0, "std": 0.0}
+        return {"mean": float(np.nanmean(spread)), "max": float(np.nanmax(spread)),
+                "std": float(np.nanstd(spread))}
+
+    def to_csv(self, path: str):
+        """Save the columns to a CSV file."""
+        names = list(self.columns)
+        np.savetxt(path, np.column_stack([self.columns[name] for name in names]),
+                   delimiter=",", header=",".join(names), comments="")
+
+
+class SyncAcquisition:
+    """
+    Step one instrument and read the others at every step on a common timebase.
+
+    At each setpoint the stepper is written, the settling time is waited for, and
+    then every reader is triggered at once from its own worker, so a step takes
+    as long as the slowest read rather than the sum of all of them.
+
+    Parameters
+    ----------
+    step: callable
+        Called with each setpoint, e.g. the driver's set_volt
+    setpoints: array
+        The values to step through
+    readers: list of Reader
+        The reads to take at every step
+    settle: float
+        The time to wait after each step in s
+    samples: int
+        The number of reads per step
+    step_lock:
+        The lock guarding the bus of the stepped instrument
+    """
+    def __init__(self, step, setpoints, readers: list, settle: float=0.0, samples: int=1, step_lock=None):
+        if not readers:
+            raise ValueError("At least one instrument must be read.")
+        names = [reader.name for reader in readers]
+        if len(set(names)) != len(names):
+            raise ValueError("The readers must have unique names.")
+        self.step = step
+        self.step_lock = step_lock
+        self.setpoints = np.asarray(setpoints, dtype=float)
+        self.readers = readers
+        self.settle = settle
+        self.samples = samples
+        self.cancel = threading.Event()
+        self.count = 0
+
+        rows = len(self.setpoints) * samples
+        self.columns = {"setpoint": np.full(rows, np.nan), "t setpoint": np.full(rows, np.nan)}
+        for name in names:
+            self.columns[name] = np.full(rows, np.nan)
+            self.columns[f"t {name}"] = np.full(rows, np.nan)
+            self.columns[f"dt {name}"] = np.full(rows, np.nan)
+
+    def abort(self):
+        """Ask the acquisition to stop before the next step."""
+        self.cancel.set()
+
+    def run(self) -> AcquisitionResult:
+        """Run the acquisition and return the filled columns."""
+        self.cancel.clear()
+        self.count = 0
+        columns = self.columns
+        with ThreadPoolExecutor(max_workers=len(self.readers), thread_name_prefix="acquire") as pool:
+            for setpoint in self.setpoints:
+                if self.cancel.is_set():
+                    raise SweepAborted("The acquisition was aborted.")
+                with self.step_lock if self.step_lock is not None else nullcontext():
+                    self.step(setpoint)
+                t_set = timestamp()
+                if self.cancel.wait(max(0.0, t_set + self.settle - timestamp())):
+                    raise SweepAborted("The acquisition was aborted.")
+
+                for _ in range(self.samples):
+                    row = self.count
+                    barrier = threading.Barrier(len(self.readers))
+                    futures = [pool.submit(reader.read, barrier) for reader in self.readers]
+                    columns["setpoint"][row] = setpoint
+                    columns["t setpoint"][row] = t_set
+                    for reader, future in zip(self.readers, futures):
+                        value, t, dt = future.result()
+                        columns[reader.name][row] = value
+                        columns[f"t {reader.name}"][row] = t
+                        columns[f"dt {reader.name}"][row] = dt
+                    self.count = row + 1
+        return self.result()
+
+    def trace(self, name: str):
+        """A plot trace source of a reader against the setpoint, growing as the rows come in."""
+        return _Column(self, name)
+
+    def result(self) -> AcquisitionResult:
+        """The rows acquired so far."""
+        return AcquisitionResult({name: col[:self.count] for name, col in self.columns.items()})
+
+
+class _Column:
+    def __init__(self, acquisition: SyncAcquisition, name: str):
+        self.acquisition = acquisition
+        self.name = name
+
+    def latest(self):
+        n = self.acquisition.count
+        return self.acquisition.columns["setpoint"][:n], self.acquisition.columns[self.name][:n]
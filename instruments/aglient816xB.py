@@ -1,16 +1,22 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QComboBox, QLineEdit
-from PySide6.QtCore import Qt, Slot
-import pyvisa
+import time
 
-from pyoctal.instruments import Agilent8163B, Agilent8164B
+import numpy as np
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLabel, QComboBox, QLineEdit, QPushButton
+from PySide6.QtCore import Qt, Slot, Signal
+import pyvisa
 
 from instruments.base import Instrument_GUI, WriteOnlyVar, ReadOnlyVar
-from unit import si_convert
+from instruments.devices import Agilent8163B, Agilent8164B
+from instruments.plot import PlotWidget
+from instruments.sweep import Spectrum, PowerBurst, WavelengthSweep
+from unit import si_convert, power_convert
 
 class InputWavelength(WriteOnlyVar):
     """Input wavelength for the laser."""
-    def __init__(self, instr):
-        super().__init__(instr)
+    key = "laser_wav"
+
+    def __init__(self, device):
+        super().__init__(device)
         self.label = QLabel("Input Wavelength: ")
         self._value = QLineEdit("1550")
         self._value.editingFinished.connect(self.set_value)
@@ -26,14 +32,16 @@ class InputWavelength(WriteOnlyVar):
         unit = self.unit.currentText()
         value = float(self._value.text())
         if unit != "nm":
-            value = si_convert(value, unit, "s")
-        self.instr.set_laser_wav(value)
+            value = si_convert(value, unit, "nm")
+        self.param.set(value)
 
     
 class InputPower(WriteOnlyVar):
     """Input power for the laser."""
-    def __init__(self, instr):
-        super().__init__(instr)
+    key = "laser_pow"
+
+    def __init__(self, device):
+        super().__init__(device)
 
         self.label = QLabel("Input Power: ")
         self._value = QLineEdit("0")
@@ -50,20 +58,22 @@ class InputPower(WriteOnlyVar):
     @Slot()
     def set_value(self):
         """Set the input power of the laser."""
-        self.instr.set_laser_pow(self._value.text())
+        self.param.set(self._value.text())
         
     @Slot()
     def set_unit(self, value: str=None):
         """Set the unit of the input power."""
         if value is None:
             value = self.unit.currentText()
-        self.instr.set_laser_unit(value)
+        self.device["laser_unit"].set(value)
 
    
 class OutputWavelength(WriteOnlyVar):
     """Output wavelength for the laser."""
-    def __init__(self, instr):
-        super().__init__(instr)
+    key = "detect_wav"
+
+    def __init__(self, device):
+        super().__init__(device)
         
         self.label = QLabel("Output Wavelength: ")
         self._value = QLineEdit("1550")
@@ -82,13 +92,15 @@ class OutputWavelength(WriteOnlyVar):
         unit = self.unit.currentText()
         value = self._value.text()
         if unit != "nm":
-            value = si_convert(value, unit, "m")
-        self.instr.set_detect_wav(value)
+            value = si_convert(float(value), unit, "nm")
+        self.param.set(value)
          
 class OutputPower(ReadOnlyVar):
     """Output power for the laser."""
-    def __init__(self, instr):
-        super().__init__(instr)
+    key = "detect_pow"
+
+    def __init__(self, device):
+        super().__init__(device)
         
         self.label = QLabel("Output Power: ")
         self._value = QLabel("-----")
@@ -107,11 +119,7 @@ class OutputPower(ReadOnlyVar):
         """Set the unit of the output power."""
         if value is None:
             value = self.unit.currentText()
-        self.instr.set_detect_unit(value)
-         
-    def get_value(self) -> float:
-        """Get the output power of the laser."""
-        return self.instr.get_detect_pow()
+        self.device["detect_unit"].set(value)
     
     @Slot()
     def update_value(self, value: float):
@@ -125,8 +133,10 @@ class OutputPower(ReadOnlyVar):
         
 class AverageTime(WriteOnlyVar):
     """Average time for the laser."""
-    def __init__(self, instr):
-        super().__init__(instr)
+    key = "detect_avgtime"
+
+    def __init__(self, device):
+        super().__init__(device)
         self.label = QLabel("Average Time: ")
         self._value = QLineEdit("100")
         self._value.editingFinished.connect(self.set_value)
@@ -144,13 +154,128 @@ class AverageTime(WriteOnlyVar):
         value = float(self._value.text())
         if unit != "s":
             value = si_convert(value, unit, "s")
-        self.instr.set_detect_avgtime(value)
+        self.param.set(value)
+
+
+class SweepPanel(QWidget):
+    """Settings and result of a hardware-timed wavelength sweep."""
+    fields = {
+        "start": ("Start [nm]: ", "1540"),
+        "stop": ("Stop [nm]: ", "1560"),
+        "step": ("Step [pm]: ", "5"),
+        "speed": ("Speed [nm/s]: ", "5"),
+        "avgtime": ("Averaging time [us]: ", "100"),
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.edits = {}
+        for key, (label, default) in self.fields.items():
+            self.edits[key] = QLineEdit(default, parent=self)
+            form.addRow(label, self.edits[key])
+        layout.addLayout(form)
+
+        buttons = QHBoxLayout()
+        self.sweep_button = QPushButton("Sweep", parent=self)
+        self.abort_button = QPushButton("Abort", parent=self)
+        self.abort_button.setEnabled(False)
+        self.status = QLabel(parent=self)
+        buttons.addWidget(self.sweep_button)
+        buttons.addWidget(self.abort_button)
+        buttons.addWidget(self.status, 1)
+        layout.addLayout(buttons)
+
+        self.plot = PlotWidget(parent=self, time_axis=False)
+        self.spectrum = Spectrum()
+        self.plot.add_trace("Power [dBm]", self.spectrum)
+        layout.addWidget(self.plot, 1)
+
+    def params(self) -> dict:
+        """Get the sweep parameters from the settings."""
+        params = {key: float(edit.text()) for key, edit in self.edits.items()}
+        params["avgtime"] = si_convert(params["avgtime"], "us", "s")
+        return params
+
+    def running(self, state: bool):
+        """Enable the controls that apply to a running or stopped sweep."""
+        self.sweep_button.setEnabled(not state)
+        self.abort_button.setEnabled(state)
+        for edit in self.edits.values():
+            edit.setEnabled(not state)
+        if state:
+            self.status.setText("Sweeping...")
+
+    def show_result(self, spectrum: Spectrum, duration: float):
+        """Plot the spectrum in dBm."""
+        dbm = power_convert(spectrum.y, "W", "dBm")
+        # points without power are left out of the plot
+        dbm[np.isneginf(dbm)] = np.nan
+        self.spectrum.x, self.spectrum.y = spectrum.x, dbm
+        self.status.setText(f"{len(spectrum)} points in {duration:.1f} s")
+        self.plot.update()
+
+
+class BurstPanel(QWidget):
+    """Settings of a burst of power readings logged by the power meter."""
+    fields = {
+        "points": ("Points: ", "1000"),
+        "avgtime": ("Averaging time [us]: ", "100"),
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.edits = {}
+        for key, (label, default) in self.fields.items():
+            self.edits[key] = QLineEdit(default, parent=self)
+            form.addRow(label, self.edits[key])
+        layout.addLayout(form)
+
+        buttons = QHBoxLayout()
+        self.capture_button = QPushButton("Capture", parent=self)
+        self.abort_button = QPushButton("Abort", parent=self)
+        self.abort_button.setEnabled(False)
+        self.status = QLabel("The readings are added to the history of the output power.", parent=self)
+        buttons.addWidget(self.capture_button)
+        buttons.addWidget(self.abort_button)
+        buttons.addWidget(self.status, 1)
+        layout.addLayout(buttons)
+        layout.addStretch()
+
+    def params(self) -> dict:
+        """Get the burst parameters from the settings."""
+        return {"points": int(self.edits["points"].text()),
+                "avgtime": si_convert(float(self.edits["avgtime"].text()), "us", "s")}
+
+    def running(self, state: bool):
+        """Enable the controls that apply to a running or stopped burst."""
+        self.capture_button.setEnabled(not state)
+        self.abort_button.setEnabled(state)
+        for edit in self.edits.values():
+            edit.setEnabled(not state)
+        if state:
+            self.status.setText("Capturing...")
+
+    def show_result(self, burst: Spectrum, duration: float):
+        if len(burst) > 1:
+            rate = (len(burst) - 1) / (burst.x[-1] - burst.x[0])
+            self.status.setText(f"{len(burst)} points at {rate * 1E-3:.3g} kHz in {duration:.2f} s")
+        else:
+            self.status.setText(f"{len(burst)} points in {duration:.2f} s")
 
 
 class Agilent816xB_GUI(Instrument_GUI):
     """GUI for the Agilent 816xB series."""
-    def __init__(self, name: str, instr, *args, **kwargs):
-        super().__init__(name=name, instr=instr, *args, **kwargs)
+    sweep_done = Signal(object, float)
+    burst_done = Signal(object, float)
+
+    def __init__(self, name: str, device, *args, **kwargs):
+        super().__init__(name=name, device=device, *args, **kwargs)
+        self.sweeper = None
+        self.burster = None
         self.window()
         self.layout.alignment = Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter     
         
@@ -158,11 +283,11 @@ class Agilent816xB_GUI(Instrument_GUI):
         """Create the GUI window for this specific instrument."""
         self.widget = QWidget(self)
         self.widget_layout = QVBoxLayout(self.widget)
-        self.input_wavelength = InputWavelength(self.instr)
-        self.input_power = InputPower(self.instr)
-        self.output_wavelength = OutputWavelength(self.instr)
-        self.output_power = OutputPower(self.instr)
-        self.average_time = AverageTime(self.instr)
+        self.input_wavelength = InputWavelength(self.device)
+        self.input_power = InputPower(self.device)
+        self.output_wavelength = OutputWavelength(self.device)
+        self.output_power = OutputPower(self.device)
+        self.average_time = AverageTime(self.device)
         
         self.widget_layout.addWidget(self.input_wavelength)
         self.widget_layout.addWidget(self.input_power)
@@ -170,40 +295,140 @@ class Agilent816xB_GUI(Instrument_GUI):
         self.widget_layout.addWidget(self.output_power)
         self.widget_layout.addWidget(self.average_time)
         
-        self.read_channel.register_callback(self.output_power.get_value)
+        # the device polls the power, the channel hands the readings to the panel
         self.read_channel.data_ready.connect(self.output_power.update_value)
+        self.plot_variable("Output Power", self.output_power)
+        self.step_targets["Input Wavelength [nm]"] = ("laser_wav", self.instr.set_laser_wav)
+        self.step_targets["Input Power"] = ("laser_pow", self.instr.set_laser_pow)
+
+        self.sweep_panel = SweepPanel(parent=self)
+        self.sweep_panel.sweep_button.clicked.connect(self.start_sweep)
+        self.sweep_panel.abort_button.clicked.connect(self.abort_sweep)
+        self.sweep_done.connect(self.on_sweep_done)
+        self.command_failed.connect(self.on_sweep_failed)
+        self.tabs.addTab(self.sweep_panel, "Sweep")
+
+        self.burst_panel = BurstPanel(parent=self)
+        self.burst_panel.capture_button.clicked.connect(self.start_burst)
+        self.burst_panel.abort_button.clicked.connect(self.abort_burst)
+        self.burst_done.connect(self.on_burst_done)
+        self.tabs.addTab(self.burst_panel, "Burst")
         
         self.layout.addWidget(self.widget)
-        self.layout.addStretch(1)
+        self.layout.addWidget(self.tabs, 1)
         
     def initialise(self, state: bool):
         """Initialise the instrument."""
         if state is False:
             return
 
+        # sent as one compound transaction instead of a round-trip per setting
+        with self.commands.batch("initialise"):
+            self.apply_settings()
+            self.state(False)
+
+    def apply_settings(self):
+        """Send every setting of the panel to the instrument."""
         self.input_wavelength.set_value()
         self.input_power.set_unit()
         self.input_power.set_value()
         self.output_wavelength.set_value()
         self.output_power.set_unit()
         self.average_time.set_value()
-        self.state(False)
         
     def state(self, val: bool):
         """Turn the laser on/off."""
-        self.instr.set_laser_state(val)
-        self.read_channel.change_state(val)
+        self.device.state(val)
         self.output_power.default()
+
+    @Slot()
+    def start_sweep(self):
+        """Start a wavelength sweep on the command queue."""
+        try:
+            self.sweeper = WavelengthSweep(self.instr, **self.sweep_panel.params())
+        except ValueError as e:
+            print("Sweep issue: \n", e)
+            return
+        # the power meter is busy logging during the sweep
+        polling = self.read_channel.is_running
+        self.read_channel.stop()
+        self.sweep_panel.running(True)
+        self.commands.submit("sweep", self._run_sweep, self.sweeper, polling, cache=False)
+
+    def _run_sweep(self, sweeper: WavelengthSweep, polling: bool):
+        start = time.perf_counter()
+        spectrum = self.device.run_sweep(sweeper, polling)
+        self.sweep_done.emit(spectrum, time.perf_counter() - start)
+
+    @Slot()
+    def abort_sweep(self):
+        """Abort the running sweep."""
+        if self.sweeper is not None:
+            self.sweeper.abort()
+
+    @Slot(object, float)
+    def on_sweep_done(self, spectrum: Spectrum, duration: float):
+        """Show the spectrum, the device has put the settings back."""
+        self.sweep_panel.show_result(spectrum, duration)
+        self.finish_sweep()
+
+    @Slot(str, str)
+    def on_sweep_failed(self, key: str, error: str):
+        if key == "sweep":
+            self.sweep_panel.status.setText("Sweep failed")
+            self.finish_sweep()
+        elif key == "burst":
+            self.burst_panel.status.setText("Burst failed")
+            self.finish_burst()
+
+    def finish_sweep(self):
+        self.sweep_panel.running(False)
+        self.sweeper = None
+
+    @Slot()
+    def start_burst(self):
+        """Start a burst of power readings on the command queue."""
+        try:
+            self.burster = PowerBurst(self.instr, **self.burst_panel.params())
+        except ValueError as e:
+            print("Burst issue: \n", e)
+            return
+        # the power meter is busy logging during the burst
+        polling = self.read_channel.is_running
+        self.read_channel.stop()
+        self.burst_panel.running(True)
+        self.commands.submit("burst", self._run_burst, self.burster, polling, cache=False)
+
+    def _run_burst(self, burst: PowerBurst, polling: bool):
+        start = time.perf_counter()
+        result = self.device.run_burst(burst, polling)
+        self.burst_done.emit(result, time.perf_counter() - start)
+
+    @Slot()
+    def abort_burst(self):
+        """Abort the running burst."""
+        if self.burster is not None:
+            self.burster.abort()
+
+    @Slot(object, float)
+    def on_burst_done(self, burst: Spectrum, duration: float):
+        """Show the rate of the burst, its readings are in the history."""
+        self.burst_panel.show_result(burst, duration)
+        self.finish_burst()
+
+    def finish_burst(self):
+        self.burst_panel.running(False)
+        self.burster = None
     
 
 class Agilent8164B_GUI(Agilent816xB_GUI):
     """GUI for the Agilent 8164B."""
-    def __init__(self, rm: pyvisa.ResourceManager, *args, **kwargs):
+    def __init__(self, rm: pyvisa.ResourceManager, *args, device=None, **kwargs):
         super().__init__(name="Agilent 8164B",
-                         instr=Agilent8164B(rm=rm), *args, **kwargs)
+                         device=device if device is not None else Agilent8164B(rm=rm), *args, **kwargs)
 
 class Agilent8163B_GUI(Agilent816xB_GUI):
     """GUI for the Agilent 8163B."""
-    def __init__(self, rm: pyvisa.ResourceManager, *args, **kwargs):
+    def __init__(self, rm: pyvisa.ResourceManager, *args, device=None, **kwargs):
         super().__init__(name="Agilent 8163B",
-                         instr=Agilent8163B(rm=rm), *args, **kwargs)
+                         device=device if device is not None else Agilent8163B(rm=rm), *args, **kwargs)
@@ -1,14 +1,19 @@
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QLabel, QComboBox
-from PySide6.QtCore import Qt, Slot
-import pyvisa
+import time
 
-from pyoctal.instruments import AgilentE3640A
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLabel, QLineEdit, QLabel, QComboBox, QPushButton, QCheckBox
+from PySide6.QtCore import Qt, Slot, Signal
+import pyvisa
 
 from instruments.base import Instrument_GUI, WriteOnlyVar, ReadOnlyVar
+from instruments.devices import AgilentE3640A
+from instruments.plot import PlotWidget
+from instruments.sweep import VoltageSweep
 
 class Voltage(WriteOnlyVar):
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+    key = "volt"
+
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
         self.label = QLabel("Voltage [V]: ", parent=self)
         self._value = QLineEdit("0", parent=self)
         self._value.editingFinished.connect(self.set_value)
@@ -17,7 +22,7 @@ class Voltage(WriteOnlyVar):
     
     @Slot()
     def set_value(self):
-        self.instr.set_volt(self._value.text())
+        self.param.set(self._value.text())
         
     def update_value_max(self, vlim: float):
         self.double_validator.setBottom(0.0)
@@ -28,22 +33,29 @@ class Voltage(WriteOnlyVar):
         pass
     
 class VoltageLimit(WriteOnlyVar):
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+    key = "volt_lim"
+    max_ready = Signal(float)
+
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
         self.label = QLabel("Voltage limit [V]: ", parent=self)
         self._value = QLineEdit("0", parent=self)
         self._value.editingFinished.connect(self.set_value)
+        self.max_ready.connect(self.set_value_max)
 
         self.layout.addWidget(self.label, 2)
         self.layout.addWidget(self._value, 2)
     
     @Slot()
     def set_value(self):
-        _, curr_lim = self.instr.get_params()
-        self.instr.set_params(self._value.text(), curr_lim)
+        self.param.set(self._value.text())
         
     def update_value_max(self):
-        max_value = self.instr.get_volt_max()
+        # the range write may still be queued, so the maximum is read after it
+        self.device["volt_max"].query(callback=self.max_ready.emit, cached=False)
+
+    @Slot(float)
+    def set_value_max(self, max_value: float):
         self.double_validator.setBottom(0.0)
         self.double_validator.setTop(float(max_value))
         self._value.setValidator(self.double_validator)
@@ -52,47 +64,54 @@ class VoltageLimit(WriteOnlyVar):
         self._value.textChanged.connect(func)
     
 class Current(ReadOnlyVar):
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+    key = "curr"
+
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
         self.label = QLabel("Current [A]: ", parent=self)
         self._value = QLabel(parent=self)
         self._value.setContentsMargins(6, 0, 0, 0)
-        self.get_value()
         self.layout.addWidget(self.label, 2)
         self.layout.addWidget(self._value, 2)
         
-    def get_value(self):
-        return self.instr.get_curr()
-        
+    @Slot(object)
     def update_value(self, value: float):
-        print(f"Current - Updated value: {value}")
         self._value.setText(str(value))
 
         
-class CurrentLimit(ReadOnlyVar):
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+class CurrentLimit(WriteOnlyVar):
+    key = "curr_lim"
+    max_ready = Signal(float)
+
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
         self.label = QLabel("Current limit [A]: ", parent=self)
         self._value = QLineEdit("0", parent=self)
         self._value.editingFinished.connect(self.set_value)
+        self.max_ready.connect(self.set_value_max)
         self.layout.addWidget(self.label, 2)
         self.layout.addWidget(self._value, 2)
     
     @Slot()
     def set_value(self):
-        volt_lim, _ = self.instr.get_params()
-        self.instr.set_params(volt_lim, self._value.text())
+        self.param.set(self._value.text())
         
     def update_value_max(self):
-        max_value = self.instr.get_curr_max()
+        # the range write may still be queued, so the maximum is read after it
+        self.device["curr_max"].query(callback=self.max_ready.emit, cached=False)
+
+    @Slot(float)
+    def set_value_max(self, max_value: float):
         self.double_validator.setBottom(0.0)
         self.double_validator.setTop(float(max_value))
         self._value.setValidator(self.double_validator)
 
     
 class VRange(WriteOnlyVar):
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+    key = "vrange"
+
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
         self.label = QLabel("Range: ", parent=self)
         self._value = QComboBox(parent=self)
         self._value.currentTextChanged.connect(self.set_value)
@@ -103,15 +122,76 @@ class VRange(WriteOnlyVar):
     def set_value(self, value: str=None):
         if value is None:
             value = self._value.currentText()
-        self.instr.set_vrange(value)
+        self.param.set(value)
     
     def callback(self, func: callable):
         self._value.currentTextChanged.connect(func)
 
 
+class IVSweepPanel(QWidget):
+    """Settings and result of a voltage sweep."""
+    fields = {
+        "start": ("Start [V]: ", "0"),
+        "stop": ("Stop [V]: ", "1"),
+        "step": ("Step [V]: ", "0.1"),
+        "dwell": ("Dwell [ms]: ", "100"),
+    }
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.edits = {}
+        for key, (label, default) in self.fields.items():
+            self.edits[key] = QLineEdit(default, parent=self)
+            form.addRow(label, self.edits[key])
+        self.bidirectional = QCheckBox("Sweep back to start", parent=self)
+        form.addRow(self.bidirectional)
+        layout.addLayout(form)
+
+        buttons = QHBoxLayout()
+        self.sweep_button = QPushButton("Sweep", parent=self)
+        self.abort_button = QPushButton("Abort", parent=self)
+        self.abort_button.setEnabled(False)
+        self.status = QLabel(parent=self)
+        buttons.addWidget(self.sweep_button)
+        buttons.addWidget(self.abort_button)
+        buttons.addWidget(self.status, 1)
+        layout.addLayout(buttons)
+
+        self.plot = PlotWidget(parent=self, time_axis=False)
+        layout.addWidget(self.plot, 1)
+
+    def params(self) -> dict:
+        """Get the sweep parameters from the settings."""
+        params = {key: float(edit.text()) for key, edit in self.edits.items()}
+        params["dwell"] *= 1E-3
+        params["bidirectional"] = self.bidirectional.isChecked()
+        return params
+
+    def running(self, state: bool):
+        """Enable the controls that apply to a running or stopped sweep."""
+        self.sweep_button.setEnabled(not state)
+        self.abort_button.setEnabled(state)
+        self.bidirectional.setEnabled(not state)
+        for edit in self.edits.values():
+            edit.setEnabled(not state)
+        if state:
+            self.status.setText("Sweeping...")
+
+    def show_sweep(self, sweep: VoltageSweep):
+        """Plot the sweep while it fills in."""
+        self.plot.clear()
+        self.plot.add_trace("Current [A] vs Voltage [V]", sweep)
+
+
 class AgilentE3640A_GUI(Instrument_GUI):
-    def __init__(self, rm: pyvisa.ResourceManager, *args, **kwargs):
-        super().__init__(name="Agilent E3640A", instr=AgilentE3640A(rm=rm), *args, **kwargs)
+    sweep_done = Signal(float)
+
+    def __init__(self, rm: pyvisa.ResourceManager, *args, device=None, **kwargs):
+        super().__init__(name="Agilent E3640A", device=device if device is not None else AgilentE3640A(rm=rm),
+                         *args, **kwargs)
+        self.sweeper = None
         self.window()
         self.layout.alignment = Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter
         
@@ -120,11 +200,11 @@ class AgilentE3640A_GUI(Instrument_GUI):
         
         # instantiate widgets
         self.widget_layout = QVBoxLayout(self.widget)
-        self.vrange = VRange(self.instr, parent=self)
-        self.voltage = Voltage(self.instr, parent=self)
-        self.voltage_lim = VoltageLimit(self.instr, parent=self)
-        self.current = Current(self.instr, parent=self)
-        self.current_lim = CurrentLimit(self.instr, parent=self)
+        self.vrange = VRange(self.device, parent=self)
+        self.voltage = Voltage(self.device, parent=self)
+        self.voltage_lim = VoltageLimit(self.device, parent=self)
+        self.current = Current(self.device, parent=self)
+        self.current_lim = CurrentLimit(self.device, parent=self)
         self.widget_layout.addWidget(self.vrange)
         self.widget_layout.addWidget(self.voltage)
         self.widget_layout.addWidget(self.voltage_lim)
@@ -135,26 +215,82 @@ class AgilentE3640A_GUI(Instrument_GUI):
         self.vrange.callback(self.voltage_lim.update_value_max)
         self.vrange.callback(self.current_lim.update_value_max)
         self.voltage_lim.callback(self.voltage.update_value_max)
-        self.read_channel.register_callback(self.current.get_value)
+        # the device polls the current, the channel hands the readings to the panel
         self.read_channel.data_ready.connect(self.current.update_value)
+        self.plot_variable("Current", self.current)
+        self.step_targets["Voltage [V]"] = ("volt", self.instr.set_volt)
+
+        self.sweep_panel = IVSweepPanel(parent=self)
+        self.sweep_panel.sweep_button.clicked.connect(self.start_sweep)
+        self.sweep_panel.abort_button.clicked.connect(self.abort_sweep)
+        self.sweep_done.connect(self.on_sweep_done)
+        self.command_failed.connect(self.on_sweep_failed)
+        self.tabs.addTab(self.sweep_panel, "IV sweep")
         
         self.voltage.update_value_max(self.voltage_lim.value.text())
 
         self.layout.addWidget(self.widget)
-        self.layout.addStretch(1)
+        self.layout.addWidget(self.tabs, 1)
         
     def initialise(self, state: bool):
         if state is False:
             return
         
+        with self.commands.batch("initialise"):
+            self.apply_settings()
+
+    def apply_settings(self):
+        """Send every setting of the panel to the instrument."""
         self.vrange.set_value()
         self.voltage_lim.update_value_max()
         self.voltage_lim.set_value()
-        self.voltage.update_value_max(self.voltage_lim.value.text())
-        self.voltage.set_value()
         self.current_lim.update_value_max()
         self.current_lim.set_value()
+        # the limits are set with APPLY, which sets the voltage too
+        self.voltage.update_value_max(self.voltage_lim.value.text())
+        self.voltage.set_value()
 
     def state(self, val: bool):
-        self.instr.set_output_state(val)
-        self.read_channel.change_state(val)            
\ No newline at end of file
+        self.device.state(val)
+
+    @Slot()
+    def start_sweep(self):
+        """Start a voltage sweep on the command queue, limited by the current limit."""
+        try:
+            self.sweeper = VoltageSweep(self.instr, compliance=float(self.current_lim.value.text()),
+                                        **self.sweep_panel.params())
+        except ValueError as e:
+            print("Sweep issue: \n", e)
+            return
+        polling = self.read_channel.is_running
+        self.read_channel.stop()
+        self.sweep_panel.running(True)
+        self.sweep_panel.show_sweep(self.sweeper)
+        self.commands.submit("iv_sweep", self._run_sweep, self.sweeper, polling, cache=False)
+
+    def _run_sweep(self, sweeper: VoltageSweep, polling: bool):
+        start = time.perf_counter()
+        self.device.run_sweep(sweeper, polling)
+        self.sweep_done.emit(time.perf_counter() - start)
+
+    @Slot()
+    def abort_sweep(self):
+        """Abort the running sweep."""
+        if self.sweeper is not None:
+            self.sweeper.abort()
+
+    @Slot(float)
+    def on_sweep_done(self, duration: float):
+        text = f"{len(self.sweeper)} points in {duration:.1f} s"
+        if self.sweeper.compliance_reached:
+            text += ", stopped at the current limit"
+        self.sweep_panel.status.setText(text)
+        self.sweep_panel.running(False)
+
+    @Slot(str, str)
+    def on_sweep_failed(self, key: str, error: str):
+        if key != "iv_sweep":
+            return
+        aborted = self.sweeper is not None and self.sweeper.cancel.is_set()
+        self.sweep_panel.status.setText("Sweep aborted" if aborted else "Sweep failed")
+        self.sweep_panel.running(False)
@@ -1,56 +1,145 @@
+import collections
+import threading
 import time
 
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QHBoxLayout, QPushButton
-from PySide6.QtCore import QThread, Qt, Signal
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QHBoxLayout, QPushButton, QComboBox, QTabWidget
+from PySide6.QtCore import QObject, QTimer, Qt, Signal, Slot, QSignalBlocker
 from PySide6.QtGui import QDoubleValidator
 
-class Channel(QThread):
+from instruments.core import Poller
+from instruments.plot import PlotPanel
+from instruments.commands import command_queue
+from instruments.visa import DEFAULT_TIMEOUT
+from instruments.metrics import get_metrics
+
+class Channel(QObject):
     """
-    A thread to run a function in the background.
-    The purpose of this class is for instruments that require continuous reading of data.
-    Those will be registeted as callbacks and the data will be emitted when ready.
+    The Qt view of a device's poller.
+    The results of the callbacks polled in the background are buffered and only
+    the latest one is handed to the GUI thread with `data_ready`, at most once
+    per display frame, so the labels skip the intermediate values instead of
+    flooding the event queue. The plots draw every reading from the histories.
     """
+    MIN_PERIOD = Poller.MIN_PERIOD
+    MAX_PERIOD = Poller.MAX_PERIOD
+    # seconds between deliveries to the GUI
+    REFRESH = 1 / 60
     data_ready = Signal(type)
-    def __init__(self, *args, **kwargs):
+    _pending = Signal()
+
+    def __init__(self, poller: Poller=None, *args, **kwargs):
         super().__init__()
-        self.is_running = True
-        self.callbacks = []
-        
-    def register_callback(self, func):
+        self.poller = poller if poller is not None else Poller(*args, **kwargs)
+        self.metrics = get_metrics()
+        self._buffer = collections.deque()
+        self._buffer_lock = threading.Lock()
+        self._scheduled = False
+        self._last_flush = 0.0
+        # results waiting for the GUI, the most ever waiting and the ones never shown
+        self.max_depth = 0
+        self.skipped = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self._pending.connect(self._schedule_flush)
+        self.poller.add_listener(self._buffer_result)
+
+    def _buffer_result(self, data):
+        """Keep a result for the next frame, from the polling thread."""
+        with self._buffer_lock:
+            self._buffer.append(data)
+            self.max_depth = max(self.max_depth, len(self._buffer))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        # only the first result of a frame crosses to the GUI thread
+        self._pending.emit()
+
+    @Slot()
+    def _schedule_flush(self):
+        delay = self._last_flush + self.REFRESH - time.monotonic()
+        self._timer.start(max(0, int(delay * 1E3)))
+
+    @Slot()
+    def flush(self):
+        """Deliver the latest of the buffered results to the GUI."""
+        with self._buffer_lock:
+            batch = list(self._buffer)
+            self._buffer.clear()
+            self._scheduled = False
+        self._last_flush = time.monotonic()
+        if not batch:
+            return
+        self.skipped += len(batch) - 1
+        name = self.poller.name or ""
+        self.metrics.set_gauge("ui_queue_depth", name, len(batch))
+        self.metrics.set_gauge("ui_queue_max_depth", name, self.max_depth)
+        self.data_ready.emit(batch[-1])
+
+    def depth(self) -> int:
+        """Number of results waiting for the GUI."""
+        with self._buffer_lock:
+            return len(self._buffer)
+
+    @property
+    def is_running(self) -> bool:
+        return self.poller.is_running
+
+    @property
+    def period(self) -> float:
+        return self.poller.period
+
+    @property
+    def lock(self):
+        return self.poller.lock
+
+    @property
+    def tasks(self) -> list:
+        return self.poller.tasks
+
+    check_period = Poller.check_period
+
+    def register_callback(self, func, period: float=None, name: str=None):
         """Register a function to be run in the background."""
-        self.callbacks.append(func)
-
-    def run(self):
-        """Run the functions in the background."""
-        while self.is_running:
-            for callback in self.callbacks:
-                data = callback()
-                self.data_ready.emit(data)
-                time.sleep(0.5)
-                
+        self.poller.register_callback(func, period, name)
+
+    def set_period(self, period: float):
+        """Change the polling period of the callbacks without their own period."""
+        self.poller.set_period(period)
+
+    def start(self):
+        """Start polling the callbacks."""
+        self.poller.start()
+
     def change_state(self, state: bool):
-        """Change the state of the thread."""
-        self.is_running = state
-        if self.is_running:
-            self.start()
-        else:
-            self.terminate()
-            self.wait()
+        """Change the state of the channel."""
+        self.poller.change_state(state)
+
+    def stop(self, wait: bool=True):
+        """Stop polling the callbacks, see `Poller.stop`."""
+        self.poller.stop(wait)
 
-    def stop(self):
-        """Stop the thread."""
-        self.is_running = False
-        self.quit()
-        self.wait()
+    def stats(self) -> list:
+        """Return the requested versus measured rates of the callbacks."""
+        return self.poller.stats()
+
+    def delete(self):
+        self.poller.remove_listener(self._buffer_result)
+        self._timer.stop()
 
 class Var(QWidget):
     """
     A variable base class to be used in the GUI.
     This class is used to create a variable that can be read or written to.
+    Subclasses showing a parameter of the device set its `key`.
     """
-    def __init__(self, instr, *args, **kwargs):
+    key = None
+
+    def __init__(self, device, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.instr = instr
+        self.device = device
+        self.instr = getattr(device, "instr", device)
+        self.param = device.params[self.key] if self.key is not None else None
         self._value = 0
         self.double_validator = QDoubleValidator()
         self.double_validator.setNotation(QDoubleValidator.Notation.StandardNotation)
@@ -63,6 +152,42 @@ class Var(QWidget):
     @property
     def value(self):
         return self._value
+
+    @property
+    def commands(self):
+        return command_queue(self.instr)
+
+    def submit(self, key: str, func, *args, **kwargs):
+        """
+        Queue a driver call on the instrument's command queue so the GUI never waits
+        on the bus. A pending call with the same key is replaced by this one.
+        """
+        self.commands.submit(key, func, *args, **kwargs)
+
+    def state(self) -> dict:
+        """The text of the value and unit fields, so the panel can be rebuilt later."""
+        state = {}
+        if isinstance(self._value, QLineEdit):
+            state["value"] = self._value.text()
+        elif isinstance(self._value, QComboBox):
+            state["value"] = self._value.currentText()
+        unit = getattr(self, "unit", None)
+        if isinstance(unit, QComboBox):
+            state["unit"] = unit.currentText()
+        return state
+
+    def restore(self, state: dict):
+        """Fill in the fields from `state` without sending anything to the instrument."""
+        if "value" in state and isinstance(self._value, QLineEdit):
+            with QSignalBlocker(self._value):
+                self._value.setText(state["value"])
+        elif "value" in state and isinstance(self._value, QComboBox):
+            with QSignalBlocker(self._value):
+                self._value.setCurrentText(state["value"])
+        unit = getattr(self, "unit", None)
+        if "unit" in state and isinstance(unit, QComboBox):
+            with QSignalBlocker(unit):
+                unit.setCurrentText(state["unit"])
     
 class WriteOnlyVar(Var):
     """A variable that can only be written to."""
@@ -75,24 +200,45 @@ class WriteOnlyVar(Var):
     
     
 class ReadOnlyVar(Var):
-    """A variable that can only be read."""
-    def __init__(self, instr, *args, **kwargs):
-        super().__init__(instr, *args, **kwargs)
+    """
+    A variable that can only be read.
+    Every reading taken through `sample` is kept in the history of its parameter.
+    """
+    def __init__(self, device, *args, **kwargs):
+        super().__init__(device, *args, **kwargs)
+        self.history = self.param.history
     
     def get_value(self, *args, **kwargs):
-        raise NotImplementedError
+        return self.param.read()
+
+    def sample(self):
+        """Read the value and record it in the history."""
+        return self.param.sample()
+
+    def set_memory_limit(self, memory_limit: int):
+        """Change the memory used by the history of this variable."""
+        self.history.resize(memory_limit=memory_limit)
 
 class Address(WriteOnlyVar):
     """A variable to store the address of the instrument."""
     connect_signal = Signal(bool)
+    # emitted from the thread opening the instrument
+    opening = Signal()
+    opened = Signal()
+    open_failed = Signal(str)
+    timeout = DEFAULT_TIMEOUT
     
-    def __init__(self, instr):
-        super().__init__(instr)
+    def __init__(self, device):
+        super().__init__(device)
         self.connect_status = False
+        self.in_progress = False
         self.label = QLabel("Address: ", parent=self)
         self._value = QLineEdit(placeholderText="i.e. GPIB0::1::INSTR", parent=self)
         self.connect_button = QPushButton("Connect", parent=self)
         self.connect_button.clicked.connect(self.connect_to_instr)
+        self.opening.connect(self.on_opening)
+        self.opened.connect(self.on_opened)
+        self.open_failed.connect(self.on_open_failed)
 
         self.con = QLabel(parent=self)
         self.con.setFixedSize(15, 15)
@@ -104,22 +250,64 @@ class Address(WriteOnlyVar):
         self.layout.addWidget(self.con)
 
     def connect_to_instr(self):
-        """Connect to the instrument."""
+        """Connect to the instrument, or disconnect if connected."""
         if self.connect_status:
-            self.instr.disconnect()
-            self.con.setStyleSheet("border-radius: 7px; background-color: red;")
-            self.connect_status = False
-            self.connect_signal.emit(False)
-            self.connect_button.setText("Connect")
+            self.device.disconnect()
+            self.set_connected(False)
         else:
-            try:
-                self.instr.connect(self._value.text())
-                self.con.setStyleSheet("border-radius: 7px; background-color: green;")
-                self.connect_status = True
-                self.connect_signal.emit(True)
-                self.connect_button.setText("Disconnect")
-            except ValueError as e:
-                print("Connection issue: \n", e)
+            # opening can take up to the timeout, so it is done off the GUI thread
+            threading.Thread(target=self.try_open, args=(self.value,), name="connect", daemon=True).start()
+
+    def open(self, addr: str, timeout: float=None):
+        """
+        Open the instrument, blocking until it answers or the timeout expires.
+        It can be called from any thread and the result is shown on the panel.
+        """
+        self.in_progress = True
+        self.opening.emit()
+        try:
+            self.device.connect(addr, self.timeout if timeout is None else timeout)
+        except Exception as e:
+            self.open_failed.emit(str(e))
+            raise
+        finally:
+            self.in_progress = False
+        self.opened.emit()
+
+    def try_open(self, addr: str, timeout: float=None):
+        try:
+            self.open(addr, timeout)
+        except Exception:
+            pass
+
+    @Slot()
+    def on_opening(self):
+        self.connect_button.setEnabled(False)
+        self.connect_button.setText("Connecting...")
+        self.con.setStyleSheet("border-radius: 7px; background-color: orange;")
+
+    @Slot()
+    def on_opened(self):
+        self.set_connected(True)
+
+    @Slot(str)
+    def on_open_failed(self, error: str):
+        print("Connection issue: \n", error)
+        self.connect_button.setEnabled(True)
+        self.connect_button.setText("Connect")
+        self.con.setStyleSheet("border-radius: 7px; background-color: red;")
+
+    def set_connected(self, state: bool):
+        """Show the connection state and tell the panel about it."""
+        self.show_connected(state)
+        self.connect_signal.emit(state)
+
+    def show_connected(self, state: bool):
+        """Show the connection state only, e.g. of a device opened before the panel was built."""
+        self.connect_status = state
+        self.connect_button.setEnabled(True)
+        self.connect_button.setText("Disconnect" if state else "Connect")
+        self.con.setStyleSheet(f"border-radius: 7px; background-color: {'green' if state else 'red'};")
 
     @property
     def value(self):
@@ -130,21 +318,84 @@ class Address(WriteOnlyVar):
         self._value.setText(value)
 
 
+class PollPeriod(WriteOnlyVar):
+    """The polling period of an instrument's read channel."""
+    units = {"ms": 1E-3, "s": 1, "min": 60}
+
+    def __init__(self, channel: Channel):
+        super().__init__(channel)
+        self.label = QLabel("Poll period: ", parent=self)
+        self._value = QLineEdit(str(channel.period), parent=self)
+        self._value.editingFinished.connect(self.set_value)
+        self.unit = QComboBox(parent=self)
+        self.unit.addItems(list(self.units))
+        self.unit.setCurrentText("s")
+        self.unit.currentTextChanged.connect(self.set_value)
+        self.layout.addWidget(self.label, 2)
+        self.layout.addWidget(self._value, 2)
+        self.layout.addWidget(self.unit, 1)
+
+    def set_value(self):
+        """Set the polling period of the channel."""
+        try:
+            period = float(self._value.text()) * self.units[self.unit.currentText()]
+            self.instr.set_period(period)
+        except ValueError as e:
+            print("Polling period issue: \n", e)
+
+    def restore(self, state: dict):
+        super().restore(state)
+        self.set_value()
+
+
 class Instrument_GUI(QWidget):
     """ Base class for instrument GUIs."""
-    def __init__(self, name, instr):
+    command_done = Signal(str, object)
+    command_failed = Signal(str, str)
+
+    def __init__(self, name, device):
         super().__init__()
-        self.instr = instr
-        self.read_channel = Channel()
+        self.device = device
+        self.instr = device.instr
+        self.commands = device.commands
+        self.commands.add_listener(on_done=self._command_done, on_error=self._command_error)
+        self.command_failed.connect(self.on_command_failed)
+        self.read_channel = Channel(device.poller)
         
         self.layout = QVBoxLayout(self)
         label = QLabel(f"Instrument type: {name}", parent=self)
         label.setContentsMargins(0, 0, 0, 15)
         self.layout.addWidget(label, alignment=Qt.AlignmentFlag.AlignCenter)
 
-        self._addr = Address(self.instr)
+        self._addr = Address(self.device)
+        self._addr.connect_signal.connect(self.reset_cache)
         self._addr.connect_signal.connect(self.initialise)
+        # a device opened without a panel already holds its settings
+        if device.connected:
+            self._addr.show_connected(True)
         self.layout.addWidget(self._addr)
+        self.poll_period = PollPeriod(self.read_channel)
+        self.layout.addWidget(self.poll_period)
+
+        # measured versus requested polling rate
+        self.rate = QLabel(parent=self)
+        self.layout.addWidget(self.rate, alignment=Qt.AlignmentFlag.AlignCenter)
+        self.stats = QLabel(parent=self)
+        self.layout.addWidget(self.stats, alignment=Qt.AlignmentFlag.AlignCenter)
+        self.rate_timer = QTimer(self)
+        self.rate_timer.timeout.connect(self.update_rate)
+        self.rate_timer.timeout.connect(self.update_stats)
+        self.rate_timer.start(1000)
+
+        # live plot of the read variables and any instrument specific tab,
+        # added to the layout by the subclass
+        self.read_vars = {}
+        self.plot = PlotPanel(parent=self)
+        self.tabs = QTabWidget(parent=self)
+        self.tabs.addTab(self.plot, "Live")
+
+        # the settings a synchronised acquisition can step, by name: (cache key, setter)
+        self.step_targets = {}
         
     def window(self):
         """Adding instrument specific widgets to the layout."""
@@ -158,9 +409,76 @@ class Instrument_GUI(QWidget):
         """Initialise the instrument."""
         raise NotImplementedError
     
+    def _command_done(self, key: str, result):
+        self.command_done.emit(key, result)
+
+    def _command_error(self, key: str, e: Exception):
+        self.command_failed.emit(key, str(e))
+
+    @Slot(str, str)
+    def on_command_failed(self, key: str, error: str):
+        """Report a command that the instrument rejected."""
+        print(f"Command {key} failed: \n", error)
+
+    def plot_variable(self, name: str, var: ReadOnlyVar):
+        """Show the history of a read variable on the panel's plot."""
+        self.read_vars[name] = var
+        self.plot.add_trace(name, var.history)
+
+    def update_rate(self):
+        """Show the measured versus requested polling rate."""
+        stats = self.read_channel.stats()
+        if not stats:
+            self.rate.setText("")
+            return
+        self.rate.setText("Polling: " + ", ".join(
+            f"{s['measured_rate']:.2f} Hz (requested {s['requested_rate']:.2f} Hz)" for s in stats))
+
+    def update_stats(self):
+        """Show how many bus transactions the cache and the command queue avoided."""
+        cache = self.commands.cache.stats()
+        self.stats.setText(f"Bus transactions avoided: {cache['hits'] + self.commands.coalesced} "
+                           f"(cache hits {cache['hits']}, misses {cache['misses']}, "
+                           f"coalesced {self.commands.coalesced})\n"
+                           f"Display queue: max {self.read_channel.max_depth}, "
+                           f"skipped {self.read_channel.skipped} updates")
+
+    @Slot(bool)
+    def reset_cache(self, state: bool):
+        """The instrument may have changed while it was not connected."""
+        self.commands.clear()
+        self.commands.cache.invalidate()
+    
+    def settings(self) -> dict:
+        """The state of every setting of the panel, by attribute name."""
+        return {name: var.state() for name, var in vars(self).items()
+                if isinstance(var, Var) and not isinstance(var, Address) and var.state()}
+
+    def restore_settings(self, settings: dict):
+        """Fill in the settings captured by `settings`."""
+        for name, state in settings.items():
+            var = getattr(self, name, None)
+            if isinstance(var, Var):
+                var.restore(state)
+
+    @property
+    def connected(self) -> bool:
+        return self._addr.connect_status
+
+    def open(self, addr: str, timeout: float=None):
+        """Open the instrument at `addr`, blocking. Safe to call from any thread."""
+        self._addr.open(addr, timeout)
+
+    def busy(self) -> bool:
+        """Check if the instrument is being opened, polled or still has commands to send."""
+        return self._addr.in_progress or self.read_channel.is_running or not self.commands.wait(0)
+
     def delete(self):
         """Delete the instrument."""
-        self.read_channel.stop()
+        self.rate_timer.stop()
+        self.read_channel.delete()
+        self.commands.remove_listener(on_done=self._command_done, on_error=self._command_error)
+        self.device.close()
     
     @property
     def addr(self):
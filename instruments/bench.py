@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+
+from instruments.acquisition import Reader, SyncAcquisition
+from instruments.connect import connect_all
+from instruments.history import timestamp
+from instruments.registry import get_device_registry
+from instruments.session import read_session, write_session
+from instruments.visa import DEFAULT_TIMEOUT, resource_manager
+
+
+class Bench:
+    """
+    A set of instruments driven from a script, without Qt.
+
+    e.g.
+        with Bench() as bench:
+            psu = bench.add("psu", "AgilentE3640A", "GPIB0::5::INSTR")
+            pm = bench.add("pm", "Agilent8163B", "GPIB0::20::INSTR")
+            bench.connect()
+            psu.set("volt", 1.5)
+            print(pm.get("detect_pow"))
+            result = bench.acquire(("psu", "volt"), np.linspace(0, 2, 21), [("pm", "detect_pow")])
+            result.to_csv("heater.csv")
+    """
+    def __init__(self, rm=None):
+        self.rm = rm
+        self.devices = {}
+        self.addrs = {}
+        self.types = {}
+        self.server = None
+        self.recorder = None
+
+    def add(self, name: str, instr_type: str, addr: str=None, **kwargs):
+        """Add an instrument by its registered type, to be opened at `addr`."""
+        if name in self.devices:
+            raise ValueError(f"There is already an instrument called {name}.")
+        rm = self.rm if self.rm is not None else resource_manager()
+        device = get_device_registry().load(instr_type)(rm=rm, **kwargs)
+        self.devices[name] = device
+        self.addrs[name] = addr
+        self.types[name] = instr_type
+        return device
+
+    def __getitem__(self, name: str):
+        return self.devices[name]
+
+    def connect(self, timeout: float=DEFAULT_TIMEOUT, max_workers: int=8, initialise: bool=True) -> dict:
+        """
+        Open every instrument with an address at once and send their settings.
+        Raise ConnectionError naming the instruments that could not be opened,
+        and RuntimeError naming the settings that an instrument rejected.
+        """
+        def _open(name: str):
+            device = self.devices[name]
+            device.connect(self.addrs[name], timeout)
+            if initialise:
+                device.errors.clear()
+                device.initialise()
+
+        jobs = {name: (lambda name=name: _open(name)) for name, addr in self.addrs.items()
+                if addr and not self.devices[name].connected}
+        results = connect_all(jobs, max_workers=max_workers)
+        failed = {name: result.error for name, result in results.items() if not result.ok}
+        if failed:
+            raise ConnectionError("Could not open " + ", ".join(f"{name} ({e})" for name, e in failed.items()))
+        self.wait()
+        if initialise:
+            # the settings are sent in the background, each failing on its own
+            failed = {name: dict(self.devices[name].errors) for name in jobs if self.devices[name].errors}
+            if failed:
+                raise RuntimeError("Could not initialise " + ", ".join(
+                    f"{name} ({', '.join(f'{key}: {e}' for key, e in errors.items())})"
+                    for name, errors in failed.items()))
+        return results
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for the queued commands of every instrument to be sent."""
+        end = None if timeout is None else time.monotonic() + timeout
+        for device in self.devices.values():
+            remaining = None if end is None else max(0.0, end - time.monotonic())
+            if not device.wait(remaining):
+                return False
+        return True
+
+    def record(self, duration: float, period: float=None) -> dict:
+        """
+        Poll every instrument for `duration` s and return the readings taken,
+        as (times, values) arrays by "instrument: parameter".
+        """
+        start = timestamp()
+        polling = {name: device.poller.is_running for name, device in self.devices.items()}
+        for device in self.devices.values():
+            if period is not None:
+                device.poller.set_period(period)
+            device.poller.start()
+        try:
+            time.sleep(duration)
+        finally:
+            for name, device in self.devices.items():
+                device.poller.change_state(polling[name])
+        readings = {}
+        for name, device in self.devices.items():
+            for key, param in device.params.items():
+                if param.history is not None:
+                    t, v = param.history.since(start)
+                    readings[f"{name}: {key}"] = (np.array(t), np.array(v))
+        return readings
+
+    def acquire(self, step: tuple, setpoints, reads: list, settle: float=0.0, samples: int=1):
+        """
+        Step a parameter and read others at every step on a common timebase,
+        see `SyncAcquisition`.
+
+        Parameters
+        ----------
+        step: (str, str)
+            The instrument and parameter to step
+        setpoints: array
+            The values to step through
+        reads: list of (str, str)
+            The instruments and parameters to read at every step
+        """
+        name, key = step
+        stepper = self.devices[name]
+        readers = [Reader(f"{device}: {param}", self.devices[device][param].read,
+                          lock=self.devices[device].commands.lock) for device, param in reads]
+        acquisition = SyncAcquisition(stepper[key].setter, setpoints, readers, settle=settle,
+                                      samples=samples, step_lock=stepper.commands.lock)
+        try:
+            return acquisition.run()
+        finally:
+            # the setpoints were written around the command queue
+            stepper.commands.cache.invalidate(key)
+
+    def save_session(self, path: str):
+        """Save the instruments and the value of every parameter, see `instruments.session`."""
+        write_session(path, {"instruments": [
+            {"id": name, "type": self.types[name], "addr": self.addrs[name] or "", "settings": {},
+             "params": device.settings()} for name, device in self.devices.items()]})
+
+    def load_session(self, path: str) -> dict:
+        """
+        Take the parameters of a session, adding the instruments that are missing.
+        Connected instruments are only sent the parameters that differ from their
+        state. Return the keys sent by instrument.
+        """
+        sent = {}
+        for data in read_session(path)["instruments"]:
+            name = data["id"]
+            if name not in self.devices:
+                self.add(name, data["type"], data["addr"] or None)
+            elif self.types[name] != data["type"]:
+                raise ValueError(f"{name} is a {self.types[name]}, not a {data['type']}.")
+            sent[name] = self.devices[name].apply(data["params"])
+        self.wait()
+        return sent
+
+    def serve(self, port: int=None, host: str="127.0.0.1"):
+        """
+        Serve the instruments to other processes while the script runs, see
+        `ControlServer`, and return the started server.
+        """
+        from instruments.server import DEFAULT_PORT, ControlServer
+        self.server = ControlServer(self.devices, host=host, port=DEFAULT_PORT if port is None else port)
+        self.server.start()
+        return self.server
+
+    def stream(self, directory: str, **kwargs):
+        """
+        Write every reading of the polling to Parquet files in `directory` while
+        the script runs, see `Recorder` for the options, and return the started recorder.
+        """
+        from instruments.recorder import Recorder
+        self.recorder = Recorder(self.devices, directory, **kwargs)
+        self.recorder.start()
+        return self.recorder
+
+    def close(self):
+        """Stop polling and close every instrument."""
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+        for device in self.devices.values():
+            if device.connected:
+                try:
+                    device.disconnect()
+                except Exception as e:
+                    print("Disconnect issue: \n", e)
+            device.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
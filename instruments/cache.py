@@ -0,0 +1,64 @@
+import threading
+
+_MISSING = object()
+
+
+class ParamCache:
+    """
+    A shadow of the last known state of an instrument.
+    It holds the values that were last written to or read from the instrument, so
+    unchanged writes and repeated queries can be answered without a bus transaction.
+    It must be invalidated whenever the instrument state may have changed behind
+    its back, e.g. on reconnect or after an error.
+    """
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._values
+
+    def get(self, key: str, default=None):
+        """Get a cached value without counting a hit or a miss."""
+        with self._lock:
+            return self._values.get(key, default)
+
+    def lookup(self, key: str):
+        """Return (True, value) on a hit and (False, None) on a miss."""
+        with self._lock:
+            value = self._values.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, value
+
+    def matches(self, key: str, value) -> bool:
+        """Check if writing `value` would leave the instrument unchanged."""
+        with self._lock:
+            if self._values.get(key, _MISSING) == value:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def store(self, key: str, value):
+        """Remember the value that the instrument now holds."""
+        with self._lock:
+            self._values[key] = value
+
+    def invalidate(self, *keys: str):
+        """Forget the given keys, or everything if no key is given."""
+        with self._lock:
+            if not keys:
+                self._values.clear()
+            for key in keys:
+                self._values.pop(key, None)
+
+    def stats(self) -> dict:
+        """The bus transactions avoided (hits) and made (misses)."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._values)}
@@ -0,0 +1,236 @@
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from instruments.cache import ParamCache
+from instruments.scpi import ScpiBatch
+
+
+class CommandQueue:
+    """
+    A background queue of commands for one instrument.
+    Commands are keyed by the parameter they change: submitting a command for a
+    key that is still waiting replaces it, so only the latest value is sent.
+    The commands share a lock with the read channel so the instrument is never
+    talked to from two threads at once, and a shadow cache of the instrument
+    state so writes that would not change anything are skipped.
+    """
+    def __init__(self, name: str=None, lock=None, instr=None):
+        self.name = name
+        self._instr = weakref.ref(instr) if instr is not None else None
+        # the batch being collected by each thread, by thread id
+        self._batches = {}
+        self.lock = lock if lock is not None else threading.RLock()
+        self.cache = ParamCache()
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._busy = False
+        # the keys of the command being sent, whose values the cache does not hold yet
+        self._inflight = set()
+        self._closed = False
+        self._unkeyed = itertools.count()
+        self._done_listeners = []
+        self._error_listeners = []
+        self.sent = 0
+        self.coalesced = 0
+
+    def add_listener(self, on_done=None, on_error=None):
+        """
+        Add functions called with (key, result) when a command completes and
+        (key, exception) when it fails. They are called from the worker thread.
+        """
+        if on_done is not None:
+            self._done_listeners.append(on_done)
+        if on_error is not None:
+            self._error_listeners.append(on_error)
+
+    def remove_listener(self, on_done=None, on_error=None):
+        """Remove functions added by `add_listener`."""
+        if on_done in self._done_listeners:
+            self._done_listeners.remove(on_done)
+        if on_error in self._error_listeners:
+            self._error_listeners.remove(on_error)
+
+    def submit(self, key: str, func, *args, callback=None, cache: bool=True, **kwargs):
+        """
+        Queue `func(*args, **kwargs)` under `key`, replacing any command for the
+        same key that has not been sent yet. `callback` receives the result.
+        The command is skipped if the cache says the instrument already holds
+        the value, unless `cache` is False or `key` is None, or a command for the
+        key is still queued or being sent, as it will change what the instrument
+        holds.
+        """
+        value = args[0] if len(args) == 1 else args
+        with self._cond:
+            batch = self._batches.get(threading.get_ident())
+            batching = batch is not None
+            pending = batch if batching else self._pending
+            if key is None:
+                key, cache = f"_{next(self._unkeyed)}", False
+            if key in pending:
+                self.coalesced += 1
+                del pending[key]
+            elif cache and not self._queued(key) and self.cache.matches(key, value):
+                return
+            # the latest command goes last so it still follows the ones it depends on
+            pending[key] = (func, args, kwargs, callback, value if cache else None)
+            if not batching:
+                self._start()
+                self._cond.notify()
+
+    def _keys(self, key: str, func, args: tuple) -> set:
+        """The keys a queued command writes: those of its commands for a batch."""
+        return set(args[0]) if func == self._run_batch else {key}
+
+    def _queued(self, key: str) -> bool:
+        """Check if a command for `key` is waiting or being sent, with the queue locked."""
+        if key in self._pending or key in self._inflight:
+            return True
+        return any(key in self._keys(other, func, args) for other, (func, args, *_) in self._pending.items())
+
+    @contextmanager
+    def batch(self, key: str="batch"):
+        """
+        Collect the commands submitted by this thread within the block and send
+        them as a single queued command, compiled into compound SCPI messages.
+        A batch still waiting under the same key takes in the new commands
+        instead of being replaced, so none of its commands are lost.
+        """
+        thread = threading.get_ident()
+        with self._cond:
+            self._batches[thread] = OrderedDict()
+        try:
+            yield
+        finally:
+            with self._cond:
+                commands = self._batches.pop(thread)
+                if commands and key in self._pending and self._pending[key][0] == self._run_batch:
+                    merged = self._pending[key][1][0]
+                    for other in commands:
+                        merged.pop(other, None)
+                    merged.update(commands)
+                    commands = merged
+                if commands:
+                    self.submit(key, self._run_batch, commands, cache=False)
+
+    def _run_batch(self, commands: OrderedDict):
+        """
+        Run the commands of a batch within one compound transaction.
+        A command that fails is reported under its own key, as if it had been
+        sent alone, and the rest of the batch still goes out.
+        """
+        instr = self._instr() if self._instr is not None else None
+        try:
+            with ScpiBatch(instr) if instr is not None else nullcontext() as batch:
+                for key, (func, args, kwargs, callback, value) in commands.items():
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        # the writes recorded before the failure are sent as they would have been
+                        if batch is not None:
+                            batch.flush(sync=False)
+                        self.cache.invalidate(key)
+                        for listener in self._error_listeners:
+                            listener(key, e)
+                        continue
+                    if value is not None:
+                        self.cache.store(key, value)
+                    if callback is not None:
+                        callback(result)
+        except Exception:
+            # the writes of the batch may have been only partly applied
+            self.cache.invalidate(*commands)
+            raise
+
+    def query(self, key: str, func, *args, callback=None, cached: bool=True, **kwargs):
+        """
+        Queue a query whose result is cached under `key`. On a cache hit the
+        callback is called straight away and nothing is sent, unless `cached` is
+        False, e.g. when a write still queued may change the value.
+        """
+        if cached:
+            hit, value = self.cache.lookup(key)
+            if hit:
+                if callback is not None:
+                    callback(value)
+                return
+
+        def _query():
+            result = func(*args, **kwargs)
+            self.cache.store(key, result)
+            return result
+        self.submit(key, _query, callback=callback, cache=False)
+
+    def pending(self) -> int:
+        """Number of commands waiting to be sent."""
+        with self._cond:
+            return len(self._pending)
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for every queued command to be sent. Return False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def clear(self):
+        """Drop the commands that have not been sent yet."""
+        with self._cond:
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def close(self):
+        """Stop the worker once the queued commands are sent. Later commands start it again."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _start(self):
+        self._closed = False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"commands-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Send the queued commands one at a time."""
+        while True:
+            with self._cond:
+                self._busy = False
+                self._inflight = set()
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    self._thread = None
+                    return
+                key, (func, args, kwargs, callback, value) = self._pending.popitem(last=False)
+                self._inflight = self._keys(key, func, args)
+                self._busy = True
+
+            try:
+                with self.lock:
+                    result = func(*args, **kwargs)
+                self.sent += 1
+                if value is not None:
+                    self.cache.store(key, value)
+                if callback is not None:
+                    callback(result)
+            except Exception as e:
+                # the instrument state is unknown after a failed command
+                self.cache.invalidate(key)
+                for listener in self._error_listeners:
+                    listener(key, e)
+                continue
+
+            for listener in self._done_listeners:
+                listener(key, result)
+
+
+_queues = weakref.WeakKeyDictionary()
+
+def command_queue(instr) -> CommandQueue:
+    """Get the command queue of an instrument driver, creating it on first use."""
+    queue = _queues.get(instr)
+    if queue is None:
+        queue = _queues[instr] = CommandQueue(name=instr.__class__.__name__, instr=instr)
+    return queue
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class ConnectResult:
+    """The outcome of opening one instrument."""
+    def __init__(self, name: str, error: Exception=None, duration: float=0.0):
+        self.name = name
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"ConnectResult({self.name}, {status}, {self.duration:.2f} s)"
+
+
+def _attempt(name: str, func) -> ConnectResult:
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        return ConnectResult(name, e, time.perf_counter() - start)
+    return ConnectResult(name, None, time.perf_counter() - start)
+
+
+def connect_all(jobs: dict, max_workers: int=8, on_progress=None) -> dict:
+    """
+    Open many instruments at once in a bounded pool of workers.
+
+    Each job opens one instrument and is expected to enforce its own timeout,
+    e.g. through `visa.open_session`, so bringing up a rack takes about as long
+    as its slowest instrument rather than the sum of all of them.
+
+    Parameters
+    ----------
+    jobs: dict
+        Functions that open an instrument, by name
+    max_workers: int
+        The most instruments opened at the same time
+    on_progress: callable
+        Called with (done, total, result) from the worker as each job finishes
+    """
+    results = {}
+    if not jobs:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)), thread_name_prefix="connect") as pool:
+        futures = [pool.submit(_attempt, name, func) for name, func in jobs.items()]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[result.name] = result
+            if on_progress is not None:
+                on_progress(done, len(jobs), result)
+    return results
@@ -0,0 +1,413 @@
+import threading
+from functools import partial
+
+from instruments.scheduler import get_scheduler
+from instruments.history import RingBuffer, timestamp
+from instruments.commands import command_queue
+from instruments.visa import DEFAULT_TIMEOUT, resource_manager, open_session, close_session
+
+
+# returned by a polled callback with no new result, which is not handed to the listeners
+NOTHING = object()
+
+
+class Poller:
+    """
+    A set of callbacks polled in the background by the shared scheduler.
+    The results are handed to the listeners from the worker threads.
+    """
+    MIN_PERIOD = 0.01
+    MAX_PERIOD = 3600.0
+
+    def __init__(self, period: float=0.5, scheduler=None, lock=None, name: str=None):
+        self.name = name
+        self.is_running = False
+        self.period = self.check_period(period)
+        self.callbacks = []
+        self.tasks = []
+        self.listeners = []
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        # callbacks of the same instrument must not talk to it at the same time
+        self.lock = lock if lock is not None else threading.Lock()
+        # a worker process polling the instrument in place of this one, see `instruments.worker`
+        self.remote = None
+
+    @classmethod
+    def check_period(cls, period: float) -> float:
+        """Make sure the polling period is within the supported range."""
+        period = float(period)
+        if not cls.MIN_PERIOD <= period <= cls.MAX_PERIOD:
+            raise ValueError(f"Polling period must be between {cls.MIN_PERIOD} s and {cls.MAX_PERIOD} s.")
+        return period
+
+    def add_listener(self, func):
+        """Add a function called with every result."""
+        self.listeners.append(func)
+
+    def remove_listener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+
+    def _publish(self, data):
+        if data is NOTHING:
+            return
+        for listener in self.listeners:
+            listener(data)
+
+    def register_callback(self, func, period: float=None, name: str=None):
+        """Register a function to be run in the background, named `name` in the statistics."""
+        self.callbacks.append((func, period, name))
+        if self.is_running:
+            self._schedule(func, period, name)
+
+    def set_period(self, period: float):
+        """Change the polling period of the callbacks without their own period."""
+        self.period = self.check_period(period)
+        if self.is_running:
+            self.stop(wait=False)
+            self.start()
+
+    def _schedule(self, func, period: float=None, name: str=None):
+        if name is None:
+            name = getattr(func, "__qualname__", repr(func))
+        if self.name:
+            name = f"{self.name}: {name}"
+        task = self.scheduler.register(func, period if period else self.period,
+                                       on_result=self._publish, lock=self.lock, name=name)
+        self.tasks.append(task)
+
+    def start(self):
+        """Start polling the callbacks."""
+        if self.is_running:
+            return
+        self.is_running = True
+        if self.remote is not None:
+            self.remote.start(self.period)
+        for func, period, name in self.callbacks:
+            self._schedule(func, period, name)
+
+    def change_state(self, state: bool):
+        """Change the state of the poller."""
+        if state:
+            self.start()
+        else:
+            self.stop()
+
+    def stop(self, wait: bool=True):
+        """
+        Stop polling the callbacks.
+        Nothing is killed: no new reads are started and, if `wait` is set, the
+        read in flight is given at most one polling period to return.
+        """
+        self.is_running = False
+        if self.remote is not None:
+            self.remote.stop(wait)
+        for task in self.tasks:
+            self.scheduler.unregister(task, timeout=task.period if wait else 0)
+        self.tasks.clear()
+
+    def stats(self) -> list:
+        """Return the requested versus measured rates of the callbacks."""
+        if self.remote is not None:
+            return self.remote.stats()
+        return [task.stats() for task in self.tasks]
+
+
+class Parameter:
+    """
+    One setting or reading of a device.
+
+    Writes are queued on the device's command queue under the parameter's key, so
+    they never block the caller, a newer value replaces one not sent yet and a
+    value the instrument already holds is not sent again. The last value set is
+    kept so the settings can be sent again, e.g. after reconnecting.
+
+    Parameters
+    ----------
+    device: Device
+        The device the parameter belongs to
+    key: str
+        The name of the parameter, also its key in the command queue and cache
+    getter, setter: callable
+        The driver calls reading and writing the parameter
+    unit: str
+        The unit of the value
+    value:
+        The initial setting, sent when the device is initialised
+    record: bool
+        Keep a history of the readings taken with `sample`
+    cache: bool
+        Skip the writes the cache says the instrument holds; False for a value
+        that other commands change as well, so the cache cannot be trusted
+    """
+    def __init__(self, device, key: str, getter=None, setter=None, unit: str="", value=None,
+                 record: bool=False, cache: bool=True):
+        self.device = device
+        self.key = key
+        self.getter = getter
+        self.setter = setter
+        self.unit = unit
+        self.value = value
+        self.cache = cache
+        self.history = RingBuffer(memory_limit=device.memory_limit) if record else None
+        self.listeners = []
+
+    @property
+    def readable(self) -> bool:
+        return self.getter is not None
+
+    @property
+    def writable(self) -> bool:
+        return self.setter is not None
+
+    def add_listener(self, func):
+        """
+        Add a function called with (param, t, value) for every sample, from the
+        polling thread, so one reading can be handed to many consumers.
+        """
+        self.listeners.append(func)
+
+    def remove_listener(self, func):
+        if func in self.listeners:
+            self.listeners.remove(func)
+
+    def read(self):
+        """Read the value from the instrument, without taking the device lock."""
+        if self.getter is None:
+            raise AttributeError(f"{self.key} cannot be read.")
+        return self.getter()
+
+    def get(self):
+        """Read the value from the instrument, waiting for the bus."""
+        with self.device.commands.lock:
+            return self.read()
+
+    def sample(self):
+        """Read the value and record it in the history."""
+        value = self.read()
+        t = timestamp()
+        if self.history is not None:
+            self.history.append(t, value)
+        for listener in self.listeners:
+            listener(self, t, value)
+        return value
+
+    def extend(self, t, values):
+        """Record a block of readings taken otherwise, e.g. logged by the instrument."""
+        if self.history is not None:
+            self.history.extend(t, values)
+        for listener in self.listeners:
+            for ti, value in zip(t.tolist(), values.tolist()):
+                listener(self, ti, value)
+
+    def query(self, callback=None, cached: bool=True):
+        """
+        Read the value on the command queue, answered from the cache if known
+        and `cached` is set, or after the commands queued before otherwise.
+        """
+        self.device.commands.query(self.key, self.read, callback=callback, cached=cached)
+
+    def set(self, value, wait: bool=False, callback=None):
+        """
+        Queue a write of the value, waiting for it to be sent if `wait` is set.
+        Without a connection the value is only kept, to be sent by `initialise`.
+        """
+        if self.setter is None:
+            raise AttributeError(f"{self.key} cannot be set.")
+        self.value = value
+        if not self.device.connected:
+            return
+        self.device.commands.submit(self.key, self.setter, value, callback=callback, cache=self.cache)
+        if wait:
+            self.device.commands.wait()
+
+    def __repr__(self):
+        return f"Parameter({self.key}, value={self.value!r}, unit={self.unit!r})"
+
+
+class Device:
+    """
+    An instrument without a GUI: its parameters, command queue and polling.
+    Subclasses set the pyoctal `driver` and add their parameters in `setup`.
+
+    e.g.
+        psu = AgilentE3640A()
+        psu.connect("GPIB0::5::INSTR")
+        psu.set("volt", 1.5)
+        psu.get("curr")
+
+    With `process` set, the instrument is opened and polled in a worker process,
+    see `instruments.worker`: True for a process of its own, or a group name for
+    the process shared by the devices of the group. `Device.process` is the
+    default for the devices created without it.
+    """
+    name = "Device"
+    driver = None
+    memory_limit = RingBuffer.DEFAULT_MEMORY_LIMIT
+    process = False
+
+    def __init__(self, rm=None, instr=None, period: float=0.5, process=None):
+        if instr is None:
+            instr = self.driver(rm=rm if rm is not None else resource_manager())
+        self.instr = instr
+        if process is not None:
+            self.process = process
+        self.worker = None
+        self.commands = command_queue(instr)
+        self.poller = Poller(period=period, lock=self.commands.lock)
+        # the last error of each command, so a script can tell that a write failed
+        self.errors = {}
+        self.commands.add_listener(on_error=self._command_error)
+        self.params = {}
+        self.polled = []
+        self.addr = None
+        self.connected = False
+        self.setup()
+
+    def setup(self):
+        """Add the parameters of the device."""
+
+    def _command_error(self, key: str, e: Exception):
+        self.errors[key] = e
+
+    def add(self, key: str, **kwargs) -> Parameter:
+        """Add a parameter to the device."""
+        param = self.params[key] = Parameter(self, key, **kwargs)
+        return param
+
+    def __getitem__(self, key: str) -> Parameter:
+        return self.params[key]
+
+    def get(self, key: str):
+        """Read a parameter from the instrument."""
+        return self.params[key].get()
+
+    def set(self, key: str, value, wait: bool=True):
+        """
+        Set a parameter, by default waiting for it to be sent and raising the
+        error of the instrument if it failed.
+        """
+        self.errors.pop(key, None)
+        self.params[key].set(value, wait=wait)
+        if wait and key in self.errors:
+            raise self.errors.pop(key)
+
+    def connect(self, addr: str, timeout: float=DEFAULT_TIMEOUT):
+        """Open the instrument, blocking until it answers or the timeout expires."""
+        with self.commands.lock:
+            if self.process:
+                self._open_worker(addr, timeout)
+            else:
+                open_session(self.instr, addr, timeout)
+        self.addr = addr
+        self.poller.name = addr
+        self.connected = True
+        # the instrument may have changed while it was not connected
+        self.commands.clear()
+        self.commands.cache.invalidate()
+
+    def disconnect(self):
+        """Stop polling and close the instrument."""
+        self.poller.stop()
+        with self.commands.lock:
+            if self.connected:
+                self.instr.disconnect()
+            if self.worker is not None:
+                self._close_worker()
+            else:
+                close_session(self.instr)
+        self.connected = False
+
+    def _open_worker(self, addr: str, timeout: float):
+        from instruments.worker import DeviceWorker
+        worker = DeviceWorker(self, group=self.process if isinstance(self.process, str) else None)
+        worker.open(addr, timeout)
+        self.worker = worker
+        self.instr._addr = addr
+        self.instr._identity = worker.identity
+        self.instr._instr = worker.resource
+        self.poller.remote = worker
+
+    def _close_worker(self):
+        worker, self.worker = self.worker, None
+        self.poller.remote = None
+        self.instr._instr = None
+        worker.close()
+
+    def initialise(self):
+        """Send every setting to the instrument as one compound transaction."""
+        with self.commands.batch("initialise"):
+            self.apply_settings()
+
+    def apply_settings(self):
+        """Send every parameter that has a setting."""
+        for param in self.params.values():
+            if param.writable and param.value is not None:
+                param.set(param.value)
+
+    def settings(self) -> dict:
+        return {key: param.value for key, param in self.params.items()
+                if param.writable and param.value is not None}
+
+    def restore(self, settings: dict):
+        """Take the settings of `settings` without sending them."""
+        for key, value in settings.items():
+            if key in self.params:
+                self.params[key].value = value
+
+    def changes(self, settings: dict) -> dict:
+        """
+        The settings of `settings` that the instrument is not known to hold,
+        going by the cache: a parameter never written or read, or not cached, is
+        a change.
+        """
+        cache = self.commands.cache
+        return {key: value for key, value in settings.items()
+                if key in self.params and self.params[key].writable and
+                (not self.params[key].cache or key not in cache or cache.get(key) != value)}
+
+    def apply(self, settings: dict) -> list:
+        """
+        Take the settings of `settings`, sending only the ones that differ from
+        the state of the instrument as one compound transaction.
+        Return the keys sent.
+        """
+        self.restore(settings)
+        changes = self.changes(settings)
+        if changes and self.connected:
+            with self.commands.batch("restore"):
+                for key, value in changes.items():
+                    self.params[key].set(value)
+        return list(changes)
+
+    def poll(self, key: str, period: float=None) -> Parameter:
+        """Sample a parameter in the background while the device is on."""
+        param = self.params[key]
+        self.polled.append(key)
+        self.poller.register_callback(partial(self._sample, param), period, name=key)
+        return param
+
+    def _sample(self, param: Parameter):
+        # in a worker process the readings are taken there and only collected here
+        if self.worker is not None:
+            return self.worker.collect(param)
+        return param.sample()
+
+    def state(self, val: bool):
+        """Turn the device on/off, polling while it is on."""
+        self.poller.change_state(val)
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for the queued commands to be sent."""
+        return self.commands.wait(timeout)
+
+    def close(self):
+        """Stop polling and release the command queue and the session."""
+        self.poller.stop()
+        self.commands.remove_listener(on_error=self._command_error)
+        self.commands.close()
+        if self.worker is not None:
+            self._close_worker()
+        else:
+            close_session(self.instr)
+        self.connected = False
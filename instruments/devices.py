@@ -0,0 +1,178 @@
+import numpy as np
+
+from pyoctal.instruments import Agilent8163B as Agilent8163BDriver
+from pyoctal.instruments import Agilent8164B as Agilent8164BDriver
+from pyoctal.instruments import AgilentE3640A as AgilentE3640ADriver
+
+from instruments.core import Device
+from instruments.sweep import Spectrum, PowerBurst, WavelengthSweep, VoltageSweep
+from unit import power_convert
+
+
+class Agilent816xB(Device):
+    """An Agilent 8163B/8164B mainframe with a laser and a power meter."""
+    name = "Agilent 816xB"
+
+    def setup(self):
+        instr = self.instr
+        self.add("laser_wav", setter=instr.set_laser_wav, unit="nm", value=1550.0)
+        self.add("laser_unit", setter=instr.set_laser_unit, value="dBm")
+        self.add("laser_pow", setter=instr.set_laser_pow, value=0.0)
+        self.add("detect_wav", setter=instr.set_detect_wav, unit="nm", value=1550.0)
+        self.add("detect_unit", setter=instr.set_detect_unit, value="dBm")
+        self.add("detect_avgtime", setter=instr.set_detect_avgtime, unit="s", value=0.1)
+        self.add("detect_pow", getter=instr.get_detect_pow, record=True)
+        self.poll("detect_pow")
+
+    def initialise(self):
+        # sent as one compound transaction instead of a round-trip per setting
+        with self.commands.batch("initialise"):
+            self.apply_settings()
+            self.state(False)
+
+    def state(self, val: bool):
+        """Turn the laser on/off."""
+        if not val:
+            # let the read in flight finish before switching the laser off
+            self.poller.stop()
+        self.commands.submit("laser_state", self.instr.set_laser_state, val)
+        self.poller.change_state(val)
+
+    def sweep(self, **params) -> Spectrum:
+        """Run a wavelength sweep, see `WavelengthSweep` for the parameters."""
+        return self.run_sweep(WavelengthSweep(self.instr, **params))
+
+    def burst(self, **params) -> Spectrum:
+        """
+        Log a burst of power readings, see `PowerBurst` for the parameters, and
+        add them to the history of the power. Return their times and powers in
+        the unit of the power meter.
+        """
+        return self.run_burst(PowerBurst(self.instr, **params))
+
+    def run_burst(self, burst: PowerBurst, polling: bool=None) -> Spectrum:
+        """Run a burst with the polling paused and record it like the polled readings."""
+        if polling is None:
+            polling = self.poller.is_running
+        param = self.params["detect_pow"]
+        self.poller.stop()
+        try:
+            with self.commands.lock:
+                result = burst.run()
+                # the logging is always in W, the polled readings in the unit of the power meter
+                if self.params["detect_unit"].value == "dBm":
+                    result.y = power_convert(result.y, "W", "dBm")
+                    # samples without power have no level in dBm
+                    result.y[np.isneginf(result.y)] = np.nan
+                # recorded before the polling resumes, so the history stays in time order
+                if self.worker is not None:
+                    self.worker.collect(param)
+                param.extend(result.x, result.y)
+            return result
+        finally:
+            self.resume(polling)
+
+    def run_sweep(self, sweeper: WavelengthSweep, polling: bool=None) -> Spectrum:
+        """Run a sweep with the polling paused, then put the settings back."""
+        if polling is None:
+            polling = self.poller.is_running
+        # the power meter is busy logging during the sweep
+        self.poller.stop()
+        try:
+            with self.commands.lock:
+                return sweeper.run()
+        finally:
+            self.resume(polling)
+
+    def resume(self, polling: bool):
+        """Re-apply the settings after a sweep changed them."""
+        self.commands.cache.invalidate()
+        with self.commands.batch("restore"):
+            self.apply_settings()
+            self.commands.submit("laser_state", self.instr.set_laser_state, polling)
+        self.poller.change_state(polling)
+
+
+class Agilent8163B(Agilent816xB):
+    name = "Agilent 8163B"
+    driver = Agilent8163BDriver
+
+
+class Agilent8164B(Agilent816xB):
+    name = "Agilent 8164B"
+    driver = Agilent8164BDriver
+
+
+class AgilentE3640A(Device):
+    """An Agilent E3640A DC power supply."""
+    name = "Agilent E3640A"
+    driver = AgilentE3640ADriver
+
+    def setup(self):
+        instr = self.instr
+        self.add("vrange", setter=self._set_range, value="LOW")
+        self.add("volt_lim", setter=self._set_volt_lim, unit="V", value="0")
+        self.add("curr_lim", setter=self._set_curr_lim, unit="A", value="0")
+        # the limits are set with APPLY, which sets the voltage too, so it is sent after them
+        self.add("volt", setter=instr.set_volt, unit="V", value="0", cache=False)
+        self.add("curr", getter=instr.get_curr, unit="A", record=True)
+        self.add("volt_max", getter=instr.get_volt_max, unit="V")
+        self.add("curr_max", getter=instr.get_curr_max, unit="A")
+        self.poll("curr")
+
+    def _set_range(self, value: str):
+        self.instr.set_volt_range(value)
+        # the maximum values depend on the range
+        self.commands.cache.invalidate("volt_max", "curr_max")
+
+    def _set_volt_lim(self, volt_lim: str):
+        # the other limit is kept from the cache instead of being queried
+        hit, curr_lim = self.commands.cache.lookup("curr_lim")
+        if not hit:
+            _, curr_lim = self.instr.get_params()
+            self.commands.cache.store("curr_lim", curr_lim)
+        self.instr.set_params(volt_lim, curr_lim)
+        # APPLY sets the output voltage too
+        self.commands.cache.invalidate("volt")
+
+    def _set_curr_lim(self, curr_lim: str):
+        hit, volt_lim = self.commands.cache.lookup("volt_lim")
+        if not hit:
+            volt_lim, _ = self.instr.get_params()
+            self.commands.cache.store("volt_lim", volt_lim)
+        self.instr.set_params(volt_lim, curr_lim)
+        self.commands.cache.invalidate("volt")
+
+    def state(self, val: bool):
+        """Turn the output on/off."""
+        if not val:
+            self.poller.stop()
+        self.commands.submit("output_state", self.instr.set_output_state, val)
+        self.poller.change_state(val)
+
+    def sweep(self, **params):
+        """
+        Run a voltage sweep limited by the current limit, see `VoltageSweep` for the
+        parameters, and return the measured voltages [V] and currents [A].
+        """
+        params.setdefault("compliance", float(self.params["curr_lim"].value))
+        return self.run_sweep(VoltageSweep(self.instr, **params))
+
+    def run_sweep(self, sweeper: VoltageSweep, polling: bool=None):
+        """Run a sweep with the polling paused, then put the settings back."""
+        if polling is None:
+            polling = self.poller.is_running
+        self.poller.stop()
+        try:
+            with self.commands.lock:
+                return sweeper.run()
+        finally:
+            self.resume(polling)
+
+    def resume(self, polling: bool):
+        """Put the supply back to its settings after a sweep."""
+        self.commands.cache.invalidate()
+        with self.commands.batch("restore"):
+            self.apply_settings()
+            self.commands.submit("output_state", self.instr.set_output_state, polling)
+        self.poller.change_state(polling)
@@ -0,0 +1,105 @@
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QTableWidget,
+                               QTableWidgetItem, QHeaderView, QFileDialog)
+from PySide6.QtCore import QTimer, Qt, Slot
+
+from instruments.metrics import GAUGES, get_metrics
+from instruments.scheduler import get_scheduler
+
+
+class DiagnosticsPanel(QWidget):
+    """
+    The live timing of every SCPI command by instrument, and of the polling.
+    A long latency points at a slow instrument, a long wait at contention for
+    the bus and overruns at polling faster than the instrument can answer.
+    """
+    command_columns = ["Instrument", "Command", "Count", "Mean [ms]", "p50 [ms]", "p95 [ms]", "Max [ms]",
+                       "Wait p95 [ms]", "Timeouts", "Errors"]
+    poll_columns = ["Task", "Requested [Hz]", "Measured [Hz]", "Samples", "Overruns", "Last [ms]"]
+    gauge_columns = ["Instrument"] + list(GAUGES)
+
+    def __init__(self, parent=None, refresh: int=1000):
+        super().__init__(parent)
+        self.metrics = get_metrics()
+        layout = QVBoxLayout(self)
+
+        layout.addWidget(QLabel("SCPI commands:", parent=self))
+        self.commands = self._table(self.command_columns)
+        layout.addWidget(self.commands, 2)
+        layout.addWidget(QLabel("Polling:", parent=self))
+        self.polls = self._table(self.poll_columns)
+        layout.addWidget(self.polls, 1)
+        layout.addWidget(QLabel("Display queues:", parent=self))
+        self.gauges = self._table(self.gauge_columns)
+        layout.addWidget(self.gauges, 1)
+
+        buttons = QHBoxLayout()
+        self.reset_button = QPushButton("Reset", parent=self)
+        self.reset_button.clicked.connect(self.reset)
+        buttons.addWidget(self.reset_button)
+        self.export_button = QPushButton("Export", parent=self)
+        self.export_button.clicked.connect(self.export)
+        buttons.addWidget(self.export_button)
+        buttons.addStretch()
+        layout.addLayout(buttons)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(refresh)
+
+    def _table(self, columns: list) -> QTableWidget:
+        table = QTableWidget(0, len(columns), parent=self)
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        return table
+
+    @staticmethod
+    def _fill(table: QTableWidget, rows: list):
+        table.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                text = f"{value:.2f}" if isinstance(value, float) else str(value)
+                item = table.item(i, j)
+                if item is None:
+                    item = QTableWidgetItem()
+                    if j > 1:
+                        item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                    table.setItem(i, j, item)
+                item.setText(text)
+
+    @Slot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+        rows = []
+        for (instrument, command), metrics in sorted(self.metrics.commands().items()):
+            latency = metrics.latency
+            rows.append([instrument, command, latency.count, latency.mean * 1E3, latency.quantile(0.5) * 1E3,
+                         latency.quantile(0.95) * 1E3, latency.max * 1E3, metrics.wait.quantile(0.95) * 1E3,
+                         metrics.timeouts, metrics.errors])
+        self._fill(self.commands, rows)
+        self._fill(self.polls, [[s["name"], s["requested_rate"], s["measured_rate"], s["count"], s["overruns"],
+                                 s["last_duration"] * 1E3] for s in get_scheduler().stats()])
+        gauges = {}
+        for (name, instrument), value in self.metrics.gauges().items():
+            gauges.setdefault(instrument, {})[name] = value
+        self._fill(self.gauges, [[instrument] + [values.get(name, "") for name in GAUGES]
+                                 for instrument, values in sorted(gauges.items())])
+
+    @Slot()
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    @Slot()
+    def export(self):
+        """Save the metrics in the Prometheus text format."""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Export metrics", "metrics.prom",
+                                                   "Prometheus text (*.prom);;All files (*)")
+        if not file_path:
+            return
+        try:
+            self.metrics.write(file_path, get_scheduler().stats())
+        except OSError as e:
+            print("Metrics export issue: \n", e)
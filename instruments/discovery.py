@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from instruments.registry import get_registry
+
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".pyoctal_gui", "idn_cache.json")
+
+
+class Found:
+    """A resource found on the bus, with its identity and matching instrument type."""
+    def __init__(self, resource: str, idn: str=None, instr_type: str=None, error: str=None):
+        self.resource = resource
+        self.idn = idn
+        self.instr_type = instr_type
+        self.error = error
+
+    def __repr__(self):
+        return f"Found({self.resource}, {self.idn!r}, {self.instr_type})"
+
+
+class IdnCache:
+    """
+    The *IDN? responses of the resources probed before, saved as JSON and keyed
+    by resource string, so a rescan only has to probe the new addresses.
+    """
+    def __init__(self, path: str=CACHE_PATH, max_age: float=7 * 24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self._entries = json.load(file)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def save(self):
+        with self._lock:
+            entries = dict(self._entries)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as file:
+                json.dump(entries, file, indent=4)
+        except OSError as e:
+            print("Discovery cache issue: \n", e)
+
+    def get(self, resource: str) -> str:
+        """The cached identity of a resource, or None if it has to be probed."""
+        with self._lock:
+            entry = self._entries.get(resource)
+        if entry is None or entry.get("idn") is None or time.time() - entry["time"] > self.max_age:
+            return None
+        return entry["idn"]
+
+    def store(self, resource: str, idn: str):
+        with self._lock:
+            self._entries[resource] = {"idn": idn, "time": time.time()}
+
+    def invalidate(self, *resources: str):
+        """Forget the given resources, or everything if none is given."""
+        with self._lock:
+            if not resources:
+                self._entries.clear()
+            for resource in resources:
+                self._entries.pop(resource, None)
+
+
+def probe(rm, resource: str, timeout: float=1.0) -> str:
+    """Ask a resource for its identity, giving up after `timeout` s."""
+    instr = rm.open_resource(resource, open_timeout=int(timeout * 1E3))
+    try:
+        instr.timeout = timeout * 1E3
+        if resource.startswith("ASRL"):
+            instr.read_termination = "\r\n"
+        return instr.query("*IDN?").strip()
+    finally:
+        instr.close()
+
+
+def match_type(idn: str, types: list=None) -> str:
+    """
+    Find the registered instrument type of an identity string, i.e. the one whose
+    name ends with the model number, e.g. 'Agilent8164B' for '...,8164B,...'.
+    """
+    parts = idn.split(",")
+    if len(parts) < 2:
+        return None
+    model = parts[1].strip().upper()
+    if not model:
+        return None
+    for name in get_registry().names() if types is None else types:
+        if name.upper().endswith(model):
+            return name
+    return None
+
+
+def discover(rm, cache: IdnCache=None, timeout: float=1.0, max_workers: int=16,
+             skip=(), refresh: bool=False, on_progress=None) -> list:
+    """
+    List the VISA resources and identify them, probing all the uncached ones at once.
+
+    Parameters
+    ----------
+    rm:
+        The VISA resource manager
+    cache: IdnCache
+        The responses of earlier scans, updated and saved by the scan
+    timeout: float
+        The time each resource has to answer in s
+    max_workers: int
+        The most resources probed at the same time
+    skip:
+        Resources not to probe, e.g. the ones already connected
+    refresh: bool
+        Probe every resource even if it is cached
+    on_progress: callable
+        Called with (done, total) from the worker as each probe finishes
+    """
+    types = get_registry().names()
+    found = {}
+    to_probe = []
+    for resource in rm.list_resources():
+        idn = None if cache is None or refresh else cache.get(resource)
+        if idn is not None:
+            found[resource] = Found(resource, idn, match_type(idn, types))
+        elif resource not in skip:
+            to_probe.append(resource)
+
+    def _probe(resource: str) -> Found:
+        try:
+            idn = probe(rm, resource, timeout)
+        except Exception as e:
+            return Found(resource, error=str(e))
+        if cache is not None:
+            cache.store(resource, idn)
+        return Found(resource, idn, match_type(idn, types))
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(to_probe)), thread_name_prefix="probe") as pool:
+            futures = [pool.submit(_probe, resource) for resource in to_probe]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                found[result.resource] = result
+                if on_progress is not None:
+                    on_progress(done, len(to_probe))
+        if cache is not None:
+            cache.save()
+    return list(found.values())
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import numpy as np
+
+_T0_WALL = time.time()
+_T0_PERF = time.perf_counter()
+
+def timestamp() -> float:
+    """
+    Seconds since the epoch, taken from a monotonic clock.
+    Every sample on the bench is stamped with this so readings from different
+    instruments share one timebase that never jumps with the system clock.
+    """
+    return _T0_WALL + (time.perf_counter() - _T0_PERF)
+
+
+class RingBuffer:
+    """
+    A preallocated, fixed-capacity history of timestamped samples.
+
+    Every sample is written twice, at `i` and `i + capacity`, so the latest `n`
+    samples are always one contiguous slice. Appending is O(1) and windows are
+    returned as read-only views into the buffer without copying.
+    """
+    DEFAULT_MEMORY_LIMIT = 16 * 1024**2
+    # time and value, float64, mirrored
+    BYTES_PER_SAMPLE = 2 * 8 * 2
+
+    def __init__(self, capacity: int=None, memory_limit: int=DEFAULT_MEMORY_LIMIT):
+        if capacity is None:
+            capacity = memory_limit // self.BYTES_PER_SAMPLE
+        if capacity < 1:
+            raise ValueError("The history must hold at least one sample.")
+        self._capacity = int(capacity)
+        # pages are only committed once written, and only written samples are ever read
+        self._t = np.empty(2 * self._capacity)
+        self._v = np.empty(2 * self._capacity)
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def nbytes(self) -> int:
+        return self._t.nbytes + self._v.nbytes
+
+    def __len__(self):
+        return self._count
+
+    def append(self, t: float, value: float):
+        """Append a sample, overwriting the oldest one when full."""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = np.nan
+        with self._lock:
+            i = self._head
+            self._t[i] = self._t[i + self._capacity] = t
+            self._v[i] = self._v[i + self._capacity] = value
+            self._head = (i + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+
+    def extend(self, t: np.ndarray, values: np.ndarray):
+        """Append a block of samples."""
+        t = np.asarray(t, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if t.shape != values.shape:
+            raise ValueError("Timestamps and values must have the same length.")
+        # only the last `capacity` samples can survive
+        t = t[-self._capacity:]
+        values = values[-self._capacity:]
+        with self._lock:
+            idx = (self._head + np.arange(len(t))) % self._capacity
+            self._t[idx] = self._t[idx + self._capacity] = t
+            self._v[idx] = self._v[idx + self._capacity] = values
+            self._head = (self._head + len(t)) % self._capacity
+            self._count = min(self._count + len(t), self._capacity)
+
+    def latest(self, n: int=None):
+        """Return views of the times and values of the latest `n` samples, oldest first."""
+        with self._lock:
+            n = self._count if n is None else min(n, self._count)
+            stop = self._head + self._capacity
+            t = self._t[stop - n:stop]
+            v = self._v[stop - n:stop]
+        t.flags.writeable = False
+        v.flags.writeable = False
+        return t, v
+
+    def since(self, t0: float):
+        """Return views of the samples taken at or after `t0`."""
+        t, v = self.latest()
+        start = np.searchsorted(t, t0, side="left")
+        return t[start:], v[start:]
+
+    def last(self):
+        """Return the latest sample or None if empty."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            i = self._head - 1 + self._capacity
+            return self._t[i], self._v[i]
+
+    def clear(self):
+        """Drop every sample."""
+        with self._lock:
+            self._head = 0
+            self._count = 0
+
+    def resize(self, capacity: int=None, memory_limit: int=None):
+        """Reallocate the buffer, keeping the latest samples that fit."""
+        t, v = self.latest()
+        t, v = t.copy(), v.copy()
+        kwargs = {} if memory_limit is None else {"memory_limit": memory_limit}
+        other = RingBuffer(capacity=capacity, **kwargs)
+        other.extend(t, v)
+        with self._lock:
+            self._capacity = other._capacity
+            self._t, self._v = other._t, other._v
+            self._head, self._count = other._head, other._count
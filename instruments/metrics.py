@@ -0,0 +1,254 @@
+import bisect
+import os
+import threading
+import time
+
+# upper bounds of the latency buckets in s, as in a Prometheus histogram
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, float("inf"))
+
+# the gauges other parts of the app report, and their help text
+GAUGES = {
+    "ui_queue_depth": "Polled results delivered to the GUI in its last frame.",
+    "ui_queue_max_depth": "Most polled results ever waiting for the GUI.",
+}
+
+# the VISA status of a timeout, VI_ERROR_TMO
+_VISA_TIMEOUT = -1073807339
+
+
+def command_name(message) -> str:
+    """The SCPI header of a message without its arguments, e.g. 'voltage' for 'voltage 1.5'."""
+    if not isinstance(message, str):
+        return ""
+    if ";" in message:
+        # a compound message of a batch
+        return "compound"
+    return message.split(None, 1)[0].lower() if message.strip() else ""
+
+def is_timeout(e: Exception) -> bool:
+    return isinstance(e, TimeoutError) or getattr(e, "error_code", None) == _VISA_TIMEOUT
+
+
+class Histogram:
+    """
+    Counts of durations in fixed buckets. Observing is a bisect and an increment,
+    so every transaction can be timed without a noticeable cost.
+    """
+    def __init__(self, buckets: tuple=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram"):
+        """Add the durations counted by another histogram with the same buckets."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class CommandMetrics:
+    """The timing of one command of one instrument."""
+    def __init__(self):
+        # the time on the bus, and the time spent waiting for another driver to finish
+        self.latency = Histogram()
+        self.wait = Histogram()
+        self.timeouts = 0
+        self.errors = 0
+
+    def merge(self, other: "CommandMetrics"):
+        self.latency.merge(other.latency)
+        self.wait.merge(other.wait)
+        self.timeouts += other.timeouts
+        self.errors += other.errors
+
+
+class Metrics:
+    """
+    The timing of every SCPI transaction by instrument and command, collected by
+    the shared sessions, see `instruments.visa.Session`. A slow instrument shows
+    as a long latency, contention for the bus as a long wait. Other parts of the
+    app report their queues as gauges.
+
+    The transactions of other processes, e.g. the worker processes, are added
+    from their sources: objects with `metrics()`, returning their metrics by
+    (instrument, command), and `reset_metrics()`.
+    """
+    def __init__(self):
+        self.enabled = True
+        self._commands = {}
+        self._gauges = {}
+        self._sources = []
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def add_source(self, source):
+        """Add the metrics of another process to these."""
+        with self._lock:
+            self._sources.append(source)
+
+    def remove_source(self, source, last: dict=None):
+        """Stop asking a source, keeping `last`, the metrics it had at the end."""
+        with self._lock:
+            if source in self._sources:
+                self._sources.remove(source)
+            for key, metrics in (last or {}).items():
+                self._commands.setdefault(key, CommandMetrics()).merge(metrics)
+
+    def _get(self, instrument: str, command: str) -> CommandMetrics:
+        key = (instrument, command)
+        metrics = self._commands.get(key)
+        if metrics is None:
+            with self._lock:
+                metrics = self._commands.setdefault(key, CommandMetrics())
+        return metrics
+
+    def observe(self, instrument: str, command: str, latency: float, wait: float=0.0, error: Exception=None):
+        """Record a transaction, and its error if it failed."""
+        metrics = self._get(instrument, command)
+        with self._lock:
+            metrics.latency.observe(latency)
+            metrics.wait.observe(wait)
+            if error is not None:
+                if is_timeout(error):
+                    metrics.timeouts += 1
+                else:
+                    metrics.errors += 1
+
+    def set_gauge(self, name: str, instrument: str, value: float):
+        """Report the current value of a gauge of `GAUGES`, e.g. a queue depth."""
+        self._gauges[(name, instrument)] = value
+
+    def gauges(self) -> dict:
+        """The gauges by (name, instrument)."""
+        with self._lock:
+            return dict(self._gauges)
+
+    def commands(self) -> dict:
+        """The metrics by (instrument, command), with the ones of the sources."""
+        with self._lock:
+            commands = dict(self._commands)
+            sources = list(self._sources)
+        for source in sources:
+            try:
+                remote = source.metrics()
+            except Exception:
+                # a source that is going away has its last metrics kept by `remove_source`
+                continue
+            for key, metrics in remote.items():
+                if key in commands:
+                    combined = CommandMetrics()
+                    with self._lock:
+                        combined.merge(commands[key])
+                    combined.merge(metrics)
+                    metrics = combined
+                commands[key] = metrics
+        return commands
+
+    def reset(self):
+        with self._lock:
+            self._commands.clear()
+            self._gauges.clear()
+            self.started = time.time()
+            sources = list(self._sources)
+        for source in sources:
+            try:
+                source.reset_metrics()
+            except Exception as e:
+                print("Metrics issue: \n", e)
+
+    def to_prometheus(self, poll_stats: list=None) -> str:
+        """
+        The metrics in the Prometheus text format, with the polling statistics
+        of the scheduler's tasks if given.
+        """
+        lines = []
+        commands = self.commands()
+        for name, attr, text in (("pyoctal_scpi_latency_seconds", "latency", "Time of the SCPI transactions on the bus."),
+                                 ("pyoctal_scpi_wait_seconds", "wait", "Time waited for the bus before each transaction.")):
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} histogram"]
+            for (instrument, command), metrics in sorted(commands.items()):
+                histogram = getattr(metrics, attr)
+                labels = f'instrument="{_escape(instrument)}",command="{_escape(command)}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        for name, attr, text in (("pyoctal_scpi_timeouts_total", "timeouts", "SCPI transactions that timed out."),
+                                 ("pyoctal_scpi_errors_total", "errors", "SCPI transactions that failed otherwise.")):
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+            for (instrument, command), metrics in sorted(commands.items()):
+                lines.append(f'{name}{{instrument="{_escape(instrument)}",command="{_escape(command)}"}} '
+                             f'{getattr(metrics, attr)}')
+
+        gauges = self.gauges()
+        for gauge, text in GAUGES.items():
+            name = f"pyoctal_{gauge}"
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} gauge"]
+            for (other, instrument), value in sorted(gauges.items()):
+                if other == gauge:
+                    lines.append(f'{name}{{instrument="{_escape(instrument)}"}} {value!r}')
+
+        if poll_stats:
+            for name, field, kind, text in (
+                    ("pyoctal_poll_samples_total", "count", "counter", "Callbacks run by the polling."),
+                    ("pyoctal_poll_overruns_total", "overruns", "counter", "Polls skipped as the previous one had not returned."),
+                    ("pyoctal_poll_rate_hz", "measured_rate", "gauge", "Measured polling rate."),
+                    ("pyoctal_poll_requested_rate_hz", "requested_rate", "gauge", "Requested polling rate."),
+                    ("pyoctal_poll_duration_seconds", "last_duration", "gauge", "Duration of the last poll.")):
+                lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+                for stats in poll_stats:
+                    lines.append(f'{name}{{task="{_escape(stats["name"])}"}} {stats[field]!r}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, poll_stats: list=None):
+        """
+        Write the Prometheus text to a file, replacing it at once so a collector
+        never reads half a file.
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            file.write(self.to_prometheus(poll_stats))
+        os.replace(tmp, path)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_metrics = Metrics()
+
+def get_metrics() -> Metrics:
+    """Get the metrics shared by every session."""
+    return _metrics
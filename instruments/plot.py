@@ -0,0 +1,226 @@
+import numpy as np
+import shiboken6
+
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QComboBox, QLabel
+from PySide6.QtCore import Qt, QTimer, QPointF, QRectF
+from PySide6.QtGui import QPainter, QPen, QColor, QPolygonF
+
+from instruments.history import timestamp
+
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b",
+          "#e377c2", "#7f7f7f", "#bcbd22", "#17becf", "#000080", "#808000"]
+
+def decimate_minmax(x: np.ndarray, y: np.ndarray, x0: float, x1: float, width: int):
+    """
+    Reduce the samples within [x0, x1] to at most two points per pixel column.
+    Each column keeps its minimum and maximum so peaks and glitches stay visible,
+    which makes the number of points drawn depend on the width and not the samples.
+    `x` must be sorted.
+    """
+    start = np.searchsorted(x, x0, side="left")
+    stop = np.searchsorted(x, x1, side="right")
+    x, y = x[start:stop], y[start:stop]
+    if len(x) <= 2 * width:
+        return x, y
+
+    # first sample of every pixel column, dropping the empty ones
+    edges = np.searchsorted(x, np.linspace(x0, x1, width + 1)[:-1], side="left")
+    edges = np.unique(edges[edges < len(x)])
+    ymin = np.fmin.reduceat(y, edges)
+    ymax = np.fmax.reduceat(y, edges)
+
+    xs = np.repeat(x[edges], 2)
+    ys = np.empty(2 * len(edges))
+    ys[0::2] = ymin
+    ys[1::2] = ymax
+    return xs, ys
+
+
+def to_polygon(x: np.ndarray, y: np.ndarray) -> QPolygonF:
+    """Fill a QPolygonF straight from the arrays instead of building a QPointF per point."""
+    polygon = QPolygonF()
+    polygon.resize(len(x))
+    if len(x):
+        buffer = shiboken6.VoidPtr(polygon.data(), len(x) * 16, True)
+        points = np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)
+        points[:, 0] = x
+        points[:, 1] = y
+    return polygon
+
+
+class Trace:
+    """A line on the plot. The source is anything with a `latest()` returning (x, y) arrays."""
+    def __init__(self, name: str, source, color: str=None):
+        self.name = name
+        self.source = source
+        self.color = QColor(color) if color else None
+        self.visible = True
+
+
+class PlotWidget(QWidget):
+    """
+    A live plot of one or more traces.
+    In time mode the x axis follows the latest `window` seconds, or all the history
+    when `window` is None. Otherwise it fits the data, e.g. for spectra.
+    """
+    margin = 70
+
+    def __init__(self, parent=None, window: float=60.0, time_axis: bool=True, refresh: int=100):
+        super().__init__(parent)
+        self.setMinimumHeight(200)
+        self.traces = []
+        self.window = window
+        self.time_axis = time_axis
+        self.normalise = False
+        self.paused = False
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(refresh)
+
+    def add_trace(self, name: str, source, color: str=None) -> Trace:
+        """Add a trace to the plot."""
+        trace = Trace(name, source, color if color else COLORS[len(self.traces) % len(COLORS)])
+        self.traces.append(trace)
+        return trace
+
+    def remove_trace(self, trace: Trace):
+        """Remove a trace from the plot."""
+        self.traces.remove(trace)
+        self.update()
+
+    def clear(self):
+        """Remove every trace."""
+        self.traces.clear()
+        self.update()
+
+    def refresh(self):
+        """Redraw when the plot is on screen."""
+        if self.isVisible() and not self.paused:
+            self.update()
+
+    def _lines(self, width: int):
+        """Decimate every trace to the pixel width."""
+        lines = []
+        now = timestamp()
+        for trace in self.traces:
+            if not trace.visible:
+                continue
+            x, y = trace.source.latest()
+            if len(x) == 0:
+                continue
+            if self.time_axis:
+                x0, x1 = (now - self.window if self.window else x[0]), now
+                xs, ys = decimate_minmax(x, y, x0, x1, width)
+            elif len(x) > 2 * width and np.all(np.diff(x) >= 0):
+                xs, ys = decimate_minmax(x, y, x[0], x[-1], width)
+            else:
+                # e.g. a bidirectional sweep, drawn as it is
+                xs, ys = x, y
+            if self.time_axis:
+                xs = xs - now
+            if self.normalise:
+                lo, hi = np.nanmin(ys, initial=np.inf), np.nanmax(ys, initial=-np.inf)
+                ys = (ys - lo) / (hi - lo) if hi > lo else ys - lo
+            lines.append((trace, xs, ys))
+        return lines
+
+    def paintEvent(self, event):
+        """Draw the axes and the decimated traces."""
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.GlobalColor.white)
+        area = QRectF(self.margin, 10, self.width() - self.margin - 10, self.height() - 40)
+        painter.setPen(QPen(Qt.GlobalColor.black))
+        painter.drawRect(area)
+        if area.width() < 2 or area.height() < 2:
+            return
+
+        lines = self._lines(int(area.width()))
+        xs = [xs for _, xs, _ in lines if len(xs)]
+        ys = [ys[np.isfinite(ys)] for _, _, ys in lines]
+        ys = [y for y in ys if len(y)]
+        if self.time_axis and self.window:
+            xmin, xmax = -self.window, 0.0
+        elif xs:
+            xmin, xmax = min(np.nanmin(x) for x in xs), max(np.nanmax(x) for x in xs)
+        else:
+            xmin, xmax = 0.0, 1.0
+        ymin = min(y.min() for y in ys) if ys else 0.0
+        ymax = max(y.max() for y in ys) if ys else 1.0
+        if xmax <= xmin:
+            xmax = xmin + 1
+        if ymax <= ymin:
+            ymin, ymax = ymin - 0.5, ymax + 0.5
+
+        # axis labels
+        painter.drawText(QRectF(0, area.top() - 5, self.margin - 4, 20),
+                         Qt.AlignmentFlag.AlignRight, f"{ymax:.4g}")
+        painter.drawText(QRectF(0, area.bottom() - 15, self.margin - 4, 20),
+                         Qt.AlignmentFlag.AlignRight, f"{ymin:.4g}")
+        painter.drawText(QRectF(area.left(), area.bottom() + 2, 100, 20),
+                         Qt.AlignmentFlag.AlignLeft, f"{xmin:.4g}{' s' if self.time_axis else ''}")
+        painter.drawText(QRectF(area.right() - 100, area.bottom() + 2, 100, 20),
+                         Qt.AlignmentFlag.AlignRight, f"{xmax:.4g}{' s' if self.time_axis else ''}")
+
+        # traces
+        painter.setClipRect(area)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing, False)
+        sx = area.width() / (xmax - xmin)
+        sy = area.height() / (ymax - ymin)
+        legend = area.left() + 5
+        for trace, x, y in lines:
+            painter.setPen(QPen(trace.color, 1))
+            px = area.left() + (x - xmin) * sx
+            py = area.bottom() - (y - ymin) * sy
+            finite = np.isfinite(py)
+            painter.drawPolyline(to_polygon(px[finite], py[finite]))
+            painter.drawText(QPointF(legend, area.top() + 15), trace.name)
+            legend += painter.fontMetrics().horizontalAdvance(trace.name) + 15
+        painter.end()
+
+
+class PlotPanel(QWidget):
+    """A plot with the controls for its time window and scaling."""
+    windows = {"10 s": 10, "1 min": 60, "10 min": 600, "1 h": 3600, "All": None}
+
+    def __init__(self, parent=None, window: float=60.0):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Window: ", parent=self))
+        self.window_box = QComboBox(parent=self)
+        self.window_box.addItems(list(self.windows))
+        self.window_box.setCurrentText("1 min")
+        self.window_box.currentTextChanged.connect(self.set_window)
+        controls.addWidget(self.window_box)
+        self.normalise = QCheckBox("Normalise", parent=self)
+        self.normalise.toggled.connect(self.set_normalise)
+        controls.addWidget(self.normalise)
+        self.pause = QCheckBox("Pause", parent=self)
+        self.pause.toggled.connect(self.set_paused)
+        controls.addWidget(self.pause)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.plot = PlotWidget(parent=self, window=window)
+        layout.addWidget(self.plot, 1)
+
+    def add_trace(self, name: str, source, color: str=None) -> Trace:
+        return self.plot.add_trace(name, source, color)
+
+    def clear(self):
+        self.plot.clear()
+
+    def set_window(self, text: str):
+        """Change the time window, or fit all the samples."""
+        self.plot.window = self.windows[text]
+        self.plot.update()
+
+    def set_normalise(self, state: bool):
+        self.plot.normalise = state
+        self.plot.update()
+
+    def set_paused(self, state: bool):
+        self.plot.paused = state
@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class Recorder:
+    """
+    Streams the readings of every recorded parameter to Parquet files, from a
+    background writer thread so the polling never waits on the disk.
+
+    Each reading is appended to a buffer by the polling thread that took it. The
+    writer empties the buffer into a compressed row group every `flush_interval`
+    s, or sooner once `chunk_rows` readings are waiting, and starts a new file
+    once the current one reaches `max_bytes` or `max_age`. A file is written as
+    `.parquet.part` and renamed once it is complete. The buffer holds at most
+    `max_pending` readings; if the disk cannot keep up, newer readings are dropped
+    and counted instead of filling the memory.
+
+    The files have one row per reading: time (UTC), instrument, parameter, value.
+    Parquet needs pyarrow, which is only imported when recording starts.
+
+    e.g.
+        recorder = Recorder(bench.devices, "runs/stability")
+        recorder.start()
+        ...
+        recorder.stop()
+        df = pandas.read_parquet("runs/stability")
+
+    Parameters
+    ----------
+    devices: dict or callable
+        The devices by instrument name, or a function returning them; it is
+        checked at every flush, so instruments can come and go while recording
+    directory: str
+        Where the files are written
+    prefix: str
+        The start of the file names, followed by the time the file was started
+    flush_interval: float
+        The most time in s a reading waits before being written
+    chunk_rows: int
+        The number of waiting readings that are written at once
+    max_bytes: int
+        The size in bytes after which a new file is started
+    max_age: float
+        The time in s after which a new file is started
+    max_pending: int
+        The most readings waiting to be written
+    compression: str
+        The Parquet compression codec
+    """
+    def __init__(self, devices, directory: str, prefix: str="readings", flush_interval: float=5.0,
+                 chunk_rows: int=50000, max_bytes: int=256 * 1024**2, max_age: float=3600.0,
+                 max_pending: int=500000, compression: str="zstd"):
+        self._devices = devices if callable(devices) else (lambda: devices)
+        self.directory = directory
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.compression = compression
+        self._names = []
+        self._t = []
+        self._values = []
+        self._cond = threading.Condition()
+        # the listener of each recorded parameter, by (instrument, param)
+        self._listeners = {}
+        self._thread = None
+        self._running = False
+        self._pa = self._pq = None
+        self._schema = None
+        self._writer = None
+        self._path = None
+        self._opened = 0.0
+        self.files = []
+        self.rows = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        """Start recording in the background. Raise ImportError without pyarrow."""
+        if self._running:
+            return
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Recording needs pyarrow, e.g. pip install pyarrow") from e
+        self._pa, self._pq = pa, pq
+        os.makedirs(self.directory, exist_ok=True)
+        self._schema = pa.schema([
+            ("time", pa.timestamp("us", tz="UTC")),
+            ("instrument", pa.dictionary(pa.int32(), pa.string())),
+            ("parameter", pa.dictionary(pa.int32(), pa.string())),
+            ("value", pa.float64()),
+        ])
+        self._running = True
+        self._sync()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=None):
+        """Stop recording, writing the readings still waiting and closing the file."""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = len(self._t)
+        return {"rows": self.rows, "files": len(self.files), "pending": pending, "dropped": self.dropped,
+                "errors": self.errors, "path": self._path}
+
+    def _sync(self):
+        """Listen to the recorded parameters of the devices there are now, and stop listening to the others."""
+        wanted = {}
+        for name, device in list(self._devices().items()):
+            for key, param in device.params.items():
+                if param.history is not None:
+                    wanted[(name, key)] = param
+        for name, (param, listener) in list(self._listeners.items()):
+            if wanted.get(name) is not param:
+                param.remove_listener(listener)
+                del self._listeners[name]
+        for name, param in wanted.items():
+            if name not in self._listeners:
+                listener = lambda param, t, value, name=name: self._append(name, t, value)
+                param.add_listener(listener)
+                self._listeners[name] = (param, listener)
+
+    def _append(self, name: tuple, t: float, value):
+        """Keep a reading for the writer, from the polling thread."""
+        with self._cond:
+            if len(self._t) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._names.append(name)
+            self._t.append(t)
+            self._values.append(value)
+            if len(self._t) == self.chunk_rows:
+                self._cond.notify()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running or len(self._t) >= self.chunk_rows,
+                                    timeout=max(0.0, next_flush - time.monotonic()))
+                running = self._running
+                names, t, values = self._names, self._t, self._values
+                self._names, self._t, self._values = [], [], []
+            next_flush = time.monotonic() + self.flush_interval
+            try:
+                if running:
+                    self._sync()
+                self._write(names, t, values)
+                if self._writer is not None and (os.path.getsize(self._path + ".part") >= self.max_bytes or
+                                                 time.monotonic() - self._opened >= self.max_age):
+                    self._close_file()
+            except Exception as e:
+                self.errors += 1
+                print("Recording issue: \n", e)
+            if not running:
+                break
+        for param, listener in self._listeners.values():
+            param.remove_listener(listener)
+        self._listeners.clear()
+        try:
+            self._close_file()
+        except Exception as e:
+            print("Recording issue: \n", e)
+
+    def _write(self, names: list, t: list, values: list):
+        if not t:
+            return
+        try:
+            values = np.asarray(values, dtype=float)
+        except (TypeError, ValueError):
+            values = np.array([_float(value) for value in values])
+        pa = self._pa
+        table = pa.table({
+            "time": pa.array((np.asarray(t) * 1E6).astype(np.int64), type=pa.timestamp("us", tz="UTC")),
+            "instrument": pa.array([name[0] for name in names], type=pa.dictionary(pa.int32(), pa.string())),
+            "parameter": pa.array([name[1] for name in names], type=pa.dictionary(pa.int32(), pa.string())),
+            "value": pa.array(values, type=pa.float64()),
+        }, schema=self._schema)
+        if self._writer is None:
+            self._open_file()
+        self._writer.write_table(table, row_group_size=len(table))
+        self.rows += len(table)
+
+    def _open_file(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}.parquet")
+        i = 1
+        while os.path.exists(path) or os.path.exists(path + ".part"):
+            path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{i}.parquet")
+            i += 1
+        self._path = path
+        self._writer = self._pq.ParquetWriter(path + ".part", self._schema, compression=self.compression)
+        self._opened = time.monotonic()
+
+    def _close_file(self):
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        writer.close()
+        os.replace(self._path + ".part", self._path)
+        self.files.append(self._path)
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
@@ -0,0 +1,108 @@
+import threading
+import time
+from importlib import import_module
+from importlib.metadata import entry_points
+
+# other packages add instruments by declaring an entry point in this group, e.g.
+#   [project.entry-points."pyoctal_gui.instruments"]
+#   Keithley2400 = "my_package.keithley:Keithley2400_GUI"
+ENTRY_POINT_GROUP = "pyoctal_gui.instruments"
+
+BUILTIN = {
+    "Agilent8163B": "instruments.aglient816xB:Agilent8163B_GUI",
+    "Agilent8164B": "instruments.aglient816xB:Agilent8164B_GUI",
+    "AgilentE3640A": "instruments.aglientE3640A:AgilentE3640A_GUI",
+}
+
+# the same instruments without a GUI, for scripts and headless runs
+DEVICE_GROUP = "pyoctal_gui.devices"
+
+DEVICES = {
+    "Agilent8163B": "instruments.devices:Agilent8163B",
+    "Agilent8164B": "instruments.devices:Agilent8164B",
+    "AgilentE3640A": "instruments.devices:AgilentE3640A",
+}
+
+
+class Registry:
+    """
+    The instrument types the app knows about, by name.
+    Only the import paths of the GUI classes are kept until a type is first
+    used, so its module and driver are imported on demand instead of at startup.
+    """
+    def __init__(self, builtin: dict=None, group: str=ENTRY_POINT_GROUP):
+        self.group = group
+        self._paths = dict(BUILTIN if builtin is None else builtin)
+        self._classes = {}
+        self._discovered = False
+        self._lock = threading.Lock()
+        self.load_times = {}
+
+    def _discover(self):
+        """Add the types declared by installed packages, without importing them."""
+        if self._discovered:
+            return
+        self._discovered = True
+        try:
+            for ep in entry_points(group=self.group):
+                self._paths.setdefault(ep.name, ep.value)
+        except Exception as e:
+            print("Instrument registry issue: \n", e)
+
+    def register(self, name: str, target):
+        """Register a GUI class, or its import path as 'module:attribute'."""
+        with self._lock:
+            if isinstance(target, str):
+                self._paths[name] = target
+                self._classes.pop(name, None)
+            else:
+                self._paths[name] = f"{target.__module__}:{target.__qualname__}"
+                self._classes[name] = target
+
+    def names(self) -> list:
+        """The names of every known instrument type."""
+        with self._lock:
+            self._discover()
+            return list(self._paths)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names()
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._classes
+
+    def load(self, name: str):
+        """Get the GUI class of an instrument type, importing it on first use."""
+        with self._lock:
+            cls = self._classes.get(name)
+            if cls is not None:
+                return cls
+            self._discover()
+            if name not in self._paths:
+                raise KeyError(f"Unknown instrument type: {name}")
+            module, _, attr = self._paths[name].partition(":")
+            start = time.perf_counter()
+            cls = import_module(module)
+            for part in attr.split("."):
+                cls = getattr(cls, part)
+            self.load_times[name] = time.perf_counter() - start
+            self._classes[name] = cls
+            return cls
+
+
+_registry = None
+_device_registry = None
+
+def get_registry() -> Registry:
+    """Get the registry of instrument types shared by the app."""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+def get_device_registry() -> Registry:
+    """Get the registry of the headless devices, by the same type names."""
+    global _device_registry
+    if _device_registry is None:
+        _device_registry = Registry(DEVICES, group=DEVICE_GROUP)
+    return _device_registry
@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PollTask:
+    """
+    A callback that is polled periodically by the scheduler.
+    The next deadline is always computed from the previous deadline rather than
+    from the end of the callback, so the SCPI latency does not accumulate as drift.
+    """
+    def __init__(self, func, period: float, on_result=None, lock=None, name: str=None):
+        self.func = func
+        self.period = period
+        self.on_result = on_result
+        self.lock = lock
+        self.name = name if name else getattr(func, "__qualname__", repr(func))
+        self.deadline = 0.0
+        self.active = True
+        self.running = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.count = 0
+        self.overruns = 0
+        self.started = None
+        self.last_duration = 0.0
+
+    def run(self):
+        """Run the callback once and hand the result to the consumer."""
+        start = time.perf_counter()
+        try:
+            if self.lock is None:
+                data = self.func()
+            else:
+                with self.lock:
+                    data = self.func()
+            if self.active and self.on_result is not None:
+                self.on_result(data)
+        except Exception as e:
+            print(f"Polling {self.name} failed: {e}")
+        finally:
+            self.last_duration = time.perf_counter() - start
+            self.count += 1
+            self.running = False
+            self.idle.set()
+
+    def wait(self, timeout: float=None) -> bool:
+        """Wait for an in-flight call to return. Return False on timeout."""
+        return self.idle.wait(timeout)
+
+    @property
+    def measured_rate(self) -> float:
+        """The measured rate in Hz since the task was registered."""
+        if self.started is None or self.count == 0:
+            return 0.0
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def requested_rate(self) -> float:
+        """The requested rate in Hz."""
+        return 1 / self.period
+
+    def stats(self) -> dict:
+        """Return the requested and measured rates of the task."""
+        return {
+            "name": self.name,
+            "period": self.period,
+            "requested_rate": self.requested_rate,
+            "measured_rate": self.measured_rate,
+            "count": self.count,
+            "overruns": self.overruns,
+            "last_duration": self.last_duration,
+        }
+
+
+class PollScheduler:
+    """
+    A central polling scheduler shared by every instrument.
+    A single dispatcher thread keeps the tasks ordered by deadline and hands due
+    tasks to a bounded pool of workers, so the number of threads does not grow
+    with the number of instruments on the bench.
+    """
+    def __init__(self, max_workers: int=4):
+        self.max_workers = max_workers
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = None
+        self._thread = None
+        self._running = False
+
+    def register(self, func, period: float=0.5, on_result=None, lock=None, name: str=None) -> PollTask:
+        """Register a callback to be polled every `period` seconds."""
+        task = PollTask(func, period, on_result=on_result, lock=lock, name=name)
+        with self._cond:
+            self._start()
+            task.started = time.perf_counter()
+            task.deadline = time.monotonic()
+            heapq.heappush(self._heap, (task.deadline, next(self._counter), task))
+            self._cond.notify()
+        return task
+
+    def unregister(self, task: PollTask, timeout: float=0) -> bool:
+        """
+        Stop polling a task. It is dropped from the queue lazily.
+        A call that is already in flight is never interrupted; wait up to `timeout`
+        seconds for it to return so the instrument is left between transactions.
+        """
+        with self._cond:
+            task.active = False
+            self._cond.notify()
+        return task.wait(timeout) if timeout else not task.running
+
+    def tasks(self) -> list:
+        """Return the active tasks."""
+        with self._cond:
+            return [task for _, _, task in self._heap if task.active]
+
+    def stats(self) -> list:
+        """Return the requested versus measured rates of every active task."""
+        return [task.stats() for task in self.tasks()]
+
+    def _start(self):
+        if self._running:
+            return
+        self._running = True
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="poll")
+        self._thread = threading.Thread(target=self._dispatch, name="poll-scheduler", daemon=True)
+        self._thread.start()
+
+    def _dispatch(self):
+        """Hand the due tasks to the worker pool."""
+        with self._cond:
+            while self._running:
+                while self._heap and not self._heap[0][2].active:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                deadline, _, task = self._heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self._cond.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                if task.running:
+                    # the previous read has not returned yet
+                    task.overruns += 1
+                else:
+                    task.running = True
+                    task.idle.clear()
+                    self._pool.submit(task.run)
+
+                task.deadline = deadline + task.period
+                if task.deadline <= now:
+                    # skip the missed deadlines instead of bursting to catch up
+                    missed = (now - deadline) // task.period
+                    task.overruns += int(missed)
+                    task.deadline = deadline + (missed + 1) * task.period
+                heapq.heappush(self._heap, (task.deadline, next(self._counter), task))
+
+    def shutdown(self):
+        """Stop the dispatcher and wait for the running callbacks to return."""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            for _, _, task in self._heap:
+                task.active = False
+            self._heap.clear()
+            self._cond.notify()
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+
+_scheduler = None
+
+def get_scheduler() -> PollScheduler:
+    """Get the scheduler shared by all instruments."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PollScheduler()
+    return _scheduler
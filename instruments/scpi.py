@@ -0,0 +1,103 @@
+import numpy as np
+
+def join_commands(commands: list) -> str:
+    """
+    Join SCPI commands into one compound message.
+    Every command after the first is rooted with ':' so the path of the previous
+    one does not apply, except the common commands such as *OPC?.
+    """
+    message = []
+    for i, cmd in enumerate(commands):
+        cmd = cmd.strip()
+        if i and not cmd.startswith((":", "*")):
+            cmd = ":" + cmd
+        message.append(cmd)
+    return ";".join(message)
+
+
+class _Recorder:
+    """Stands in for the VISA resource of a driver while a batch is open."""
+    def __init__(self, batch):
+        self._batch = batch
+
+    def write(self, cmd: str):
+        self._batch.write(cmd)
+
+    def query(self, cmd: str) -> str:
+        return self._batch.query(cmd)
+
+    def __getattr__(self, name: str):
+        # anything else, e.g. binary transfers, needs the writes to be sent first
+        self._batch.flush(sync=False)
+        return getattr(self._batch.resource, name)
+
+
+class ScpiBatch:
+    """
+    Defer the writes of a pyoctal driver and send them as compound SCPI messages.
+
+    While the batch is open the driver methods are called as usual, but their
+    writes are collected instead of sent. They are joined with ';' and go out
+    with the next query, so a query costs one round-trip together with every
+    write before it, or with a final *OPC? when the batch closes so it returns
+    once the instrument has processed everything.
+
+    e.g.
+        with ScpiBatch(instr):
+            instr.set_laser_wav(1550)
+            instr.set_laser_pow(0)
+    """
+    def __init__(self, instr, max_length: int=1024):
+        self.instr = instr
+        self.max_length = max_length
+        self.resource = None
+        self.pending = []
+        self.messages = 0
+        self.commands = 0
+
+    def __enter__(self):
+        self.resource = self.instr._instr
+        self.instr._instr = _Recorder(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instr._instr = self.resource
+        if exc_type is None:
+            self.flush(sync=True)
+        return False
+
+    def write(self, cmd: str):
+        """Defer a write, sending the pending ones first if the message would get too long."""
+        if self.pending and len(join_commands(self.pending + [cmd])) > self.max_length:
+            self.flush(sync=False)
+        self.pending.append(cmd)
+        self.commands += 1
+
+    def query(self, cmd: str) -> str:
+        """Send the pending writes together with a query and return its response."""
+        if self.pending and len(join_commands(self.pending + [cmd])) > self.max_length:
+            self.flush(sync=False)
+        message = join_commands(self.pending + [cmd])
+        self.pending.clear()
+        self.messages += 1
+        self.commands += 1
+        return self.resource.query(message)
+
+    def flush(self, sync: bool=True):
+        """Send the pending writes, waiting for the instrument to finish them if `sync` is set."""
+        if sync:
+            if self.pending:
+                self.query("*OPC?")
+            return
+        if self.pending:
+            self.resource.write(join_commands(self.pending))
+            self.pending.clear()
+            self.messages += 1
+
+
+def query_block(instr, cmd: str, datatype: str="f") -> np.ndarray:
+    """
+    Query an IEEE 488.2 binary block from a pyoctal driver and decode it
+    straight into a NumPy array, without a Python object per value.
+    """
+    return instr.query_binary_values(cmd, datatype=datatype, container=np.ndarray)
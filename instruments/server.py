@@ -0,0 +1,487 @@
+import itertools
+import json
+import queue
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import partial
+
+from instruments.history import timestamp
+
+DEFAULT_PORT = 8765
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INSTRUMENT_ERROR = -32000
+
+
+class RpcError(Exception):
+    """An error returned to the client of a request."""
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def _jsonable(obj):
+    # NumPy scalars and arrays, e.g. the readings taken from the history
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def encode(message) -> bytes:
+    """One JSON message per line."""
+    return json.dumps(message, default=_jsonable).encode("utf-8") + b"\n"
+
+def _reply(request_id, result) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+def _error(request_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+
+class _Client(socketserver.StreamRequestHandler):
+    """
+    One connection. Requests are answered in order on the connection's thread,
+    while everything sent to the client goes through a queue emptied by a writer
+    thread, so a slow client never holds up the polling that feeds the others.
+    """
+    def setup(self):
+        super().setup()
+        self.control = self.server.control
+        self.outbox = queue.Queue(maxsize=self.control.max_queued)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self._write, name="server-writer", daemon=True)
+        self.writer.start()
+
+    def handle(self):
+        self.control.add_client(self)
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            reply = self.control.dispatch(self, line)
+            if reply is not None:
+                self.send(encode(reply))
+
+    def finish(self):
+        self.control.remove_client(self)
+        self.outbox.put(None)
+        self.writer.join(timeout=1.0)
+        super().finish()
+
+    def send(self, data: bytes, drop: bool=False):
+        """
+        Queue a message. Readings are sent with `drop` set, so the oldest queued
+        reading is dropped instead of waiting when the client is not keeping up.
+        """
+        if not drop:
+            self.outbox.put(data)
+            return
+        while True:
+            try:
+                self.outbox.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self.outbox.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _write(self):
+        while True:
+            data = self.outbox.get()
+            if data is None:
+                return
+            try:
+                self.wfile.write(data)
+            except OSError:
+                return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ControlServer:
+    """
+    Serve the instruments to other processes on a local TCP port.
+
+    The protocol is JSON-RPC 2.0 with one JSON message per line. A list of
+    requests is run as a batch: its writes are queued together and waited for
+    once, and the replies come back as one list.
+
+        {"jsonrpc": "2.0", "id": 1, "method": "set", "params": ["psu", "volt", 1.5]}
+        {"jsonrpc": "2.0", "id": 1, "result": null}
+
+    Methods
+    -------
+    list()
+        The instruments and their parameters
+    get(instrument, param, max_age=None)
+        The value and time of a reading. A reading taken by the polling within
+        `max_age` s, by default one polling period, is returned without asking
+        the instrument again. Parameters that cannot be read return their setting.
+    set(instrument, param, value)
+        Set a parameter, replying once it has been sent
+    subscribe(instrument, param) / unsubscribe(instrument, param)
+        Start/stop receiving the readings of a polled parameter as "reading"
+        notifications. Each reading is taken once and sent to every subscriber.
+
+    Parameters
+    ----------
+    devices: dict or callable
+        The devices by instrument name, or a function returning them
+    host: str
+        The address to listen on, only the local machine by default
+    port: int
+        The port to listen on, 0 for any free port
+    max_queued: int
+        The most messages waiting to be sent to a client before its oldest
+        readings are dropped
+    """
+    def __init__(self, devices, host: str="127.0.0.1", port: int=DEFAULT_PORT, max_queued: int=1000):
+        self._devices = devices if callable(devices) else (lambda: devices)
+        self.host = host
+        self.port = port
+        self.max_queued = max_queued
+        self.clients = set()
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # subscribers and the listener feeding them, by (instrument, param)
+        self._subscribers = {}
+        self._listeners = {}
+        self.methods = {
+            "list": self.list,
+            "get": self.get,
+            "set": self.set,
+            "subscribe": self.subscribe,
+            "unsubscribe": self.unsubscribe,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    def start(self):
+        """Start listening in the background."""
+        if self._server is not None:
+            return
+        self._server = _TCPServer((self.host, self.port), _Client)
+        self._server.control = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop listening, drop the subscriptions and close the connections."""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        server.shutdown()
+        server.server_close()
+        with self._lock:
+            for (param, listener) in self._listeners.values():
+                param.remove_listener(listener)
+            self._listeners.clear()
+            self._subscribers.clear()
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def add_client(self, client: _Client):
+        with self._lock:
+            self.clients.add(client)
+
+    def remove_client(self, client: _Client):
+        with self._lock:
+            self.clients.discard(client)
+            topics = [topic for topic, clients in self._subscribers.items() if client in clients]
+        for topic in topics:
+            self._unsubscribe(client, topic)
+
+    def dispatch(self, client: _Client, line: bytes):
+        """Run a request or a batch of requests and return the reply, None for notifications."""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return _error(None, PARSE_ERROR, f"Parse error: {e}")
+        if isinstance(request, list):
+            if not request:
+                return _error(None, INVALID_REQUEST, "Empty batch")
+            return self._batch(client, request) or None
+        return self._call(client, request)
+
+    def _batch(self, client: _Client, requests: list) -> list:
+        """Run a batch, queuing its writes without waiting for each one."""
+        writes = []
+        replies = []
+        for request in requests:
+            reply = self._call(client, request, writes=writes)
+            if reply is not None:
+                replies.append(reply)
+        waited = set()
+        for reply, device, key in writes:
+            if device not in waited:
+                device.wait()
+                waited.add(device)
+            if key in device.errors:
+                e = device.errors.pop(key)
+                if reply is not None:
+                    reply.pop("result", None)
+                    reply["error"] = {"code": INSTRUMENT_ERROR, "message": str(e)}
+        return replies
+
+    def _call(self, client: _Client, request, writes: list=None):
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or "method" not in request:
+            return _error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        notification = "id" not in request
+        method = self.methods.get(request["method"])
+        if method is None:
+            return None if notification else _error(request_id, METHOD_NOT_FOUND, f"Method not found: {request['method']}")
+        params = request.get("params", [])
+        try:
+            if writes is not None and method == self.set:
+                # the batch waits for every write once all of them are queued
+                device, key = self._set(**params) if isinstance(params, dict) else self._set(*params)
+                reply = None if notification else _reply(request_id, None)
+                writes.append((reply, device, key))
+                return reply
+            if isinstance(params, dict):
+                result = method(client, **params)
+            else:
+                result = method(client, *params)
+        except RpcError as e:
+            return None if notification else _error(request_id, e.code, str(e))
+        except TypeError as e:
+            return None if notification else _error(request_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            return None if notification else _error(request_id, INSTRUMENT_ERROR, str(e))
+        return None if notification else _reply(request_id, result)
+
+    def _param(self, instrument: str, param: str):
+        device = self._devices().get(instrument)
+        if device is None:
+            raise RpcError(INVALID_PARAMS, f"Unknown instrument: {instrument}")
+        if param not in device.params:
+            raise RpcError(INVALID_PARAMS, f"{instrument} has no parameter {param}")
+        return device, device.params[param]
+
+    def list(self, client: _Client) -> dict:
+        return {name: {key: {"unit": param.unit, "readable": param.readable, "writable": param.writable,
+                             "polled": param.history is not None, "value": param.value}
+                       for key, param in device.params.items()}
+                for name, device in self._devices().items()}
+
+    def get(self, client: _Client, instrument: str, param: str, max_age: float=None) -> dict:
+        device, param = self._param(instrument, param)
+        if not param.readable:
+            return {"t": None, "value": param.value}
+        if param.history is not None:
+            if max_age is None and device.poller.is_running:
+                max_age = device.poller.period
+            last = param.history.last()
+            if max_age is not None and last is not None and timestamp() - last[0] <= max_age:
+                return {"t": last[0], "value": last[1]}
+        return {"t": timestamp(), "value": param.get()}
+
+    def _set(self, instrument: str, param: str, value):
+        device, param = self._param(instrument, param)
+        if not param.writable:
+            raise RpcError(INVALID_PARAMS, f"{instrument}: {param.key} cannot be set")
+        device.errors.pop(param.key, None)
+        param.set(value)
+        return device, param.key
+
+    def set(self, client: _Client, instrument: str, param: str, value):
+        device, key = self._set(instrument, param, value)
+        device.wait()
+        if key in device.errors:
+            raise device.errors.pop(key)
+
+    def subscribe(self, client: _Client, instrument: str, param: str) -> bool:
+        _, param = self._param(instrument, param)
+        topic = (instrument, param.key)
+        with self._lock:
+            clients = self._subscribers.setdefault(topic, set())
+            clients.add(client)
+            if topic not in self._listeners:
+                listener = partial(self._publish, instrument)
+                self._listeners[topic] = (param, listener)
+                param.add_listener(listener)
+        return True
+
+    def unsubscribe(self, client: _Client, instrument: str, param: str) -> bool:
+        return self._unsubscribe(client, (instrument, param))
+
+    def _unsubscribe(self, client: _Client, topic: tuple) -> bool:
+        with self._lock:
+            clients = self._subscribers.get(topic, set())
+            if client not in clients:
+                return False
+            clients.discard(client)
+            if not clients:
+                del self._subscribers[topic]
+                param, listener = self._listeners.pop(topic)
+                param.remove_listener(listener)
+        return True
+
+    def _publish(self, instrument: str, param, t: float, value):
+        """Send a reading to every subscriber, encoded once, from the polling thread."""
+        with self._lock:
+            clients = list(self._subscribers.get((instrument, param.key), ()))
+        if not clients:
+            return
+        data = encode({"jsonrpc": "2.0", "method": "reading",
+                       "params": {"instrument": instrument, "param": param.key, "t": t, "value": value}})
+        for client in clients:
+            client.send(data, drop=True)
+
+
+class ControlClient:
+    """
+    A client of the control server, for scripts and analysis processes.
+
+    e.g.
+        with ControlClient() as client:
+            client.set("psu", "volt", 1.5)
+            client.subscribe("pm", "detect_pow", lambda t, value: print(t, value))
+            print(client.batch([("get", "psu", "curr"), ("get", "pm", "detect_pow")]))
+    """
+    def __init__(self, host: str="127.0.0.1", port: int=DEFAULT_PORT, timeout: float=10.0):
+        self.timeout = timeout
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.settimeout(None)
+        self._file = self._sock.makefile("rb")
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        # why the connection can no longer be used, once the reader has stopped
+        self._error = None
+        self._reader = threading.Thread(target=self._read, name="client-reader", daemon=True)
+        self._reader.start()
+
+    def _send(self, message) -> None:
+        with self._lock:
+            self._sock.sendall(encode(message))
+
+    def _request(self, method: str, *params) -> tuple:
+        request_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            self._pending[request_id] = future
+        return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": list(params)}, future
+
+    def _wait(self, request: dict, future: Future):
+        """Wait for the reply to a request, forgetting the request if it times out."""
+        try:
+            future.result(self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(request["id"], None)
+            raise
+
+    @staticmethod
+    def _result(future: Future):
+        reply = future.result()
+        if "error" in reply:
+            raise RpcError(reply["error"]["code"], reply["error"]["message"])
+        return reply["result"]
+
+    def call(self, method: str, *params):
+        """Call a method and wait for its result."""
+        request, future = self._request(method, *params)
+        self._send(request)
+        self._wait(request, future)
+        return self._result(future)
+
+    def batch(self, calls: list) -> list:
+        """
+        Send several calls as (method, *params) in one message and return their
+        results in order, or the RpcError of the calls that failed.
+        """
+        requests, futures = zip(*(self._request(method, *params) for method, *params in calls))
+        self._send(list(requests))
+        results = []
+        for request, future in zip(requests, futures):
+            self._wait(request, future)
+            try:
+                results.append(self._result(future))
+            except RpcError as e:
+                results.append(e)
+        return results
+
+    def list(self) -> dict:
+        return self.call("list")
+
+    def get(self, instrument: str, param: str, max_age: float=None):
+        return self.call("get", instrument, param, max_age)["value"]
+
+    def set(self, instrument: str, param: str, value):
+        return self.call("set", instrument, param, value)
+
+    def subscribe(self, instrument: str, param: str, callback):
+        """Call `callback(t, value)` from the reader thread with every reading."""
+        self._callbacks.setdefault((instrument, param), []).append(callback)
+        return self.call("subscribe", instrument, param)
+
+    def unsubscribe(self, instrument: str, param: str):
+        self._callbacks.pop((instrument, param), None)
+        return self.call("unsubscribe", instrument, param)
+
+    def _read(self):
+        error = ConnectionError("The server closed the connection.")
+        try:
+            for line in self._file:
+                message = json.loads(line)
+                for message in message if isinstance(message, list) else [message]:
+                    if "id" in message:
+                        with self._lock:
+                            future = self._pending.pop(message["id"], None)
+                        if future is not None:
+                            future.set_result(message)
+                    elif message.get("method") == "reading":
+                        params = message["params"]
+                        for callback in self._callbacks.get((params["instrument"], params["param"]), []):
+                            try:
+                                callback(params["t"], params["value"])
+                            except Exception as e:
+                                print("Subscription issue: \n", e)
+        except ValueError as e:
+            # the replies cannot be matched to the requests after a broken message
+            error = ConnectionError(f"The server sent a malformed message: {e}")
+        except OSError as e:
+            error = ConnectionError(f"The connection to the server failed: {e}")
+        with self._lock:
+            self._error = error
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(error)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
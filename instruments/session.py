@@ -0,0 +1,44 @@
+import json
+import os
+
+# the version of the session files written, bumped whenever their layout changes
+SESSION_VERSION = 2
+
+
+def upgrade(state: dict) -> dict:
+    """
+    Bring a session of an older version to the current layout.
+
+    Version 1 kept the instruments under "instrument_list" with their row in the
+    list and only the panel settings; version 2 keeps them in list order under
+    "instruments" with the value of every parameter.
+    """
+    version = state.get("version", 1)
+    if version > SESSION_VERSION:
+        raise ValueError(f"Session version {version} is newer than the supported version {SESSION_VERSION}.")
+    if version < 2:
+        instruments = sorted(state.get("instrument_list", []), key=lambda data: data.get("row", 0))
+        state = {key: value for key, value in state.items() if key != "instrument_list"}
+        state["instruments"] = [{"id": data["id"], "type": data["type"], "addr": data.get("addr", ""),
+                                 "settings": data.get("settings") or {}, "params": {}}
+                                for data in instruments]
+    state["version"] = SESSION_VERSION
+    return state
+
+
+def read_session(path: str) -> dict:
+    """Read a session file of any version, in the current layout."""
+    with open(path, "r", encoding="utf-8") as file:
+        return upgrade(json.load(file))
+
+
+def write_session(path: str, state: dict):
+    """
+    Write a session file without spaces, replacing the old file at once so it
+    is never left half written.
+    """
+    state = {"version": SESSION_VERSION, **state}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(state, file, separators=(",", ":"))
+    os.replace(tmp, path)
@@ -0,0 +1,332 @@
+import math
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+
+def _number(text: str) -> float:
+    """The number at the start of a SCPI argument, without its unit, e.g. 1550nm."""
+    match = re.match(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?", text)
+    if match is None:
+        raise ValueError(f"Not a number: {text}")
+    return float(match.group(0))
+
+def _bool(text: str) -> bool:
+    return text.strip().upper() in ("1", "ON", "TRUE")
+
+
+class SimInstrument:
+    """
+    The state of a simulated instrument and the SCPI commands it answers.
+    Subclasses list their commands in `commands` as (regular expression, handler),
+    the handler being called with the groups of the match and returning the
+    response of a query, or None for a write.
+    """
+    idn = "Simulated,Instrument,0,0"
+
+    def __init__(self, noise: float=0.0):
+        self.noise = noise
+        self._lock = threading.Lock()
+        self._commands = [(re.compile(pattern, re.IGNORECASE), func) for pattern, func in self.commands()]
+        self._blocks = [(re.compile(pattern, re.IGNORECASE), func) for pattern, func in self.blocks()]
+
+    def commands(self) -> list:
+        return [
+            (r"\*idn\?", lambda: self.idn),
+            (r"\*opc\?", lambda: "1"),
+            (r"\*rst", self.reset),
+            (r"\*cls", lambda: None),
+            (r"system:error\?", lambda: '+0,"No error"'),
+        ]
+
+    def blocks(self) -> list:
+        """The queries answered with a binary block, as (regular expression, handler returning an array)."""
+        return []
+
+    def reset(self):
+        """Go back to the power-on state."""
+
+    def jitter(self, value: float) -> float:
+        """Add the measurement noise to a value."""
+        return value + random.gauss(0.0, self.noise) if self.noise else value
+
+    def message(self, message: str) -> str:
+        """
+        Run a message, which may be several commands joined with ';', and return
+        the responses of its queries joined with ';', or None if it had none.
+        """
+        responses = []
+        with self._lock:
+            for cmd in message.split(";"):
+                cmd = cmd.strip().lstrip(":")
+                if cmd:
+                    response = self._run(cmd)
+                    if response is not None:
+                        responses.append(str(response))
+        return ";".join(responses) if responses else None
+
+    def block(self, message: str) -> np.ndarray:
+        """Run a query answered with a binary block and return its values."""
+        with self._lock:
+            return self._run(message.strip().lstrip(":"), self._blocks)
+
+    def _run(self, cmd: str, commands: list=None):
+        for pattern, func in self._commands if commands is None else commands:
+            match = pattern.fullmatch(cmd)
+            if match is not None:
+                return func(*match.groups())
+        raise ValueError(f"Undefined header: {cmd}")
+
+
+class SimAgilent816xB(SimInstrument):
+    """
+    A laser and power meter mainframe. The detector sees the laser through a
+    device under test with a fixed insertion loss and a single resonance.
+    """
+    idn = "Agilent Technologies,8163B,SIM0000,V5.25"
+    insertion_loss = 3.0
+    resonance = 1550.5
+    linewidth = 0.05
+    extinction = 20.0
+    dark_power = -80.0
+
+    def __init__(self, noise: float=0.01):
+        self.reset()
+        super().__init__(noise=noise)
+
+    def reset(self):
+        self.laser_wav = 1550.0
+        self.laser_pow = 0.0
+        self.laser_state = False
+        self.laser_unit = "DBM"
+        self.detect_wav = 1550.0
+        self.detect_unit = "DBM"
+        self.detect_avgtime = 0.1
+        # the points, averaging time and start of the data logging
+        self.logging = None
+
+    def commands(self) -> list:
+        laser = r"source\d:channel\d:"
+        detect = r"sense\d:channel\d:"
+        return super().commands() + [
+            (laser + r"wavelength:fixed (.+)", lambda v: setattr(self, "laser_wav", _number(v))),
+            (laser + r"wavelength\?", lambda: f"{self.laser_wav * 1E-9:.6e}"),
+            (laser + r"power:state (.+)", lambda v: setattr(self, "laser_state", _bool(v))),
+            (laser + r"power:state\?", lambda: str(int(self.laser_state))),
+            (laser + r"power:level:immediate:amplitude (.+)", lambda v: setattr(self, "laser_pow", _number(v))),
+            (laser + r"power:unit (.+)", lambda v: setattr(self, "laser_unit", v.strip().upper())),
+            (laser + r"am:state (.+)", lambda v: None),
+            (detect + r"power:wavelength (.+)", lambda v: setattr(self, "detect_wav", _number(v))),
+            (detect + r"power:unit (.+)", lambda v: setattr(self, "detect_unit", v.strip().upper())),
+            (detect + r"power:atime (.+)", lambda v: setattr(self, "detect_avgtime", _number(v))),
+            (detect + r"power:range(:auto)? (.+)", lambda *v: None),
+            (detect + r"correction (.+)", lambda v: None),
+            (detect + r"function:parameter:logging (.+),(.+)", self.set_logging),
+            (detect + r"function:state (.+),(.+)", self.set_function_state),
+            (detect + r"function:state\?", self.function_state),
+            (r"trigger\d:channel\d:(input|output) (.+)", lambda *v: None),
+            (r"read\d:channel\d:power\?", self.read_power),
+            (r"display:lockout (.+)", lambda v: None),
+            (r"lock (.+)", lambda v: None),
+        ]
+
+    def transmission(self, wavelength: float) -> float:
+        """The loss of the device under test in dB."""
+        detuning = (wavelength - self.resonance) / (self.linewidth / 2)
+        return self.insertion_loss + self.extinction / (1 + detuning**2)
+
+    def blocks(self) -> list:
+        return super().blocks() + [
+            (r"sense\d:channel\d:function:result\?", self.logging_result),
+        ]
+
+    def detected_power(self) -> float:
+        """The power at the detector in dBm, without noise."""
+        power = self.laser_pow
+        if self.laser_unit in ("W", "WATT", "MW", "1"):
+            power = 10 * math.log10(max(power, 1E-12) * 1E3)
+        return power - self.transmission(self.laser_wav) if self.laser_state else self.dark_power
+
+    def read_power(self) -> str:
+        power = self.jitter(self.detected_power())
+        if self.detect_unit in ("W", "WATT", "MW", "1"):
+            return f"{10**(power / 10) * 1E-3:+.6e}"
+        return f"{power:+.6e}"
+
+    def set_logging(self, points: str, avgtime: str):
+        self.logging = [int(_number(points)), _number(avgtime), None]
+
+    def set_function_state(self, function: str, state: str):
+        if self.logging is not None and function.strip().upper().startswith("LOGG"):
+            self.logging[2] = time.monotonic() if state.strip().upper() == "START" else None
+
+    def function_state(self) -> str:
+        if self.logging is None or self.logging[2] is None:
+            return "NONE,NONE"
+        points, avgtime, start = self.logging
+        done = time.monotonic() - start >= points * avgtime
+        return "LOGGING_STABILITY," + ("COMPLETE" if done else "PROGRESS")
+
+    def logging_result(self) -> np.ndarray:
+        """The logged powers in W, always in W whatever the unit of the detector."""
+        if self.logging is None:
+            return np.empty(0)
+        points = self.logging[0]
+        power = self.detected_power() + np.random.normal(0.0, self.noise, points)
+        return 10**(power / 10) * 1E-3
+
+
+class SimAgilent8164B(SimAgilent816xB):
+    idn = "Agilent Technologies,8164B,SIM0000,V5.25"
+
+
+class SimAgilentE3640A(SimInstrument):
+    """A DC power supply driving a resistive load."""
+    idn = "Agilent Technologies,E3640A,SIM0000,1.5-5.0-1.0"
+    load = 10.0
+    # maximum voltage and current of each range
+    ranges = {"LOW": (8.24, 3.09), "HIGH": (20.6, 1.545)}
+
+    def __init__(self, noise: float=1E-5):
+        self.reset()
+        super().__init__(noise=noise)
+
+    def reset(self):
+        self.volt = 0.0
+        self.curr_lim = 1.0
+        self.vrange = "LOW"
+        self.output = False
+
+    def commands(self) -> list:
+        return super().commands() + [
+            (r"voltage ([^?]+)", lambda v: setattr(self, "volt", _number(v))),
+            (r"current ([^?]+)", lambda v: setattr(self, "curr_lim", _number(v))),
+            (r"apply (.+?)\s*,\s*(.+)", self.apply),
+            (r"apply\?", lambda: f'"{self.volt:.6f},{self.curr_lim:.6f}"'),
+            (r"voltage:range (\w+)", lambda v: setattr(self, "vrange", v.upper())),
+            (r"output (\w+)", lambda v: setattr(self, "output", _bool(v))),
+            (r"output\?", lambda: str(int(self.output))),
+            (r"measure:current\?", lambda: f"{self.jitter(self.current()):.6e}"),
+            (r"measure:voltage\?", lambda: f"{self.jitter(self.current() * self.load):.6e}"),
+            (r"voltage\? max", lambda: f"{self.ranges[self.vrange][0]:.6e}"),
+            (r"current\? max", lambda: f"{self.ranges[self.vrange][1]:.6e}"),
+            (r"display (\w+)", lambda v: None),
+        ]
+
+    def apply(self, volt: str, curr: str):
+        self.volt = _number(volt)
+        self.curr_lim = _number(curr)
+
+    def current(self) -> float:
+        """The current through the load, limited by the current limit."""
+        if not self.output:
+            return 0.0
+        return min(self.volt / self.load, self.curr_lim)
+
+
+MODELS = {
+    "Agilent8163B": SimAgilent816xB,
+    "Agilent8164B": SimAgilent8164B,
+    "AgilentE3640A": SimAgilentE3640A,
+}
+
+# the bench the simulator presents when none is given
+DEFAULT_BENCH = {
+    "GPIB0::20::INSTR": "Agilent8163B",
+    "GPIB0::5::INSTR": "AgilentE3640A",
+}
+
+
+class SimResource:
+    """Stands in for a pyvisa resource, answering from a simulated instrument."""
+    def __init__(self, addr: str, instrument: SimInstrument, latency: float=0.0, jitter: float=0.0):
+        self.resource_name = addr
+        self.instrument = instrument
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout = 2000
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self.resource_info = (None, None, None, addr)
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0.0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def write(self, message: str):
+        self._delay()
+        self.instrument.message(message)
+
+    def query(self, message: str) -> str:
+        self._delay()
+        response = self.instrument.message(message)
+        if response is None:
+            # a real instrument has nothing to send back either
+            time.sleep(self.timeout * 1E-3)
+            raise TimeoutError(f"Timeout expired before {message} was answered.")
+        return response + self.read_termination
+
+    def query_binary_values(self, message: str, datatype: str="f", is_big_endian: bool=False,
+                            container=list, **kwargs):
+        self._delay()
+        values = np.asarray(self.instrument.block(message), dtype=datatype)
+        return values if container in (np.ndarray, np.array) else container(values.tolist())
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SimResourceManager:
+    """
+    A VISA resource manager whose resources are simulated instruments, to run the
+    app, scripts and the server without hardware.
+
+    Parameters
+    ----------
+    instruments: dict
+        The instruments by resource string, as a type name of `MODELS`, a
+        SimInstrument class or instance, by default `DEFAULT_BENCH`
+    latency: float
+        The time every transaction takes in s
+    jitter: float
+        The most extra time a transaction takes at random in s
+    """
+    def __init__(self, instruments: dict=None, latency: float=0.0, jitter: float=0.0):
+        self.timeout = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.instruments = {}
+        for addr, instrument in (DEFAULT_BENCH if instruments is None else instruments).items():
+            self.add(addr, instrument)
+
+    def __reduce__(self):
+        # a worker process gets a bus of its own with the same kinds of instrument
+        return type(self), ({addr: type(instrument) for addr, instrument in self.instruments.items()},
+                            self.latency, self.jitter)
+
+    def add(self, addr: str, instrument):
+        """Put an instrument on the bus, by type name, class or instance."""
+        if isinstance(instrument, str):
+            instrument = MODELS[instrument]()
+        elif isinstance(instrument, type):
+            instrument = instrument()
+        self.instruments[addr] = instrument
+        return instrument
+
+    def list_resources(self, query: str="?*::INSTR") -> tuple:
+        return tuple(self.instruments)
+
+    def open_resource(self, addr: str, open_timeout: int=0, **kwargs) -> SimResource:
+        if addr not in self.instruments:
+            raise ConnectionError(f"{addr} is not on the simulated bus.")
+        return SimResource(addr, self.instruments[addr], self.latency, self.jitter)
+
+    def close(self):
+        pass
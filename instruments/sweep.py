@@ -0,0 +1,293 @@
+import threading
+import time
+
+import numpy as np
+
+from instruments.history import timestamp
+from instruments.scpi import ScpiBatch, query_block
+
+
+class SweepAborted(Exception):
+    """Raised when a sweep is aborted before it finishes."""
+
+
+class Spectrum:
+    """The result of a sweep, usable as a plot trace source."""
+    def __init__(self, x: np.ndarray=None, y: np.ndarray=None):
+        self.x = np.empty(0) if x is None else x
+        self.y = np.empty(0) if y is None else y
+
+    def latest(self):
+        return self.x, self.y
+
+    def __len__(self):
+        return len(self.x)
+
+
+class HardwareTimed:
+    """
+    A measurement timed by the instrument itself, which is waited for by polling
+    its state and can be aborted between the polls.
+    """
+    poll_interval = 0.05
+
+    def __init__(self):
+        self.cancel = threading.Event()
+
+    def abort(self):
+        """Ask the measurement to stop at the next check."""
+        self.cancel.set()
+
+    def _wait(self, done, timeout: float):
+        """Poll `done` until it is true, the measurement is aborted or the timeout expires."""
+        end = time.monotonic() + timeout
+        while not done():
+            if self.cancel.is_set():
+                raise SweepAborted(f"The {self.what} was aborted.")
+            if time.monotonic() > end:
+                raise TimeoutError(f"The {self.what} did not finish in time.")
+            time.sleep(self.poll_interval)
+
+
+class WavelengthSweep(HardwareTimed):
+    """
+    A hardware-timed wavelength sweep of an Agilent 8163B/8164B.
+
+    The laser sweeps continuously and sends a trigger every step, on which the
+    power meter logs a sample into its internal memory. Once the sweep is done
+    the wavelengths and powers are each fetched as one binary block, so the
+    number of bus transactions does not depend on the number of points.
+
+    Parameters
+    ----------
+    instr:
+        The pyoctal Agilent816xB driver
+    start, stop: float
+        The sweep range in nm
+    step: float
+        The step in pm
+    speed: float
+        The sweep speed in nm/s
+    avgtime: float
+        The power meter averaging time in s, shorter than a step
+    """
+    what = "sweep"
+
+    def __init__(self, instr, start: float=1540.0, stop: float=1560.0, step: float=5.0,
+                 speed: float=5.0, avgtime: float=1E-4):
+        if stop <= start:
+            raise ValueError("The stop wavelength must be above the start wavelength.")
+        if avgtime >= step * 1E-3 / speed:
+            raise ValueError("The averaging time must be shorter than the time of one step.")
+        super().__init__()
+        self.instr = instr
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.speed = speed
+        self.avgtime = avgtime
+
+    @property
+    def points(self) -> int:
+        return int(round((self.stop - self.start) * 1E3 / self.step)) + 1
+
+    @property
+    def duration(self) -> float:
+        """The expected duration of the sweep itself in s."""
+        return (self.stop - self.start) / self.speed
+
+    def run(self) -> Spectrum:
+        """Run the sweep and return the wavelengths [nm] and powers [W]."""
+        instr = self.instr
+        self.cancel.clear()
+        with ScpiBatch(instr):
+            instr.set_detect_func_mode(mode=("logging", "stop"))
+            instr.set_unit(source="dBm", sensor="Watt")
+            instr.set_laser_wav(self.start)
+            instr.set_laser_am_state(0)
+            instr.set_laser_state(1)
+            instr.set_detect_wav((self.start + self.stop) / 2)
+            instr.set_detect_avgtime(self.avgtime)
+
+            instr.set_trig_config(config="loop")
+            instr.set_trig_responses(instr.src_num, instr.src_chan, in_rsp="ignored", out_rsp="stfinished")
+            instr.set_trig_responses(instr.sens_num, instr.sens_chan, in_rsp="smeasure", out_rsp="disabled")
+
+            instr.set_sweep_mode(mode="continuous")
+            instr.set_sweep_repeat_mode(mode="oneway")
+            instr.set_sweep_cycles(cycles=1)
+            instr.set_sweep_start_stop(start=self.start, stop=self.stop)
+            instr.set_sweep_step(step=self.step)
+            instr.set_sweep_speed(speed=self.speed)
+            instr.set_sweep_wav_logging(status=1)
+            trigno = instr.get_sweep_trigno()
+
+            instr.set_detect_func_params(mode="logging", params=(trigno, self.avgtime))
+            instr.set_detect_func_mode(mode=("logging", "start"))
+            instr.set_sweep_state(state="start")
+
+        timeout = 2 * self.duration + 30
+        try:
+            self._wait(lambda: not instr.get_sweep_state(), timeout)
+            self._wait(lambda: instr.get_laser_points(mode="llogging") >= trigno, timeout)
+            self._wait(lambda: not instr.get_detect_func_state().lower().endswith("progress"), timeout)
+        except Exception:
+            with ScpiBatch(instr):
+                instr.set_sweep_state(state="stop")
+                instr.set_detect_func_mode(mode=("logging", "stop"))
+            raise
+
+        wavelengths = query_block(instr, f"{instr.laser}:read:data? llogging", datatype="d")
+        powers = query_block(instr, f"{instr.detect}:function:result?", datatype="f")
+        instr.set_detect_func_mode(mode=("logging", "stop"))
+
+        n = min(len(wavelengths), len(powers))
+        # the laser logs in m
+        return Spectrum(wavelengths[:n] * 1E9, powers[:n].astype(float))
+
+
+class PowerBurst(HardwareTimed):
+    """
+    A burst of power readings logged by an Agilent 8163B/8164B power meter.
+
+    The power meter logs `points` samples, one every averaging time, into its
+    internal memory without a trigger. They are then fetched as one binary
+    block, so the sample rate is set by the averaging time instead of by the
+    bus, e.g. 10 kHz at 100 us.
+
+    Parameters
+    ----------
+    instr:
+        The pyoctal Agilent816xB driver
+    points: int
+        The number of samples to log
+    avgtime: float
+        The averaging time of each sample in s
+    """
+    what = "burst"
+    # the size of the logging memory of the power meter
+    MAX_POINTS = 100000
+
+    def __init__(self, instr, points: int=1000, avgtime: float=1E-4):
+        points = int(points)
+        if not 1 <= points <= self.MAX_POINTS:
+            raise ValueError(f"The number of points must be between 1 and {self.MAX_POINTS}.")
+        if avgtime <= 0:
+            raise ValueError("The averaging time must be positive.")
+        super().__init__()
+        self.instr = instr
+        self.points = points
+        self.avgtime = avgtime
+
+    @property
+    def duration(self) -> float:
+        """The expected duration of the logging in s."""
+        return self.points * self.avgtime
+
+    def run(self) -> Spectrum:
+        """Log the burst and return the times of the samples [s, see `timestamp`] and powers [W]."""
+        instr = self.instr
+        self.cancel.clear()
+        with ScpiBatch(instr):
+            instr.set_detect_func_mode(mode=("logging", "stop"))
+            # every sample is logged on the internal clock, not on a trigger
+            instr.set_trig_responses(instr.sens_num, instr.sens_chan, in_rsp="ignored", out_rsp="disabled")
+            instr.set_detect_func_params(mode="logging", params=(self.points, self.avgtime))
+            instr.set_detect_func_mode(mode=("logging", "start"))
+        start = timestamp()
+
+        try:
+            self._wait(lambda: not instr.get_detect_func_state().endswith("progress"), 2 * self.duration + 10)
+        except Exception:
+            instr.set_detect_func_mode(mode=("logging", "stop"))
+            raise
+
+        powers = query_block(instr, f"{instr.detect}:function:result?", datatype="f")
+        instr.set_detect_func_mode(mode=("logging", "stop"))
+        # the samples are evenly spaced from the start of the logging
+        times = start + self.avgtime * np.arange(1, len(powers) + 1)
+        return Spectrum(times, powers.astype(float))
+
+
+class VoltageSweep:
+    """
+    A voltage sweep (IV curve) of an Agilent E3640A.
+
+    The readings are written into preallocated arrays as they come in, so the
+    sweep can be plotted while it runs through `latest()`, and it can be
+    aborted between steps.
+
+    Parameters
+    ----------
+    instr:
+        The pyoctal AgilentE3640A driver
+    start, stop, step: float
+        The voltages of the sweep in V
+    dwell: float
+        The settling time after each step in s
+    compliance: float
+        The current limit in A; the sweep stops once it is reached
+    bidirectional: bool
+        Sweep back down to the start voltage after reaching the stop voltage
+    """
+    # a supply in constant current mode reads slightly below its limit
+    compliance_margin = 0.99
+
+    def __init__(self, instr, start: float=0.0, stop: float=1.0, step: float=0.1,
+                 dwell: float=0.1, compliance: float=0.1, bidirectional: bool=False):
+        if step == 0 or (stop - start) * step < 0:
+            raise ValueError("The step must go from the start towards the stop voltage.")
+        if dwell < 0 or compliance <= 0:
+            raise ValueError("The dwell time and compliance must be positive.")
+        self.instr = instr
+        self.dwell = dwell
+        self.compliance = compliance
+        setpoints = start + step * np.arange(int(np.floor((stop - start) / step + 1E-9)) + 1)
+        if bidirectional:
+            setpoints = np.concatenate([setpoints, setpoints[-2::-1]])
+        self.setpoints = setpoints
+        self.voltage = np.full(len(setpoints), np.nan)
+        self.current = np.full(len(setpoints), np.nan)
+        self.time = np.full(len(setpoints), np.nan)
+        self.count = 0
+        self.compliance_reached = False
+        self.cancel = threading.Event()
+
+    def __len__(self):
+        return self.count
+
+    def latest(self):
+        """Views of the voltages and currents measured so far."""
+        n = self.count
+        return self.voltage[:n], self.current[:n]
+
+    def abort(self):
+        """Ask the sweep to stop before the next step."""
+        self.cancel.set()
+
+    def run(self):
+        """Run the sweep, returning the measured voltages [V] and currents [A]."""
+        instr = self.instr
+        self.cancel.clear()
+        self.count = 0
+        instr.set_params(self.setpoints[0], self.compliance)
+        instr.set_output_state(1)
+        start = time.perf_counter()
+        for i, volt in enumerate(self.setpoints):
+            if self.cancel.is_set():
+                raise SweepAborted("The sweep was aborted.")
+            instr.set_volt(volt)
+            # only the settling time is waited for, the bus time is part of it
+            settled = time.perf_counter() + self.dwell
+            if self.cancel.wait(max(0.0, settled - time.perf_counter())):
+                raise SweepAborted("The sweep was aborted.")
+
+            self.current[i] = instr.get_curr()
+            # at the current limit the supply regulates the current, so the voltage falls below the setpoint
+            self.voltage[i] = instr.get_volt()
+            self.time[i] = time.perf_counter() - start
+            self.count = i + 1
+            if abs(self.current[i]) >= self.compliance * self.compliance_margin:
+                self.compliance_reached = True
+                break
+        return self.latest()
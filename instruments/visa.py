@@ -0,0 +1,216 @@
+import collections
+import threading
+import time
+
+from instruments.metrics import command_name, get_metrics
+
+_rm = None
+_lock = threading.Lock()
+
+# seconds an instrument has to open and identify itself before it is given up on
+DEFAULT_TIMEOUT = 5.0
+
+def resource_manager():
+    """
+    Get the VISA resource manager shared by every instrument, opening it on first use
+    so the VISA library is only loaded once an instrument is added.
+    """
+    global _rm
+    with _lock:
+        if _rm is None:
+            import pyvisa
+            _rm = pyvisa.ResourceManager()
+        return _rm
+
+def set_resource_manager(rm):
+    """Use another resource manager for the instruments opened from now on, e.g. a simulated one."""
+    global _rm
+    with _lock:
+        _rm = rm
+
+
+class FairLock:
+    """
+    A reentrant lock granted in the order it was asked for, so a panel polling
+    one module cannot starve the others sharing its session.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._queue = collections.deque()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self, blocking: bool=True, timeout: float=None) -> bool:
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return True
+            if not blocking and (self._owner is not None or self._queue):
+                return False
+            self._queue.append(me)
+            if not self._cond.wait_for(lambda: self._owner is None and self._queue[0] == me, timeout):
+                self._queue.remove(me)
+                self._cond.notify_all()
+                return False
+            self._queue.popleft()
+            self._owner = me
+            self._depth = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Cannot release a lock that is not held.")
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def waiting(self) -> int:
+        """Number of threads queued for the lock."""
+        with self._cond:
+            return len(self._queue)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Session:
+    """
+    A VISA session shared by every driver talking to the same resource, e.g. the
+    modules of one 8163B/8164B mainframe. It stands in for the pyvisa resource of
+    each driver, and every call on it is one transaction under the session lock,
+    timed by command into the shared metrics.
+    """
+    def __init__(self, addr: str, resource):
+        self.addr = addr
+        self.resource = resource
+        self.lock = FairLock()
+        self.users = 0
+        self.transactions = 0
+        self.metrics = get_metrics()
+
+    @property
+    def timeout(self):
+        return self.resource.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        with self.lock:
+            self.resource.timeout = value
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.resource, name)
+        if not callable(attr):
+            return attr
+
+        def transaction(*args, **kwargs):
+            if not self.metrics.enabled:
+                with self.lock:
+                    self.transactions += 1
+                    return attr(*args, **kwargs)
+            start = time.perf_counter()
+            with self.lock:
+                acquired = time.perf_counter()
+                self.transactions += 1
+                error = None
+                try:
+                    return attr(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    self.metrics.observe(self.addr, command_name(args[0] if args else name),
+                                         time.perf_counter() - acquired, acquired - start, error)
+        return transaction
+
+
+class SessionPool:
+    """The open sessions by resource string, each closed when its last driver lets go."""
+    def __init__(self):
+        self._sessions = {}
+        self._opening = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def open(self, rm, addr: str, timeout: float=DEFAULT_TIMEOUT,
+             read_termination: str="\n", write_termination: str="\n") -> Session:
+        """Get the session of a resource, opening it if no driver uses it yet."""
+        with self._lock:
+            opening = self._opening[addr]
+        # different resources open concurrently, the same one only once
+        with opening:
+            with self._lock:
+                session = self._sessions.get(addr)
+            if session is None:
+                resource = rm.open_resource(addr, open_timeout=int(timeout * 1E3))
+                resource.read_termination = read_termination
+                resource.write_termination = write_termination
+                session = Session(addr, resource)
+                with self._lock:
+                    self._sessions[addr] = session
+            with self._lock:
+                session.users += 1
+        return session
+
+    def close(self, session: Session):
+        """Let go of a session, closing it if no other driver uses it."""
+        with self._lock:
+            session.users -= 1
+            if session.users > 0:
+                return
+            self._sessions.pop(session.addr, None)
+        try:
+            session.resource.close()
+        except Exception as e:
+            print("Session issue: \n", e)
+
+    def sessions(self) -> dict:
+        with self._lock:
+            return dict(self._sessions)
+
+
+_pool = SessionPool()
+
+def get_pool() -> SessionPool:
+    """Get the pool of VISA sessions shared by the app."""
+    return _pool
+
+
+def open_session(instr, addr: str, timeout: float=DEFAULT_TIMEOUT):
+    """
+    Connect a pyoctal driver as its `connect` does, but through the shared session
+    of its resource, and give up on an instrument that does not open or answer
+    *IDN? within `timeout` s instead of waiting on the VISA defaults.
+    """
+    if addr.startswith("ASRL"):
+        instr._read_termination = "\r\n"
+    try:
+        session = _pool.open(instr.rm, addr, timeout, instr._read_termination, instr._write_termination)
+    except Exception as e:
+        raise ConnectionError(f"Cannot open {addr}: {e}") from e
+
+    instr._addr = addr
+    instr._instr = session
+    try:
+        with session.lock:
+            default, session.timeout = session.timeout, timeout * 1E3
+            try:
+                instr._identity = instr.get_idn()
+            finally:
+                session.timeout = default
+    except Exception as e:
+        close_session(instr)
+        raise ConnectionError(f"{addr} did not identify itself: {e}") from e
+
+
+def close_session(instr):
+    """Detach a driver from its shared session."""
+    session = getattr(instr, "_instr", None)
+    if isinstance(session, Session):
+        instr._instr = None
+        _pool.close(session)
@@ -0,0 +1,359 @@
+"""
+Worker processes running the acquisition of devices outside the GUI process.
+
+A device created with `process` set opens its instrument in a worker process
+instead, see `Device.connect`. The worker polls the instrument and writes every
+reading into a ring in shared memory, from which the device in the GUI process
+collects them without pickling, so polling, SCPI I/O and decoding never hold
+the GIL of the GUI. Everything else the device sends, e.g. its settings or a
+sweep, is forwarded to the worker as one request per transaction.
+
+Devices created with the same group name share a worker process, e.g. the
+modules of one mainframe; each other device gets a process of its own.
+"""
+import itertools
+import multiprocessing
+import pickle
+import threading
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from instruments.core import NOTHING
+from instruments.metrics import get_metrics
+from instruments.scheduler import get_scheduler
+from instruments.sim import SimResourceManager
+from instruments.visa import close_session
+
+_processes = {}
+_lock = threading.Lock()
+_ids = itertools.count()
+
+
+class SampleRing:
+    """
+    A ring of timestamped samples in shared memory, written by one process and
+    read by another without a lock.
+
+    The writer stores a sample before it counts it as written, so the reader only
+    ever copies finished samples. A reader that falls more than a whole ring
+    behind loses the oldest samples and counts them as dropped.
+    """
+    CAPACITY = 65536
+    # the count of samples written, then (time, value) float64 pairs
+    HEADER = 8
+
+    def __init__(self, name: str=None, capacity: int=CAPACITY):
+        create = name is None
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+                                              size=self.HEADER + 16 * capacity if create else 0)
+        self._owner = create
+        self._written = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self._samples = np.ndarray((capacity, 2), dtype=np.float64, buffer=self.shm.buf, offset=self.HEADER)
+        if create:
+            self._written[0] = 0
+        self.read_count = int(self._written[0])
+        self.dropped = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, t: float, value: float):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = np.nan
+        n = int(self._written[0])
+        self._samples[n % self.capacity] = (t, value)
+        self._written[0] = n + 1
+
+    def read(self):
+        """Copy the samples written since the last read, as arrays of times and values."""
+        end = int(self._written[0])
+        start = max(self.read_count, end - self.capacity)
+        self.dropped += start - self.read_count
+        block = self._samples[np.arange(start, end) % self.capacity]
+        # the writer may have lapped the samples being copied
+        overwritten = int(self._written[0]) - self.capacity - start
+        if overwritten > 0:
+            block = block[overwritten:]
+            self.dropped += overwritten
+        self.read_count = end
+        return block[:, 0], block[:, 1]
+
+    def close(self):
+        # the views must go before the memory can be unmapped
+        del self._written, self._samples
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class WorkerResource:
+    """
+    Stands in for the VISA resource of a driver in the GUI process, running
+    every call as a transaction in the worker process.
+    """
+    def __init__(self, process, device_id: int):
+        self._process = process
+        self._device_id = device_id
+
+    @property
+    def timeout(self):
+        return self._process.call("get", self._device_id, "timeout")
+
+    @timeout.setter
+    def timeout(self, value):
+        self._process.call("set", self._device_id, "timeout", value)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def transaction(*args, **kwargs):
+            return self._process.call("io", self._device_id, name, args, kwargs)
+        return transaction
+
+
+class WorkerProcess:
+    """
+    A process running the acquisition of one or more devices. The SCPI metrics
+    of its transactions are added to the shared metrics of the GUI process.
+    """
+    def __init__(self, name: str):
+        # spawned, as forking a process with Qt and threads running is not safe
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), name=f"pyoctal-{name}", daemon=True)
+        self.process.start()
+        child.close()
+        self._lock = threading.Lock()
+        self.users = 0
+        get_metrics().add_source(self)
+
+    def call(self, op: str, device_id: int, *args):
+        """Run a request in the worker process and return its result, raising its error."""
+        with self._lock:
+            self._conn.send((op, device_id, args))
+            ok, result = self._conn.recv()
+        if not ok:
+            raise result
+        return result
+
+    def metrics(self) -> dict:
+        """The SCPI metrics of the process by (instrument, command)."""
+        return self.call("metrics", None)
+
+    def reset_metrics(self):
+        self.call("reset_metrics", None)
+
+    def close(self, timeout: float=5.0):
+        try:
+            last = self.metrics()
+        except Exception:
+            last = None
+        get_metrics().remove_source(self, last)
+        try:
+            self.call("exit", None)
+        except (EOFError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._conn.close()
+
+
+def _get_process(group: str) -> WorkerProcess:
+    with _lock:
+        process = _processes.get(group)
+        if process is None or not process.process.is_alive():
+            process = _processes[group] = WorkerProcess(group)
+        process.users += 1
+        return process
+
+def _release_process(group: str):
+    with _lock:
+        process = _processes.get(group)
+        if process is None:
+            return
+        process.users -= 1
+        if process.users > 0:
+            return
+        del _processes[group]
+    process.close()
+
+
+class DeviceWorker:
+    """
+    The GUI side of a device whose instrument is opened in a worker process.
+    It takes the place of the device's VISA session and polling, see
+    `Device.connect`.
+
+    Parameters
+    ----------
+    device: Device
+        The device in this process
+    group: str
+        The worker process shared with the other devices of the group, or
+        None for a process of its own
+    """
+    def __init__(self, device, group: str=None):
+        self.device = device
+        self.group = group if group is not None else uuid.uuid4().hex[:8]
+        self.id = next(_ids)
+        self.process = None
+        self.rings = {}
+        self.resource = None
+        self.identity = None
+
+    def open(self, addr: str, timeout: float):
+        """Open the instrument in the worker process and collect its polled readings from now on."""
+        device = self.device
+        self.process = _get_process(self.group)
+        self.rings = {key: SampleRing() for key in device.polled}
+        try:
+            self.identity = self.process.call("attach", self.id, type(device), _portable(device.instr.rm), addr,
+                                              timeout, device.poller.period,
+                                              {key: ring.name for key, ring in self.rings.items()})
+        except Exception:
+            self._release()
+            raise
+        self.resource = WorkerResource(self.process, self.id)
+
+    def close(self):
+        """Close the instrument in the worker process, and the process once no device uses it."""
+        if self.process is None:
+            return
+        try:
+            self.process.call("detach", self.id)
+        except Exception as e:
+            print("Worker issue: \n", e)
+        self._release()
+
+    def _release(self):
+        _release_process(self.group)
+        self.process = None
+        self.resource = None
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+    def start(self, period: float):
+        self.process.call("poll", self.id, True, period)
+
+    def stop(self, wait: bool=True):
+        if self.process is not None:
+            self.process.call("poll", self.id, False, None, wait)
+
+    def stats(self) -> list:
+        """The polling statistics of the worker process."""
+        return self.process.call("stats", self.id) if self.process is not None else []
+
+    def collect(self, param):
+        """
+        Take the readings of a parameter polled in the worker process into its
+        history and listeners, and return the latest, or NOTHING if there are none.
+        """
+        ring = self.rings.get(param.key)
+        if ring is None:
+            return NOTHING
+        t, values = ring.read()
+        if not len(t):
+            return NOTHING
+        param.extend(t, values)
+        return float(values[-1])
+
+
+def _portable(rm):
+    """
+    The resource manager to open the instrument with in the worker process: a
+    simulated one is recreated there, VISA is opened there afresh.
+    """
+    return rm if isinstance(rm, SimResourceManager) else None
+
+
+def _serve(conn):
+    """The main loop of a worker process, running the requests of the GUI process."""
+    devices = {}
+    rings = {}
+    while True:
+        try:
+            op, device_id, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            result = _handle(devices, rings, op, device_id, args)
+        except Exception as e:
+            conn.send((False, _portable_error(e)))
+        else:
+            conn.send((True, result))
+        if op == "exit":
+            break
+    for device_id in list(devices):
+        _handle(devices, rings, "detach", device_id, ())
+    get_scheduler().shutdown()
+
+def _handle(devices: dict, rings: dict, op: str, device_id: int, args: tuple):
+    if op == "exit":
+        return None
+    if op == "metrics":
+        return get_metrics().commands()
+    if op == "reset_metrics":
+        get_metrics().reset()
+        return None
+    if op == "attach":
+        cls, rm, addr, timeout, period, ring_names = args
+        device = cls(rm=rm, period=period, process=False)
+        device.connect(addr, timeout)
+        devices[device_id] = device
+        rings[device_id] = []
+        for key, name in ring_names.items():
+            ring = SampleRing(name)
+            rings[device_id].append(ring)
+            device.params[key].add_listener(lambda param, t, value, ring=ring: ring.write(t, value))
+        return device.instr._identity
+
+    device = devices[device_id]
+    if op == "io":
+        name, args, kwargs = args
+        with device.commands.lock:
+            return getattr(device.instr._instr, name)(*args, **kwargs)
+    if op == "get":
+        return getattr(device.instr._instr, args[0])
+    if op == "set":
+        setattr(device.instr._instr, *args)
+        return None
+    if op == "poll":
+        state, period, *wait = args
+        if not state:
+            device.poller.stop(*wait)
+            return None
+        if period != device.poller.period:
+            device.poller.set_period(period)
+        device.poller.start()
+        return None
+    if op == "stats":
+        return device.poller.stats()
+    if op == "detach":
+        device.poller.stop()
+        for param in device.params.values():
+            param.listeners.clear()
+        with device.commands.lock:
+            close_session(device.instr)
+        device.connected = False
+        del devices[device_id]
+        for ring in rings.pop(device_id, []):
+            ring.close()
+        return None
+    raise ValueError(f"Unknown request: {op}")
+
+def _portable_error(e: Exception) -> Exception:
+    """The error itself if it can be sent to the GUI process, or its message otherwise."""
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
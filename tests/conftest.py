@@ -0,0 +1,9 @@
+import pytest
+
+from instruments.scheduler import get_scheduler
+
+
+@pytest.fixture(scope="session", autouse=True)
+def scheduler():
+    yield
+    get_scheduler().shutdown()
@@ -0,0 +1,100 @@
+"""Regression tests of the command queue, its cache and batches, against simulated instruments."""
+import threading
+import time
+
+import pytest
+
+from instruments.devices import Agilent8163B, AgilentE3640A
+from instruments.sim import SimResourceManager
+
+PSU = "GPIB0::5::INSTR"
+PM = "GPIB0::20::INSTR"
+
+
+def open_device(cls, addr: str, latency: float=0.0):
+    device = cls(rm=SimResourceManager(latency=latency))
+    device.connect(addr)
+    device.initialise()
+    assert device.wait(5)
+    return device
+
+
+@pytest.fixture
+def psu():
+    device = open_device(AgilentE3640A, PSU, latency=0.02)
+    yield device
+    device.close()
+
+
+@pytest.fixture
+def pm():
+    device = open_device(Agilent8163B, PM, latency=0.05)
+    yield device
+    device.close()
+
+
+def busy(device, duration: float):
+    """Keep the command queue of a device busy for `duration` s."""
+    device.commands.submit(None, time.sleep, duration)
+    time.sleep(0.01)
+
+
+def applied(psu) -> tuple:
+    """The voltage and current the supply was set to."""
+    volt, curr = psu.instr.query("apply?").strip('"').split(",")
+    return float(volt), float(curr)
+
+
+def test_write_not_skipped_while_same_key_in_flight(pm):
+    pm.set("laser_wav", 1550.0)
+    pm["laser_wav"].set(1551.0)
+    # 1551 is being sent and the cache still holds 1550
+    time.sleep(0.01)
+    pm["laser_wav"].set(1550.0)
+    assert pm.wait(5)
+    assert float(pm.instr.query("source1:channel1:wavelength?")) == pytest.approx(1550E-9)
+
+
+def test_voltage_sent_again_after_apply(psu):
+    psu.set("volt", "1")
+    # the limits are set with APPLY, which sets the voltage too
+    psu.set("volt_lim", "5")
+    assert applied(psu)[0] == pytest.approx(5.0)
+    psu.set("volt", "1")
+    assert applied(psu)[0] == pytest.approx(1.0)
+
+
+def test_restore_sends_voltage_changed_by_apply(psu):
+    psu.set("volt_lim", "5")
+    psu.set("curr_lim", "0.5")
+    psu.set("volt", "1")
+    settings = psu.settings()
+    psu.set("volt_lim", "6")
+    assert "volt" in psu.apply(settings)
+    assert psu.wait(5)
+    assert applied(psu) == pytest.approx((1.0, 0.5))
+
+
+def test_second_batch_does_not_drop_first(psu):
+    busy(psu, 0.3)
+    assert psu.apply({"vrange": "HIGH"}) == ["vrange"]
+    assert psu.apply({"volt_lim": "5", "curr_lim": "0.5"}) == ["volt_lim", "curr_lim"]
+    assert psu.wait(5)
+    assert psu.get("volt_max") == pytest.approx(20.6)
+    assert applied(psu) == pytest.approx((5.0, 0.5))
+    assert not psu.errors
+
+
+def test_batches_of_two_threads_are_kept_apart(psu):
+    def restore(key: str, value: str):
+        with psu.commands.batch(f"restore-{key}"):
+            psu[key].set(value)
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=restore, args=args) for args in (("volt_lim", "6"), ("curr_lim", "0.4"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert psu.wait(5)
+    assert applied(psu) == pytest.approx((6.0, 0.4))
@@ -1,74 +1,112 @@
 import math
+from functools import lru_cache
+
+import numpy as np
+
+SI_PREFIXES = {
+    "y": 1E-24,  # yocto
+    "z": 1E-21,  # zepto
+    "a": 1E-18,  # atto
+    "f": 1E-15,  # femto
+    "p": 1E-12,  # pico
+    "n": 1E-9,   # nano
+    "u": 1E-6,   # micro
+    "µ": 1E-6,   # micro
+    "m": 1E-3,   # milli
+    "": 1,       # base unit
+    "k": 1E3,    # kilo
+    "M": 1E6,    # mega
+    "G": 1E9,    # giga
+    "T": 1E12,   # tera
+    "P": 1E15,   # peta
+    "E": 1E18,   # exa
+    "Z": 1E21,   # zetta
+    "Y": 1E24    # yotta
+}
+
+# converted without NumPy, which costs more than the conversion for a single value
+_SCALARS = (int, float, np.number)
+
+# logarithmic power units and their offset from dBW
+LOG_POWER_UNITS = {
+    "dBm": 30,
+    "dBW": 0,
+}
+
+
+@lru_cache(maxsize=None)
+def parse_unit(unit: str) -> tuple:
+    """
+    Split a unit into the factor of its prefix and its base unit, e.g.
+    "ms" -> (1E-3, "s"). A single letter is always a base unit, e.g. "m".
+    """
+    if len(unit) > 1 and unit[0] in SI_PREFIXES:
+        return SI_PREFIXES[unit[0]], unit[1:]
+    return 1, unit
+
+
+@lru_cache(maxsize=None)
+def si_factors(unit_from: str, unit_to: str) -> tuple:
+    """The prefix factors of two units with the same base unit."""
+    factor_from, base_from = parse_unit(unit_from)
+    factor_to, base_to = parse_unit(unit_to)
 
-def si_convert(value: float, unit_from: str, unit_to: str) -> float:
-    """Convert between SI units with prefixes (e.g., ns, ms, nm)"""
-    si_prefixes = {
-        "y": 1E-24,  # yocto
-        "z": 1E-21,  # zepto
-        "a": 1E-18,  # atto
-        "f": 1E-15,  # femto
-        "p": 1E-12,  # pico
-        "n": 1E-9,   # nano
-        "u": 1E-6,   # micro
-        "m": 1E-3,   # milli
-        "": 1,       # base unit
-        "k": 1E3,    # kilo
-        "M": 1E6,    # mega
-        "G": 1E9,    # giga
-        "T": 1E12,   # tera
-        "P": 1E15,   # peta
-        "E": 1E18,   # exa
-        "Z": 1E21,   # zetta
-        "Y": 1E24    # yotta
-    }
-    
-    # Split prefix and base unit (e.g., "ms" -> "m" and "s")
-    prefix_from = unit_from[0] if len(unit_from) > 1 else ""
-    prefix_to = unit_to[0] if len(unit_to) > 1 else ""
-    
-    # Get base unit (e.g., "s" or "m")
-    base_from = unit_from[1:] if len(unit_from) > 1 else unit_from
-    base_to = unit_to[1:] if len(unit_to) > 1 else unit_to
-    
     # Verify same base unit
     if base_from != base_to:
         raise ValueError(f"Cannot convert between different base units: {base_from} and {base_to}")
-        
-    return value * si_prefixes[prefix_from] / si_prefixes[prefix_to]
+    return factor_from, factor_to
 
 
-def power_convert(value: float, unit_from: str, unit_to: str) -> float:
+def si_convert(value, unit_from: str, unit_to: str):
+    """Convert between SI units with prefixes (e.g., ns, ms, nm), of a value or a whole array"""
+    factor_from, factor_to = si_factors(unit_from, unit_to)
+    if isinstance(value, _SCALARS):
+        return value * factor_from / factor_to
+    return np.asarray(value, dtype=float) * (factor_from / factor_to)
+
+
+@lru_cache(maxsize=None)
+def power_unit(unit: str) -> tuple:
+    """
+    Whether a power unit is logarithmic, and its offset from dBW for a logarithmic
+    unit or the factor of its prefix otherwise, e.g. "dBm" -> (True, 30).
+    """
+    if unit in LOG_POWER_UNITS:
+        return True, LOG_POWER_UNITS[unit]
+    factor, base = parse_unit(unit)
+    if base != "W":
+        raise ValueError(f"Not a power unit: {unit}")
+    return False, factor
+
+
+def _log10(watts: float) -> float:
+    # no power is -inf dB, a negative reading (e.g. noise around zero) is NaN
+    if watts > 0:
+        return math.log10(watts)
+    return -math.inf if watts == 0 else math.nan
+
+
+def power_convert(value, unit_from: str, unit_to: str):
     """
-    Convert between power units (W, mW, uW, etc. and dBm)
-    
+    Convert between power units (W, mW, uW, etc. and dBm), of a value or a whole array
+
     Examples:
         power_convert(1, "W", "dBm")    # 30.0 dBm
         power_convert(1, "mW", "dBm")   # 0.0 dBm
         power_convert(0, "dBm", "mW")   # 1.0 mW
         power_convert(0, "dBm", "W")    # 0.001 W
+        power_convert(0, "W", "dBm")    # -inf dBm
+        power_convert(np.array([1E-3, 1E-6]), "W", "dBm")    # [0.0, -30.0] dBm
     """
-    si_prefixes = {
-        "n": 1E-9,   # nano
-        "u": 1E-6,   # micro
-        "m": 1E-3,   # milli
-        "": 1,       # base unit
-        "k": 1E3,    # kilo
-        "M": 1E6,    # mega
-        "G": 1E9     # giga
-    }
-    
-    # Handle watts with SI prefixes
-    if unit_from != "dBm":
-        prefix = unit_from[0] if len(unit_from) > 1 else ""
-        watts = value * si_prefixes[prefix]
-    else:
-        # Convert from dBm to W
-        watts = 10 ** ((value - 30) / 10)
-        
-    # Convert to target unit
-    if unit_to == "dBm":
-        return 10 * math.log10(watts) + 30
-    else:
-        # Handle SI prefix for watts
-        prefix = unit_to[0] if len(unit_to) > 1 else ""
-        return watts / si_prefixes[prefix]
\ No newline at end of file
+    log_from, from_ = power_unit(unit_from)
+    log_to, to = power_unit(unit_to)
+    if isinstance(value, _SCALARS):
+        watts = 10 ** ((value - from_) / 10) if log_from else value * from_
+        return 10 * _log10(watts) + to if log_to else watts / to
+
+    value = np.asarray(value, dtype=float)
+    watts = 10 ** ((value - from_) / 10) if log_from else value * from_
+    if not log_to:
+        return watts / to
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 10 * np.log10(watts) + to